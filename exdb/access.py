@@ -0,0 +1,136 @@
+"""
+Maintenance of the materialized ExperienceAccess index.
+
+Only the parts of the permission rules that depend on stored relations (author,
+planners, next approver, approvals, status and the approver's hall staff role)
+are materialized. Rules that depend on the current time, like an approved event
+having already started, are applied at query time on the experience columns.
+"""
+import threading
+from django.apps import apps as global_apps
+from django.db import transaction
+from exdb.models import EXDBUser
+
+# Experiences and users in the middle of a cascading delete. Signals fired by the
+# cascade must not recreate access rows pointing at them.
+_deleting = threading.local()
+
+
+def deleting(model_name):
+    if not hasattr(_deleting, model_name):
+        setattr(_deleting, model_name, set())
+    return getattr(_deleting, model_name)
+
+
+def compute_grants(status, author_pk, next_approver_pk, planner_pks, hallstaff_approver_pks):
+    """
+    Return a dictionary of (user_pk, capability) -> unrestricted for one experience.
+
+    Edit access granted through a hall staff member's approval is unrestricted,
+    all other edit access ends once an approved event has started.
+    """
+    grants = {}
+
+    def grant(user_pks, capability, unrestricted=False):
+        for user_pk in user_pks:
+            key = (user_pk, capability)
+            grants[key] = grants.get(key, False) or unrestricted
+
+    participants = {author_pk}
+    if status != 'dr':
+        participants |= planner_pks
+
+    grant(participants, 'view')
+    if status == 'pe' and next_approver_pk is not None:
+        grant([next_approver_pk], 'view')
+        grant([next_approver_pk], 'approve')
+    if status == 'ad':
+        grant(hallstaff_approver_pks, 'view')
+        grant({author_pk} | planner_pks | hallstaff_approver_pks, 'evaluate')
+
+    if status not in ('ca', 'co'):
+        grant(participants, 'edit')
+    # Hall staff may edit anything they approved that is not somebody else's draft
+    grant([pk for pk in hallstaff_approver_pks if pk in participants or status != 'dr'], 'edit', unrestricted=True)
+
+    return grants
+
+
+def refresh_experience_access(experience_pks, apps=global_apps):
+    """
+    Recompute the ExperienceAccess rows of the given experiences. The rows are
+    replaced in a single transaction holding a lock on the experiences, so
+    concurrent refreshes of an experience run one after the other and its
+    users never see it without access rows.
+    """
+    Experience = apps.get_model('exdb', 'Experience')
+    ExperienceAccess = apps.get_model('exdb', 'ExperienceAccess')
+    ExperienceApproval = apps.get_model('exdb', 'ExperienceApproval')
+    User = apps.get_model('exdb', 'EXDBUser')
+
+    experience_pks = set(experience_pks)
+    if not experience_pks:
+        return 0
+
+    with transaction.atomic(using=ExperienceAccess.objects.db):
+        # Locked in pk order, so refreshes of overlapping experiences can not deadlock
+        experiences = list(Experience.objects.select_for_update().filter(pk__in=experience_pks).order_by(
+            'pk').values_list('pk', 'status', 'author_id', 'next_approver_id'))
+
+        planners = {}
+        for experience_pk, user_pk in Experience.planners.through.objects.filter(
+                experience_id__in=experience_pks).values_list('experience_id', 'exdbuser_id'):
+            planners.setdefault(experience_pk, set()).add(user_pk)
+
+        approvers = {}
+        for experience_pk, user_pk in ExperienceApproval.objects.filter(
+                experience_id__in=experience_pks).values_list('experience_id', 'approver_id'):
+            approvers.setdefault(experience_pk, set()).add(user_pk)
+
+        all_approvers = set().union(*approvers.values()) if approvers else set()
+        hallstaff_pks = set(User.objects.filter(
+            pk__in=all_approvers, groups__name__icontains=EXDBUser.ROLE_GROUP_PATTERNS['hallstaff']
+        ).values_list('pk', flat=True))
+
+        deleting_users = deleting('user')
+        rows = []
+        for pk, status, author_pk, next_approver_pk in experiences:
+            if pk in deleting('experience'):
+                continue
+            grants = compute_grants(
+                status, author_pk, next_approver_pk,
+                planners.get(pk, set()),
+                approvers.get(pk, set()) & hallstaff_pks,
+            )
+            for (user_pk, capability), unrestricted in grants.items():
+                if user_pk in deleting_users:
+                    continue
+                rows.append(ExperienceAccess(
+                    experience_id=pk, user_id=user_pk, capability=capability, unrestricted=unrestricted))
+
+        ExperienceAccess.objects.filter(experience_id__in=experience_pks).delete()
+        ExperienceAccess.objects.bulk_create(rows)
+    return len(rows)
+
+
+def refresh_user_access(user_pks, apps=global_apps):
+    """
+    Recompute the rows that depend on the role of the given users, which are the
+    rows of every experience they approved.
+    """
+    ExperienceApproval = apps.get_model('exdb', 'ExperienceApproval')
+    return refresh_experience_access(
+        ExperienceApproval.objects.filter(approver_id__in=user_pks).values_list('experience_id', flat=True),
+        apps=apps,
+    )
+
+
+def rebuild_access(chunk_size=500, apps=global_apps):
+    """Recompute the whole index, one chunk of experiences at a time"""
+    Experience = apps.get_model('exdb', 'Experience')
+
+    pks = list(Experience.objects.order_by('pk').values_list('pk', flat=True))
+    total = 0
+    for i in range(0, len(pks), chunk_size):
+        total += refresh_experience_access(pks[i:i + chunk_size], apps=apps)
+    return total
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ExdbConfig(AppConfig):
     name = 'exdb'
+
+    def ready(self):
+        import exdb.signals  # pylint: disable=unused-import
@@ -0,0 +1,106 @@
+"""
+Semester archives. A zip holding everything recorded about the experiences of
+a semester, one file per table: experiences, requirements and completion as
+csv, comments and approvals as newline delimited JSON. Every table is read with
+iterator() one chunk at a time, which uses server side cursors where the
+database has them, and the zip is compressed as it is read, so an archive of
+any size is written with flat memory and starts downloading right away.
+"""
+import csv
+import json
+import zipfile
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from exdb.completion import CampusCompletion
+from exdb.exports import EXPERIENCE_KEYS, Echo, iter_rows, iter_csv, label_expression
+from exdb.models import Experience, ExperienceComment, ExperienceApproval, Requirement
+from exdb.xlsx import StreamOutput
+
+# Lines of a file compressed before the output stream is drained
+LINES_PER_FLUSH = 100
+
+REQUIREMENT_COLUMNS = [
+    ('id', 'id'),
+    ('start_datetime', 'start_datetime'),
+    ('end_datetime', 'end_datetime'),
+    ('affiliation', 'affiliation__name'),
+    ('subtype', 'subtype__name'),
+    ('total_needed', 'total_needed'),
+    ('description', 'description'),
+]
+
+
+def get_filename(semester):
+    return 'semester-%s.zip' % semester.start_datetime.strftime('%Y-%m-%d')
+
+
+def iter_ndjson(queryset):
+    """Yield a line of JSON per row of a values() queryset"""
+    for row in queryset.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_values_csv(columns, queryset):
+    """Yield the lines of a csv of queryset, with a column per (header, lookup) of columns"""
+    writer = csv.writer(Echo())
+    yield writer.writerow([header for header, _lookup in columns])
+    rows = queryset.values_list(*[lookup for _header, lookup in columns])
+    for row in rows.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+        yield writer.writerow(row)
+
+
+def get_experiences(semester, user=None):
+    """
+    The experiences of semester, the same ones its completion counts. Drafts are
+    only seen by their author, so those of anybody but user are left out, all of
+    them without a user.
+    """
+    experiences = Experience.objects.filter(semester=semester)
+    if user is None:
+        return experiences.exclude(status='dr')
+    return experiences.exclude(~Q(author=user), status='dr')
+
+
+def get_files(semester, user=None):
+    """(name, lines) of every file of the archive of semester, the lines being read lazily"""
+    experiences = get_experiences(semester, user)
+    keys = ['id'] + EXPERIENCE_KEYS
+    comments = ExperienceComment.objects.filter(experience__in=experiences.values('pk')).annotate(
+        author_name=label_expression(get_user_model(), 'author__')).order_by('pk').values(
+        'id', 'experience_id', 'author_id', 'author_name', 'timestamp', 'message')
+    approvals = ExperienceApproval.objects.filter(experience__in=experiences.values('pk')).annotate(
+        approver_name=label_expression(get_user_model(), 'approver__')).order_by('pk').values(
+        'id', 'experience_id', 'approver_id', 'approver_name', 'timestamp')
+    requirements = Requirement.objects.filter(semester=semester).order_by('pk')
+
+    def completion():
+        # Holds one cell per section and requirement, which does not grow with the years archived
+        writer = csv.writer(Echo())
+        for row in CampusCompletion(semester).get_csv_rows():
+            yield writer.writerow(row)
+
+    return [
+        ('experiences.csv', iter_csv(keys, iter_rows(experiences, keys))),
+        ('comments.ndjson', iter_ndjson(comments)),
+        ('approvals.ndjson', iter_ndjson(approvals)),
+        ('requirements.csv', iter_values_csv(REQUIREMENT_COLUMNS, requirements)),
+        ('completion.csv', completion()),
+    ]
+
+
+def iter_archive(semester, user=None):
+    """Yield the bytes of the zip archive of semester, as seen by user, as they are compressed"""
+    output = StreamOutput()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, lines in get_files(semester, user):
+            # force_zip64 as the size of a file is not known before it is written
+            with archive.open(name, 'w', force_zip64=True) as entry:
+                for number, line in enumerate(lines, 1):
+                    entry.write(line.encode())
+                    if number % LINES_PER_FLUSH == 0:
+                        yield output.drain()
+            yield output.drain()
+    yield output.drain()
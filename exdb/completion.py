@@ -0,0 +1,367 @@
+"""
+Computes how far each Section is toward completing the Requirements of its
+Affiliation. Every completed experience counts toward at most one requirement:
+the first one, in start order, whose window contains the experience's start.
+"""
+from bisect import bisect_left, bisect_right
+from collections import namedtuple, OrderedDict
+from django.db import transaction
+from django.utils.timezone import now
+
+from exdb.models import Experience, Requirement, Semester, Section, CompletionSummary
+
+
+def assign_to_requirements(requirements, experiences):
+    """
+    Split experiences between requirements of a single subtype.
+
+    requirements must be sorted by start_datetime, experiences must be a list
+    of (start_datetime, experience) sorted by start_datetime. Returns a list of
+    experience lists parallel to requirements.
+    """
+    starts = [start for start, _ in experiences]
+    # next_free[i] leads to the first experience at or after i that has not been
+    # assigned yet, so every experience is only ever skipped over once
+    next_free = list(range(len(experiences) + 1))
+
+    def find(i):
+        root = i
+        while next_free[root] != root:
+            root = next_free[root]
+        while next_free[i] != root:
+            next_free[i], i = root, next_free[i]
+        return root
+
+    assigned = []
+    for requirement in requirements:
+        end = bisect_right(starts, requirement.end_datetime)
+        matched = []
+        i = find(bisect_left(starts, requirement.start_datetime))
+        while i < end:
+            matched.append(experiences[i][1])
+            next_free[i] = i + 1
+            i = find(i + 1)
+        assigned.append(matched)
+    return assigned
+
+
+def get_requirement_dicts(sections, semester):
+    """Return {affiliation_pk: {subtype: [requirement, ...]}} for the affiliations of sections"""
+    current_time = now()
+    requirements = Requirement.objects.filter(
+        semester=semester,
+        affiliation__in={section.affiliation_id for section in sections},
+    ).order_by('start_datetime', 'pk').select_related('subtype')
+
+    requirement_dicts = {}
+    for requirement in requirements:
+        requirement.current = requirement.start_datetime < current_time < requirement.end_datetime
+        requirement_dict = requirement_dicts.setdefault(requirement.affiliation_id, {})
+        requirement_dict.setdefault(requirement.subtype, []).append(requirement)
+    return requirement_dicts
+
+
+def cache_requirements(sections, semester):
+    """
+    Compute the completion of every given section for the semester in three
+    queries. Sets section.requirement_dict ({subtype: [requirement, ...]}) and
+    section.requirements ({requirement.pk: (experiences, total_needed, needed)}).
+    """
+    sections = list(sections)
+    requirement_dicts = get_requirement_dicts(sections, semester)
+
+    recognitions = Experience.recognition.through.objects.filter(
+        section__in=sections,
+        experience__status='co',
+        experience__semester=semester,
+    ).select_related('experience')
+
+    experiences_by_section = {}
+    experiences = {}
+    for recognition in recognitions:
+        experiences_by_section.setdefault(recognition.section_id, []).append(recognition.experience)
+        experiences[recognition.experience_id] = recognition.experience
+
+    subtypes_by_experience = {}
+    for experience_pk, subtype_pk in Experience.subtypes.through.objects.filter(
+            experience_id__in=list(experiences)).values_list('experience_id', 'subtype_id'):
+        subtypes_by_experience.setdefault(experience_pk, []).append(subtype_pk)
+
+    for section in sections:
+        section.requirement_dict = requirement_dicts.get(section.affiliation_id, {})
+        section.requirements = {}
+
+        grouped_by_subtype = {}
+        for experience in experiences_by_section.get(section.pk, []):
+            for subtype_pk in subtypes_by_experience.get(experience.pk, []):
+                grouped_by_subtype.setdefault(subtype_pk, []).append((experience.start_datetime, experience))
+
+        for subtype, subtype_requirements in section.requirement_dict.items():
+            candidates = sorted(grouped_by_subtype.get(subtype.pk, []), key=lambda pair: pair[0])
+            for requirement, matched in zip(subtype_requirements,
+                                            assign_to_requirements(subtype_requirements, candidates)):
+                needed = max(0, requirement.total_needed - len(matched))
+                section.requirements[requirement.pk] = (matched, requirement.total_needed, needed)
+
+    return sections
+
+
+def compute_summaries(sections, semester):
+    """Return unsaved CompletionSummary rows of every requirement of sections for the semester"""
+    rows = []
+    for section in cache_requirements(sections, semester):
+        for requirement_pk, (experiences, _, needed) in section.requirements.items():
+            rows.append(CompletionSummary(
+                section_id=section.pk,
+                requirement_id=requirement_pk,
+                count=len(experiences),
+                needed=needed,
+                experience_ids=','.join(str(e.pk) for e in experiences),
+            ))
+    return rows
+
+
+def refresh_summaries(sections, semesters=None):
+    """
+    Recompute and store the CompletionSummary rows of sections, for the given
+    semesters or for every semester with requirements for their affiliations.
+    The rows are replaced in a single transaction holding a lock on the
+    sections, so concurrent refreshes of a section run one after the other.
+    """
+    sections = list(sections)
+    if not sections:
+        return
+    if semesters is None:
+        semesters = Semester.objects.filter(
+            requirement__affiliation__in={section.affiliation_id for section in sections}).distinct()
+
+    with transaction.atomic(using=CompletionSummary.objects.db):
+        # Locked in pk order, so refreshes of overlapping sections can not deadlock
+        list(Section.objects.select_for_update().filter(pk__in=[section.pk for section in sections]).order_by(
+            'pk').values_list('pk', flat=True))
+        for semester in semesters:
+            rows = compute_summaries(sections, semester)
+            CompletionSummary.objects.filter(section__in=sections, requirement__semester=semester).delete()
+            # Summaries filled in by a concurrent read of a board are as good as these
+            CompletionSummary.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+def refresh_experience_summaries(experience_pk, section_pks, semester_pks):
+    """
+    Recompute the summaries an experience may have counted toward, given the
+    sections recognizing it and the semesters it belonged to.
+    """
+    semester_pks = {pk for pk in semester_pks if pk is not None}
+    if section_pks and semester_pks:
+        refresh_summaries(Section.objects.filter(pk__in=set(section_pks)), Semester.objects.filter(pk__in=semester_pks))
+
+
+def load_summaries(sections, semester, with_experiences=False):
+    """
+    Read the persisted completion of every given section for the semester,
+    computing and storing any summary that is missing. Sets the same
+    attributes as cache_requirements. Unless with_experiences is set, the
+    experience list of each requirement only holds pks.
+    """
+    sections = list(sections)
+    requirement_dicts = get_requirement_dicts(sections, semester)
+
+    def fetch(sections):
+        return {
+            (summary.section_id, summary.requirement_id): summary
+            for summary in CompletionSummary.objects.filter(section__in=sections, requirement__semester=semester)
+        }
+
+    summaries = fetch(sections)
+    missing = [
+        section for section in sections
+        if any((section.pk, requirement.pk) not in summaries
+               for requirements in requirement_dicts.get(section.affiliation_id, {}).values()
+               for requirement in requirements)
+    ]
+    if missing:
+        # Only the missing rows are written, and ignoring those another request wrote in the
+        # meantime, so boards opened at the same time do not fail on the unique constraint
+        rows = compute_summaries([Section(pk=s.pk, affiliation_id=s.affiliation_id) for s in missing], semester)
+        CompletionSummary.objects.bulk_create(
+            [row for row in rows if (row.section_id, row.requirement_id) not in summaries], ignore_conflicts=True)
+        summaries.update(fetch(missing))
+
+    experiences = {}
+    if with_experiences:
+        experiences = Experience.objects.in_bulk(
+            {pk for summary in summaries.values() for pk in summary.get_experience_ids()})
+
+    for section in sections:
+        section.requirement_dict = requirement_dicts.get(section.affiliation_id, {})
+        section.requirements = {}
+        for requirements in section.requirement_dict.values():
+            for requirement in requirements:
+                summary = summaries[(section.pk, requirement.pk)]
+                counted = summary.get_experience_ids()
+                if with_experiences:
+                    counted = [experiences[pk] for pk in counted if pk in experiences]
+                section.requirements[requirement.pk] = (counted, requirement.total_needed, summary.needed)
+
+    return sections
+
+
+CompletionCell = namedtuple('CompletionCell', ['requirement', 'experiences', 'count', 'total', 'needed', 'shade'])
+
+
+class CompletionRow(object):
+
+    def __init__(self, section, cells, groups):
+        self.section = section
+        self.cells = cells
+        # [(subtype, [cell, ...]), ...] in the order of the columns
+        self.groups = groups
+
+
+class CompletionMatrix(object):
+    """
+    The completion of sections laid out as a dense grid of cells, one row per
+    section and one column per requirement in (subtype, start) order. Built
+    from sections prepared by cache_requirements or load_summaries.
+    """
+
+    def __init__(self, sections, requirement_dict):
+        self.requirement_dict = requirement_dict
+        self.columns = [
+            (subtype, requirement)
+            for subtype, requirements in requirement_dict.items()
+            for requirement in requirements
+        ]
+        self.rows = [self._build_row(section) for section in sections]
+
+    @staticmethod
+    def get_shade(count, total):
+        if count < 1:
+            return 'none'
+        if count < total:
+            return 'partial'
+        return 'full'
+
+    def _build_row(self, section):
+        cells = []
+        groups = []
+        for subtype, requirements in self.requirement_dict.items():
+            group = []
+            for requirement in requirements:
+                experiences, total, needed = section.requirements.get(
+                    requirement.pk, ([], requirement.total_needed, requirement.total_needed))
+                cell = CompletionCell(requirement, experiences, len(experiences), total, needed,
+                                      self.get_shade(len(experiences), total))
+                group.append(cell)
+                cells.append(cell)
+            groups.append((subtype, group))
+        return CompletionRow(section, cells, groups)
+
+    def get_csv_rows(self):
+        """Yield the header and one row per section, each cell written as 'count/total'"""
+        yield ['Section'] + ['%s: %s' % (subtype, requirement) for subtype, requirement in self.columns]
+        for row in self.rows:
+            yield [str(row.section)] + ['%d/%d' % (cell.count, cell.total) for cell in row.cells]
+
+    def to_dict(self):
+        return {
+            'columns': [{
+                'pk': requirement.pk,
+                'subtype': str(subtype),
+                'requirement': str(requirement),
+                'total': requirement.total_needed,
+            } for subtype, requirement in self.columns],
+            'rows': [{
+                'pk': row.section.pk,
+                'section': str(row.section),
+                'cells': [{
+                    'count': cell.count,
+                    'total': cell.total,
+                    'needed': cell.needed,
+                    'shade': cell.shade,
+                } for cell in row.cells],
+            } for row in self.rows],
+        }
+
+
+class CompletionRollup(object):
+    """Totals of a group of cells, where a cell never counts for more than its requirement needs"""
+
+    def __init__(self, label):
+        self.label = label
+        self.cells = 0
+        self.full = 0
+        self.count = 0
+        self.total = 0
+
+    def add(self, cell):
+        self.cells += 1
+        self.full += cell.shade == 'full'
+        self.count += min(cell.count, cell.total)
+        self.total += cell.total
+
+    @property
+    def percent(self):
+        return 100 * self.count // self.total if self.total else 100
+
+    def to_dict(self):
+        return {
+            'label': str(self.label),
+            'cells': self.cells,
+            'full': self.full,
+            'count': self.count,
+            'total': self.total,
+            'percent': self.percent,
+        }
+
+
+class CampusCompletion(object):
+    """
+    The completion of every section of every affiliation for a semester,
+    loaded in a single batched pass. Holds a CompletionMatrix per affiliation
+    along with rollups per affiliation and per subtype.
+    """
+
+    def __init__(self, semester, sections=None):
+        if sections is None:
+            sections = Section.objects.select_related('affiliation').order_by('affiliation__name', 'order')
+        sections = load_summaries(sections, semester)
+
+        by_affiliation = OrderedDict()
+        for section in sections:
+            by_affiliation.setdefault(section.affiliation, []).append(section)
+
+        self.semester = semester
+        self.matrices = []
+        self.affiliation_rollups = []
+        subtype_rollups = {}
+        for affiliation, affiliation_sections in by_affiliation.items():
+            matrix = CompletionMatrix(affiliation_sections, affiliation_sections[0].requirement_dict)
+            rollup = CompletionRollup(affiliation)
+            for row in matrix.rows:
+                for subtype, cells in row.groups:
+                    subtype_rollup = subtype_rollups.setdefault(subtype.pk, CompletionRollup(subtype))
+                    for cell in cells:
+                        rollup.add(cell)
+                        subtype_rollup.add(cell)
+            self.matrices.append((affiliation, matrix))
+            self.affiliation_rollups.append(rollup)
+        self.subtype_rollups = sorted(subtype_rollups.values(), key=lambda rollup: str(rollup.label))
+
+    def get_csv_rows(self):
+        """Yield the header and one row per (section, requirement) cell"""
+        yield ['Affiliation', 'Section', 'Subtype', 'Requirement', 'Completed', 'Required']
+        for affiliation, matrix in self.matrices:
+            for row in matrix.rows:
+                for (subtype, requirement), cell in zip(matrix.columns, row.cells):
+                    yield [str(affiliation), str(row.section), str(subtype), str(requirement), cell.count, cell.total]
+
+    def to_dict(self):
+        return {
+            'semester': str(self.semester),
+            'affiliations': [
+                dict(matrix.to_dict(), pk=affiliation.pk, name=str(affiliation), rollup=rollup.to_dict())
+                for (affiliation, matrix), rollup in zip(self.matrices, self.affiliation_rollups)
+            ],
+            'subtypes': [rollup.to_dict() for rollup in self.subtype_rollups],
+        }
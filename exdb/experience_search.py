@@ -0,0 +1,110 @@
+"""
+The experience search described by the query string of the search page: its
+terms, qualifiers, facets and fuzzy mode. It only needs the query parameters
+and the user searching, so the search views and the background exports run it
+the same way.
+"""
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from exdb.models import Experience
+from exdb import search, search_cache, facets, qualifiers, exports
+
+
+class InvalidSearch(ValueError):
+    pass
+
+
+class ExperienceSearch(object):
+    """
+    The search of params run by user. Raises ValueError for invalid facets. An
+    invalid query is not an error, it sets search_error and matches nothing.
+    """
+
+    def __init__(self, params, user):
+        self.params = params
+        self.user = user
+        self.selected_facets = facets.parse_facets(params)
+        self.fuzzy = False
+        self.search_error = None
+        try:
+            self.tokens, self.qualifiers = qualifiers.parse_query(params.get('search', ''))
+        except ValueError as e:
+            self.search_error = str(e)
+            self.tokens, self.qualifiers = [], []
+        self.matched = None
+
+    def visible(self, queryset):
+        queryset = qualifiers.filter_qualifiers(queryset.exclude(status='ca'), self.qualifiers)
+        queryset = facets.filter_facets(queryset, self.selected_facets)
+        # get rid of a users drafts for everyone else
+        return queryset.exclude(~Q(author=self.user), status='dr')
+
+    def cached_matches(self):
+        """
+        The experiences matching the tokens and qualifiers through the search
+        result cache, or None when there are too many of them to be worth caching.
+        """
+        tokens = self.tokens
+
+        def compute():
+            queryset = Experience.objects.filter(pk__in=search.matching(tokens)) if tokens else Experience.objects.all()
+            rows = list(qualifiers.filter_qualifiers(queryset.exclude(status='ca'), self.qualifiers).values_list(
+                'pk', 'status', 'author_id')[:settings.SEARCH_CACHE_MAX_RESULTS + 1])
+            if len(rows) > settings.SEARCH_CACHE_MAX_RESULTS:
+                return None
+            return search_cache.SearchResults(
+                public=[pk for pk, status, _author in rows if status != 'dr'],
+                drafts=[(pk, author) for pk, status, author in rows if status == 'dr'],
+            )
+
+        results = search_cache.get_results(search_cache.normalize(tokens, self.qualifiers), compute)
+        if results is None:
+            return None
+        # Merge in the drafts of the user, which nobody else sees
+        own_drafts = [pk for pk, author in results.drafts if author == self.user.pk]
+        return facets.filter_facets(Experience.objects.filter(pk__in=results.public + own_drafts),
+                                    self.selected_facets)
+
+    def run(self):
+        """Set matched to the matching experiences and return them annotated with their score"""
+        tokens = self.tokens
+        if not tokens and not self.qualifiers:
+            self.matched = Experience.objects.none()
+            return search.rank(self.matched, tokens, timezone.now())
+
+        self.matched = self.cached_matches()
+        if self.matched is None:
+            # Every token has to be contained in the search document of the experience
+            matched = Experience.objects.filter(pk__in=search.matching(tokens)) if tokens else Experience.objects.all()
+            self.matched = self.visible(matched)
+        ranked = search.rank(self.matched, tokens, timezone.now())
+
+        # Close matches of misspelled terms, only on request as they are looser and slower
+        if tokens and self.params.get('fuzzy') == '1':
+            fuzzy = search.fuzzy(self.visible(Experience.objects.all()), tokens, timezone.now(),
+                                 settings.FUZZY_SEARCH_THRESHOLD, settings.FUZZY_SEARCH_TIME_BUDGET)
+            if fuzzy is not None:
+                self.fuzzy = True
+                self.matched = ranked = fuzzy
+
+        return ranked
+
+
+def get_experiences(params, user):
+    """
+    The results of the search in params, narrowed by the column filters of the
+    results table, as exported. Raises InvalidSearch when there is no search or
+    it is invalid.
+    """
+    if not params.get('search', '').strip():
+        raise InvalidSearch('Nothing to search for')
+    try:
+        experience_search = ExperienceSearch(params, user)
+    except ValueError as e:
+        raise InvalidSearch(str(e))
+    experience_search.run()
+    if experience_search.search_error:
+        raise InvalidSearch(experience_search.search_error)
+    return exports.filter_columns(experience_search.matched, params)
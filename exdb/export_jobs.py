@@ -0,0 +1,91 @@
+"""
+Background exports. Exporting a whole year of experiences takes longer than a
+request may, so the search page can queue an ExportJob instead, which the
+run_export_jobs command picks up and writes to EXPORT_ROOT one chunk at a time,
+recording its progress as it goes. Finished exports are kept for
+EXPORT_RETENTION_TIMEDELTA, then removed along with their job.
+"""
+import os
+from uuid import uuid4
+from django.conf import settings
+from django.http import QueryDict
+from django.utils.timezone import now
+
+from exdb.models import ExportJob
+from exdb.exports import EXPERIENCE_KEYS, iter_rows, iter_csv
+from exdb.experience_search import InvalidSearch, get_experiences
+
+
+def claim_next():
+    """Mark the oldest queued job as running and return it, or None when there is none"""
+    for pk in ExportJob.objects.filter(status='qu').order_by('created_datetime', 'pk').values_list('pk', flat=True)[:10]:
+        # Another worker may have claimed it in the meantime
+        if ExportJob.objects.filter(pk=pk, status='qu').update(status='ru', started_datetime=now()):
+            return ExportJob.objects.select_related('user').get(pk=pk)
+    return None
+
+
+def run_job(job):
+    """Write the csv of a running job, recording the rows written after every chunk"""
+    os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+    file_name = 'experiences-%d-%s.csv' % (job.pk, uuid4().hex)
+    path = os.path.join(settings.EXPORT_ROOT, file_name)
+    # The file only gets its final name once complete, so it is never downloaded half written
+    partial_path = path + '.part'
+    try:
+        # Run as the user who asked for it, the same way SearchExperienceReport does
+        experiences = get_experiences(QueryDict(job.query), job.user)
+        keys = EXPERIENCE_KEYS
+        ExportJob.objects.filter(pk=job.pk).update(total_rows=experiences.count())
+        rows = -1
+        with open(partial_path, 'w', newline='') as export:
+            for rows, line in enumerate(iter_csv(keys, iter_rows(experiences, keys))):
+                export.write(line)
+                if rows and rows % settings.EXPORT_CHUNK_SIZE == 0:
+                    ExportJob.objects.filter(pk=job.pk).update(rows_written=rows)
+        os.replace(partial_path, path)
+    except Exception as e:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        error = 'Invalid search' if isinstance(e, InvalidSearch) else '%s: %s' % (type(e).__name__, e)
+        ExportJob.objects.filter(pk=job.pk).update(status='fa', finished_datetime=now(), error=error)
+        return False
+    # The header is not a row. The job may have been failed as abandoned in the meantime.
+    if not ExportJob.objects.filter(pk=job.pk, status='ru').update(
+            status='do', finished_datetime=now(), rows_written=rows, file_name=file_name):
+        os.remove(path)
+        return False
+    return True
+
+
+def fail_abandoned():
+    """
+    Fail the jobs running for longer than EXPORT_JOB_TIMEOUT, whose worker
+    most likely died, so they stop counting toward the limit of their user.
+    Returns how many were failed.
+    """
+    return ExportJob.objects.filter(status='ru', started_datetime__lt=now() - settings.EXPORT_JOB_TIMEOUT).update(
+        status='fa', finished_datetime=now(), error='The export was interrupted.')
+
+
+def run_pending():
+    """Run queued jobs until there are none left, returning how many were run"""
+    count = 0
+    job = claim_next()
+    while job is not None:
+        run_job(job)
+        count += 1
+        job = claim_next()
+    return count
+
+
+def cleanup():
+    """Remove the jobs that finished more than EXPORT_RETENTION_TIMEDELTA ago along with their files"""
+    expired = list(ExportJob.objects.filter(
+        status__in=('do', 'fa'), finished_datetime__lt=now() - settings.EXPORT_RETENTION_TIMEDELTA))
+    for job in expired:
+        path = job.get_path()
+        if path and os.path.exists(path):
+            os.remove(path)
+    ExportJob.objects.filter(pk__in=[job.pk for job in expired]).delete()
+    return len(expired)
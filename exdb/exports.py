@@ -0,0 +1,333 @@
+"""
+Streamed exports of experiences. Experiences are read one chunk at a time in
+pk order, with the related objects of each chunk prefetched on their own, so an
+export holds a single chunk in memory however many experiences it covers, and
+its first rows are sent before the following chunks are even queried.
+
+Rows are written with the same values as Experience.convert_to_dict. When
+every field can be computed by the database, an AggregatedRowSerializer reads
+them in a single query, joining the names of many to many relations in SQL.
+Otherwise a RowSerializer writes the experiences of each chunk one by one.
+"""
+import csv
+from collections import OrderedDict
+from operator import attrgetter
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Q, F, Value, CharField, TextField, OuterRef, Subquery, Count, Max
+from django.db.models.functions import Coalesce, Concat, NullIf, Trim
+
+from exdb.models import Experience, Type, Subtype, Section, Keyword, Affiliation
+
+# Models whose str() is their name
+NAMED_MODELS = (Type, Subtype, Section, Keyword, Affiliation)
+
+# Fields of an experience written by exports, in column order
+EXPERIENCE_KEYS = [
+    'name', 'status', 'author', 'planners', 'recognition', 'start_datetime',
+    'end_datetime', 'type', 'subtypes', 'description', 'goals', 'keywords',
+    'audience', 'guest', 'guest_office', 'attendance', 'created_datetime',
+    'next_approver', 'funds', 'conclusion',
+]
+
+# Columns of the search results table whose filters an export applies, by query string parameter.
+# Filters are matched as case insensitive substrings of the column text, like the table does.
+COLUMN_FILTERS = OrderedDict([
+    ('column_name', 'name'),
+    ('column_planners', 'planners'),
+    ('column_type', 'type'),
+    ('column_subtypes', 'subtypes'),
+    ('column_building', 'building'),
+    ('column_keywords', 'keywords'),
+    ('column_status', 'status'),
+])
+
+
+class Echo(object):
+    """A file-like object handing back what is written to it, so csv writers produce strings"""
+
+    def write(self, value):
+        return value
+
+
+def iter_chunks(queryset, chunk_size=None):
+    """
+    Yield the experiences of queryset in pk order, querying chunk_size of them
+    at a time. Every chunk starts after the last pk of the previous one, so
+    chunks cost the same however far into the export they are.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+def filter_columns(queryset, params):
+    """
+    Narrow queryset to the experiences whose search results row passes the
+    column filters in params. Related names are matched through subqueries on
+    the through tables, so experiences are never duplicated.
+    """
+    for param, column in COLUMN_FILTERS.items():
+        text = params.get(param, '').strip()
+        if not text:
+            continue
+        if column == 'name':
+            queryset = queryset.filter(name__icontains=text)
+        elif column == 'type':
+            queryset = queryset.filter(type__name__icontains=text)
+        elif column == 'status':
+            queryset = queryset.filter(status__in=[
+                status for status, label, _slug in Experience.STATUS_TYPES if text.lower() in str(label).lower()])
+        elif column == 'planners':
+            queryset = queryset.filter(pk__in=Experience.planners.through.objects.filter(
+                Q(exdbuser__first_name__icontains=text) | Q(exdbuser__last_name__icontains=text)
+                | Q(exdbuser__email__icontains=text) | Q(exdbuser__username__icontains=text)
+            ).values('experience_id'))
+        elif column == 'subtypes':
+            queryset = queryset.filter(pk__in=Experience.subtypes.through.objects.filter(
+                subtype__name__icontains=text).values('experience_id'))
+        elif column == 'building':
+            queryset = queryset.filter(pk__in=Experience.recognition.through.objects.filter(
+                section__affiliation__name__icontains=text).values('experience_id'))
+        elif column == 'keywords':
+            queryset = queryset.filter(pk__in=Experience.keywords.through.objects.filter(
+                keyword__name__icontains=text).values('experience_id'))
+    return queryset
+
+
+class RowSerializer(object):
+    """
+    Writes experiences as tuples of strings, one per key. The keys are compiled
+    into a plan of one function per field: choices are looked up in a map of
+    their labels, foreign keys are read from select_related and many to many
+    fields are joined from their prefetched objects.
+    """
+
+    def __init__(self, keys, model=Experience):
+        self.keys = tuple(keys)
+        self.select_related = []
+        self.prefetch_related = []
+        self.plan = [self._compile(model._meta.get_field(key)) for key in self.keys]
+
+    def _compile(self, field):
+        if not field.editable:
+            # model_to_dict leaves those out, and csv writes missing values as empty strings
+            return lambda experience: ''
+
+        if field.many_to_many:
+            self.prefetch_related.append(field.name)
+            get_manager = attrgetter(field.name)
+
+            def join(experience):
+                related = get_manager(experience).all()
+                return ', '.join([str(obj) for obj in related]) if related else 'None'
+            return join
+
+        if field.many_to_one:
+            self.select_related.append(field.name)
+            get_object = attrgetter(field.name)
+            return lambda experience: str(get_object(experience))
+
+        get_value = attrgetter(field.attname)
+        if field.choices:
+            labels = {value: str(label) for value, label in field.flatchoices}
+
+            def display(experience):
+                value = get_value(experience)
+                return labels.get(value, value)
+            return display
+
+        def plain(experience):
+            value = get_value(experience)
+            return value if isinstance(value, str) else str(value)
+        return plain
+
+    def prepare(self, queryset):
+        """Fetch the related objects the fields need along with queryset"""
+        return queryset.select_related(*self.select_related).prefetch_related(*self.prefetch_related)
+
+    def serialize(self, experience):
+        return tuple([write(experience) for write in self.plan])
+
+
+def label_expression(model, prefix=''):
+    """
+    An expression computing str() of instances of model in SQL, reached through
+    the prefix lookup. Raises ValueError for models it is not known for.
+    """
+    if model is get_user_model():
+        # get_full_name() or email or username
+        full_name = Trim(Concat(prefix + 'first_name', Value(' '), prefix + 'last_name', output_field=CharField()))
+        return Coalesce(NullIf(full_name, Value('')), NullIf(F(prefix + 'email'), Value('')), F(prefix + 'username'),
+                        output_field=CharField())
+    if model in NAMED_MODELS:
+        return F(prefix + 'name')
+    raise ValueError('No label expression for %s' % model.__name__)
+
+
+class JoinedNames(Subquery):
+    """
+    The values of a single column queryset joined with separator in the order of
+    the queryset, NULL or empty when it has no rows. The queryset is read as a
+    derived table, as aggregates do not take an order on every backend.
+    """
+    template = "(SELECT group_concat(names.label, '%(separator)s') FROM (%(subquery)s) names)"
+
+    def __init__(self, queryset, separator=', ', **extra):
+        super(JoinedNames, self).__init__(
+            queryset, output_field=TextField(), separator=separator.replace("'", "''"), **extra)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        # An ARRAY() constructor keeps the order of its subquery
+        return self.as_sql(compiler, connection, template="ARRAY_TO_STRING(ARRAY(%(subquery)s), '%(separator)s')",
+                           **extra_context)
+
+
+def _plain(value):
+    return value if isinstance(value, str) else str(value)
+
+
+class AggregatedRowSerializer(object):
+    """
+    Reads experiences as tuples of strings, one per key, in a single query.
+    Foreign keys are labelled through joins and many to many fields through
+    correlated subqueries joining the names of the related objects, so the
+    rows only need one pass of conversions: choice values are looked up in a
+    map of their labels and everything else is made a string.
+    Raises ValueError for keys whose values can not be computed by the database.
+    """
+    separator = ', '
+
+    def __init__(self, keys, model=Experience):
+        self.keys = tuple(keys)
+        self.many_fields = OrderedDict()
+        self.annotations = OrderedDict()
+        self.columns = []
+        self.converters = []
+        for key in self.keys:
+            self._compile(model, model._meta.get_field(key))
+
+    def _compile(self, model, field):
+        if not field.editable:
+            self.columns.append('pk')
+            self.converters.append(lambda value: '')
+        elif field.many_to_many:
+            through = getattr(model, field.name).through
+            target = field.m2m_reverse_field_name()
+            related = field.related_model
+            ordering = [
+                ('-%s__%s' % (target, order[1:])) if order.startswith('-') else '%s__%s' % (target, order)
+                for order in related._meta.ordering
+            ] + ['%s__pk' % target]
+            names = through.objects.filter(**{field.m2m_field_name(): OuterRef('pk')}).annotate(
+                label=label_expression(related, target + '__')).order_by(*ordering).values('label')
+            self.many_fields[field.name] = field
+            self._annotate(field.name, JoinedNames(names, self.separator), self.convert_many)
+        elif field.many_to_one:
+            self._annotate(field.name, label_expression(field.related_model, field.name + '__'), self.convert_plain)
+        elif field.choices:
+            labels = {value: str(label) for value, label in field.flatchoices}
+            self.columns.append(field.attname)
+            self.converters.append(lambda value: labels.get(value, value))
+        else:
+            self.columns.append(field.attname)
+            self.converters.append(self.convert_plain)
+
+    def convert_many(self, value):
+        return value or 'None'
+
+    def convert_plain(self, value):
+        return _plain(value)
+
+    def _annotate(self, name, expression, converter):
+        alias = 'export_%s' % name
+        self.annotations[alias] = expression
+        self.columns.append(alias)
+        self.converters.append(converter)
+
+    def rows(self, queryset):
+        converters = self.converters
+        values = queryset.annotate(**self.annotations).order_by('pk').values_list(*self.columns)
+        for row in values.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+            yield tuple([convert(value) for convert, value in zip(converters, row)])
+
+
+class TypedRowSerializer(AggregatedRowSerializer):
+    """
+    Like AggregatedRowSerializer, but keeps the values typed for spreadsheets:
+    datetimes and numbers are left as they are, missing values are None and
+    many to many fields are lists of names.
+    """
+    # Separates names in the database, as names themselves may contain commas
+    separator = '\x1f'
+
+    def convert_many(self, value):
+        return value.split(self.separator) if value else []
+
+    def convert_plain(self, value):
+        return value
+
+    def get_widths(self, queryset):
+        """{field name: most related objects of an experience of queryset}, one query per many to many field"""
+        widths = {}
+        for name, field in self.many_fields.items():
+            through = getattr(Experience, name).through
+            widths[name] = through.objects.filter(
+                **{'%s__in' % field.m2m_field_name(): queryset.order_by().values('pk')}
+            ).values(field.m2m_field_name()).annotate(count=Count('pk')).aggregate(width=Max('count'))['width'] or 1
+        return widths
+
+    def spread(self, queryset):
+        """
+        Return the header and the rows of queryset with one column per name of
+        every many to many field, numbered when an experience has several.
+        """
+        widths = self.get_widths(queryset)
+        header = []
+        for key in self.keys:
+            width = widths.get(key)
+            if width is None:
+                header.append(key)
+            else:
+                header.extend([key] if width == 1 else ['%s %d' % (key, i) for i in range(1, width + 1)])
+
+        def rows():
+            for row in self.rows(queryset):
+                spread = []
+                for key, value in zip(self.keys, row):
+                    if key in widths:
+                        spread.extend(value + [None] * (widths[key] - len(value)))
+                    else:
+                        spread.append(value)
+                yield spread
+        return header, rows()
+
+
+def iter_rows(queryset, keys):
+    """
+    Yield the rows of the experiences of queryset for keys, with a single query
+    when possible and one chunk of experiences at a time otherwise.
+    """
+    try:
+        serializer = AggregatedRowSerializer(keys)
+    except ValueError:
+        serializer = RowSerializer(keys)
+        for experience in iter_chunks(serializer.prepare(queryset)):
+            yield serializer.serialize(experience)
+    else:
+        yield from serializer.rows(queryset)
+
+
+def iter_csv(keys, rows):
+    """Yield the lines of a csv export, the header of keys first"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(keys)
+    for row in rows:
+        yield writer.writerow(row)
@@ -0,0 +1,89 @@
+"""
+Facets of search results. Selecting a facet filters on a foreign key, a status
+or a through table, and the counts of every facet are grouped aggregates over
+the pks of the current results, so no result rows are loaded to compute them.
+"""
+from collections import OrderedDict
+from django.db.models import Count
+from django.utils.translation import gettext_lazy as _
+
+from exdb.models import Experience, Semester
+
+# Facet name -> title, in display order
+FACETS = OrderedDict([
+    ('status', _('Status')),
+    ('type', _('Type')),
+    ('subtype', _('Subtype')),
+    ('affiliation', _('Affiliation')),
+    ('semester', _('Semester')),
+])
+
+
+def parse_facets(params):
+    """Return {facet: value} for the facets selected in params, raising ValueError for invalid values"""
+    statuses = {status for status, _label, _slug in Experience.STATUS_TYPES}
+    selected = OrderedDict()
+    for name in FACETS:
+        value = params.get(name)
+        if not value:
+            continue
+        if name == 'status':
+            if value not in statuses:
+                raise ValueError('Unknown status %r' % value)
+        else:
+            value = int(value)
+        selected[name] = value
+    return selected
+
+
+def filter_facets(queryset, selected):
+    """Narrow queryset to the selected facets with equality filters"""
+    for name, value in selected.items():
+        if name == 'status':
+            queryset = queryset.filter(status=value)
+        elif name == 'type':
+            queryset = queryset.filter(type_id=value)
+        elif name == 'semester':
+            queryset = queryset.filter(semester_id=value)
+        elif name == 'subtype':
+            queryset = queryset.filter(pk__in=Experience.subtypes.through.objects.filter(
+                subtype_id=value).values('experience_id'))
+        elif name == 'affiliation':
+            queryset = queryset.filter(pk__in=Experience.recognition.through.objects.filter(
+                section__affiliation_id=value).values('experience_id'))
+    return queryset
+
+
+def count_facets(queryset):
+    """
+    Return {facet: [(value, label, count), ...]} for the experiences of queryset,
+    with one grouped query per facet.
+    """
+    experiences = queryset.order_by()
+    pks = experiences.values('pk')
+    status_labels = {status: label for status, label, _slug in Experience.STATUS_TYPES}
+    semester_labels = {semester.pk: str(semester) for semester in Semester.get_calendar()}
+
+    def grouped(rows, value_key, label):
+        counts = [(row[value_key], label(row), row['count']) for row in rows if row[value_key] is not None]
+        return sorted(counts, key=lambda count: (-count[2], str(count[1])))
+
+    return OrderedDict([
+        ('status', grouped(
+            experiences.values('status').annotate(count=Count('pk')),
+            'status', lambda row: status_labels[row['status']])),
+        ('type', grouped(
+            experiences.values('type', 'type__name').annotate(count=Count('pk')),
+            'type', lambda row: row['type__name'])),
+        ('subtype', grouped(
+            Experience.subtypes.through.objects.filter(experience_id__in=pks).values(
+                'subtype', 'subtype__name').annotate(count=Count('experience_id', distinct=True)),
+            'subtype', lambda row: row['subtype__name'])),
+        ('affiliation', grouped(
+            Experience.recognition.through.objects.filter(experience_id__in=pks).values(
+                'section__affiliation', 'section__affiliation__name').annotate(count=Count('experience_id', distinct=True)),
+            'section__affiliation', lambda row: row['section__affiliation__name'])),
+        ('semester', grouped(
+            experiences.values('semester').annotate(count=Count('pk')),
+            'semester', lambda row: semester_labels.get(row['semester'], ''))),
+    ])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from exdb.archive import iter_archive, get_filename
+from exdb.models import Semester
+
+
+class Command(BaseCommand):
+    help = 'Writes a zip archive of the experiences, comments, approvals, requirements and completion of a semester'
+
+    def add_arguments(self, parser):
+        parser.add_argument('semester', type=int, help='The pk of the semester to archive.')
+        parser.add_argument('--output',
+                            dest='output',
+                            default=None,
+                            help='The file the archive is written to, semester-<start date>.zip by default.')
+
+    def handle(self, *args, **options):
+        try:
+            semester = Semester.objects.get(pk=options['semester'])
+        except Semester.DoesNotExist:
+            raise CommandError('Semester %d does not exist.' % options['semester'])
+        path = options['output'] or get_filename(semester)
+        with open(path, 'wb') as output:
+            for data in iter_archive(semester):
+                output.write(data)
+        self.stdout.write('Semester archive written to %s.' % path)
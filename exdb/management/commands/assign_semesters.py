@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from exdb.models import Semester
+
+
+class Command(BaseCommand):
+    help = 'Points every experience at the semester it starts in'
+
+    def handle(self, *args, **options):
+        Semester.invalidate_calendar()
+        changed = Semester.assign_experiences()
+        self.stdout.write('%d experience(s) assigned.' % len(changed))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from exdb.access import rebuild_access
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the experience access index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            dest='chunk_size',
+                            default=500,
+                            help='Number of experiences to recompute at once.')
+
+    def handle(self, *args, **options):
+        rows = rebuild_access(chunk_size=options['chunk_size'])
+        self.stdout.write('%d access row(s) written.' % rows)
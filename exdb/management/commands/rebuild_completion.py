@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from exdb.completion import refresh_summaries
+from exdb.models import Section, CompletionSummary
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored completion summaries of every section'
+
+    def handle(self, *args, **options):
+        CompletionSummary.objects.all().delete()
+        refresh_summaries(Section.objects.all())
+        self.stdout.write('%d completion summary row(s) written.' % CompletionSummary.objects.count())
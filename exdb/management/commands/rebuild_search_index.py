@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from exdb.search import rebuild_index, rebuild_words
+from exdb.search_cache import invalidate
+
+
+class Command(BaseCommand):
+    help = 'Rewrites the search document of every experience and the fuzzy search vocabulary'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            dest='chunk_size',
+                            default=500,
+                            help='Number of experiences to rewrite at once.')
+
+    def handle(self, *args, **options):
+        documents = rebuild_index(chunk_size=options['chunk_size'])
+        invalidate()
+        self.stdout.write('%d search document(s) written.' % documents)
+        words = rebuild_words(chunk_size=options['chunk_size'])
+        self.stdout.write('%d search word(s) written.' % words)
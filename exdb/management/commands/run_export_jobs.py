@@ -0,0 +1,41 @@
+import logging
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+from exdb.export_jobs import run_pending, cleanup, fail_abandoned
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued background exports and removes the expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once',
+                            action='store_true',
+                            dest='once',
+                            default=False,
+                            help='Run the queued exports then exit instead of waiting for more.')
+
+    def handle(self, *args, **options):
+        while True:
+            run = 0
+            try:
+                abandoned = fail_abandoned()
+                if abandoned:
+                    self.stdout.write('%d abandoned export job(s) failed.' % abandoned)
+                removed = cleanup()
+                if removed:
+                    self.stdout.write('%d expired export job(s) removed.' % removed)
+                run = run_pending()
+            except DatabaseError:
+                # A lost connection or a failed query should not stop the worker. A job left
+                # running is failed as abandoned once EXPORT_JOB_TIMEOUT passes.
+                logger.exception('Running the export jobs failed')
+                # Reconnect on the next pass if the connection is broken
+                close_old_connections()
+            if options['once']:
+                self.stdout.write('%d export job(s) run.' % run)
+                return
+            time.sleep(settings.EXPORT_WORKER_SLEEP)
@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from django_auth_sgf.backend import SGFBackend
+from exdb.access import refresh_user_access
+from exdb.roles import invalidate_user_roles
 
 
 class Command(BaseCommand):
@@ -35,6 +37,11 @@ class Command(BaseCommand):
         # Disable any accounts that no longer exist on AD
         UserGroupRelationshipModel = get_user_model().groups.through
         UserGroupRelationshipModel.objects.filter(exdbuser__username__in=deactivated_usernames).delete()
+        # Deleting the relationships directly skips the m2m signals
+        deactivated_pks = list(get_user_model().objects.filter(
+            username__in=deactivated_usernames).values_list('pk', flat=True))
+        invalidate_user_roles(deactivated_pks)
+        refresh_user_access(deactivated_pks)
         get_user_model().objects.filter(username__in=deactivated_usernames).update(is_active=False)
 
         return
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_access_index(apps, schema_editor):
+    from exdb.access import rebuild_access
+    rebuild_access(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exdb', '0014_auto_20260731_1751'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExperienceAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('capability', models.CharField(choices=[('view', 'View'), ('edit', 'Edit'), ('approve', 'Approve'), ('evaluate', 'Evaluate')], max_length=8)),
+                ('unrestricted', models.BooleanField(default=False)),
+                ('experience', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access', to='exdb.Experience')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='experience_access', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='experienceaccess',
+            index=models.Index(fields=['user', 'capability', 'experience'], name='exdb_experi_user_id_ff0da9_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='experienceaccess',
+            unique_together={('user', 'experience', 'capability')},
+        ),
+        migrations.RunPython(build_access_index, migrations.RunPython.noop),
+    ]
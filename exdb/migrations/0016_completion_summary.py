@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exdb', '0015_experience_access'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompletionSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('needed', models.PositiveIntegerField(default=0)),
+                ('experience_ids', models.TextField(blank=True)),
+                ('requirement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='exdb.Requirement')),
+                ('section', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='exdb.Section')),
+            ],
+            options={
+                'unique_together': {('section', 'requirement')},
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def assign_semesters(apps, schema_editor):
+    Experience = apps.get_model('exdb', 'Experience')
+    Semester = apps.get_model('exdb', 'Semester')
+    # Later semesters first, so the earliest one wins where semesters overlap
+    for semester in Semester.objects.order_by('-start_datetime', '-pk'):
+        Experience.objects.filter(
+            start_datetime__gte=semester.start_datetime,
+            start_datetime__lte=semester.end_datetime,
+        ).update(semester=semester)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exdb', '0016_completion_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experience',
+            name='semester',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='exdb.Semester'),
+        ),
+        migrations.AddIndex(
+            model_name='experience',
+            index=models.Index(fields=['semester', 'status'], name='exdb_experi_semeste_27b9b0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='experience',
+            index=models.Index(fields=['start_datetime', 'end_datetime'], name='exdb_experi_start_d_19e6f9_idx'),
+        ),
+        migrations.RunPython(assign_semesters, migrations.RunPython.noop),
+    ]
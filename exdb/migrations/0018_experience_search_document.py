@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:56
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_search_index(apps, schema_editor):
+    from exdb.search import create_index, rebuild_index
+    create_index(schema_editor)
+    rebuild_index(apps=apps)
+
+
+def drop_search_index(apps, schema_editor):
+    from exdb.search import drop_index
+    drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exdb', '0017_experience_semester'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExperienceSearchDocument',
+            fields=[
+                ('experience', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='exdb.Experience')),
+                ('body', models.TextField(blank=True)),
+                ('vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:59
+
+from django.db import migrations, models
+
+
+def rebuild_search_index(apps, schema_editor):
+    from exdb.search import create_index, drop_index, rebuild_index
+    # SQLite rebuilds the document table to add a column, which drops the triggers of the index
+    drop_index(schema_editor)
+    create_index(schema_editor)
+    rebuild_index(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exdb', '0018_experience_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiencesearchdocument',
+            name='keywords',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(rebuild_search_index, migrations.RunPython.noop),
+    ]
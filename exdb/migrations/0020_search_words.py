@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-17 21:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_search_words(apps, schema_editor):
+    from exdb.search import create_word_index, rebuild_words
+    create_word_index(schema_editor)
+    rebuild_words(apps=apps)
+
+
+def drop_search_words(apps, schema_editor):
+    from exdb.search import drop_word_index
+    drop_word_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exdb', '0019_search_document_keywords'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchWord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=100, unique=True)),
+                ('trigram_count', models.PositiveSmallIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchWordTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('word', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigrams', to='exdb.SearchWord')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchwordtrigram',
+            index=models.Index(fields=['trigram', 'word'], name='exdb_search_trigram_160092_idx'),
+        ),
+        migrations.RunPython(build_search_words, drop_search_words),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-17 21:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exdb', '0020_search_words'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.TextField()),
+                ('status', models.CharField(choices=[('qu', 'Queued'), ('ru', 'Running'), ('do', 'Done'), ('fa', 'Failed')], default='qu', max_length=2)),
+                ('created_datetime', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_datetime', models.DateTimeField(blank=True, null=True)),
+                ('finished_datetime', models.DateTimeField(blank=True, null=True)),
+                ('total_rows', models.PositiveIntegerField(blank=True, null=True)),
+                ('rows_written', models.PositiveIntegerField(default=0)),
+                ('file_name', models.CharField(blank=True, max_length=200)),
+                ('error', models.TextField(blank=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_datetime', '-pk'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='exportjob',
+            index=models.Index(fields=['status', 'created_datetime'], name='exdb_export_status_3f7ed3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportjob',
+            index=models.Index(fields=['user', 'status'], name='exdb_export_user_id_dfea08_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-17 23:40
+
+from django.db import migrations
+
+
+def create_body_index(apps, schema_editor):
+    from exdb.search import create_body_index
+    create_body_index(schema_editor)
+
+
+def drop_body_index(apps, schema_editor):
+    from exdb.search import drop_body_index
+    drop_body_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exdb', '0021_export_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_body_index, drop_body_index),
+    ]
@@ -1,64 +1,70 @@
+import os
 from importlib import import_module
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Q, Exists, OuterRef, Count
 from django.utils.timezone import now
 from django.conf import settings
+from django.core.cache import cache
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import validate_email
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.auth.models import AbstractUser, UserManager
+from django.contrib.postgres.search import SearchVectorField
 from django.forms.models import model_to_dict
 
 
 class EXDBUser(AbstractUser):
+    # Roles are derived from group membership: a user has a role when the name
+    # of any of their groups contains the role's pattern (case-insensitive).
+    ROLE_GROUP_PATTERNS = {
+        'hallstaff': 'hallstaff',
+    }
+
     affiliation = models.ForeignKey('Affiliation', on_delete=models.CASCADE, null=True, blank=True)
     section = models.ForeignKey('Section', on_delete=models.CASCADE, null=True, blank=True)
 
     class EXDBUserQuerySet(models.QuerySet, UserManager):
 
         def hallstaff(self):
-            return self.filter(groups__name__icontains='hallstaff')
+            return self.filter(groups__name__icontains=EXDBUser.ROLE_GROUP_PATTERNS['hallstaff'])
 
     objects = EXDBUserQuerySet.as_manager()
 
     def approvable_experiences(self):
         if getattr(self, '_approvable_experiences', None) is None:
-            self._approvable_experiences = self.approval_queue.filter(status='pe')
+            self._approvable_experiences = Experience.objects.approvable_by(self)
         return self._approvable_experiences
 
     def editable_experiences(self):
         if getattr(self, '_editable_experiences', None) is None:
-            user_has_editing_privs = Q(author=self) | (Q(planners=self) & ~Q(status='dr'))
-            current_status_allows_edits = ~Q(status__in=('ca', 'co'))
-            event_already_occurred = Q(status='ad') & Q(start_datetime__lte=now())
-            if self.is_hallstaff():
-                # Let the staff do whatever they want to non-drafts and anything they approved (regardless of time)
-                user_has_editing_privs |= ~Q(status='dr')
-                user_is_approver = Q(approval_set__approver=self)
-            else:
-                # Only allow these extra privs for people that are STILL employed as Hall Staff
-                user_is_approver = Q(pk__isnull=True)  # "False" in ORM terms
-            editable_experience = user_has_editing_privs
-            editable_experience &= user_is_approver | (current_status_allows_edits & ~event_already_occurred)
-            self._editable_experiences = Experience.objects.filter(editable_experience).distinct()
+            self._editable_experiences = Experience.objects.editable_by(self)
         return self._editable_experiences
 
     def evaluatable_experiences(self):
         if getattr(self, '_evaluatable_experiences', None) is None:
-            Qs = Q(author=self) | Q(planners=self)
-            if self.is_hallstaff():
-                experience_approvals = ExperienceApproval.objects.filter(
-                    approver=self, experience__status='ad'
-                )
-                Qs |= Q(pk__in=experience_approvals.values('experience'))
-            self._evaluatable_experiences = Experience.objects.filter(
-                Qs, status='ad', end_datetime__lte=now()).distinct()
+            self._evaluatable_experiences = Experience.objects.evaluatable_by(self)
         return self._evaluatable_experiences
 
+    @classmethod
+    def roles_from_group_names(cls, group_names):
+        group_names = [name.lower() for name in group_names]
+        return frozenset(
+            role for role, pattern in cls.ROLE_GROUP_PATTERNS.items()
+            if any(pattern in name for name in group_names)
+        )
+
+    def get_roles(self):
+        """Return the group-derived roles of this user, loading them at most once per instance"""
+        if getattr(self, '_roles', None) is None:
+            if self.pk is None:
+                return frozenset()
+            self._roles = self.roles_from_group_names(self.groups.values_list('name', flat=True))
+        return self._roles
+
     def is_hallstaff(self):
-        return self.__class__.objects.hallstaff().filter(pk=self.pk).exists()
+        return 'hallstaff' in self.get_roles()
 
     def __str__(self):
         return self.get_full_name() or self.email or self.username
@@ -122,35 +128,8 @@ class Section(models.Model):
 
     def cache_requirements(self, semester):
         """Find all relevant Requirements and cache them under self.requirements"""
-        requirements = Requirement.objects.filter(semester=semester, affiliation=self.affiliation).order_by(
-            'start_datetime').select_related('subtype')
-
-        requirement_dict = {}
-        for req in requirements:
-            requirement_dict[req.subtype] = requirement_dict.get(req.subtype, []) + [req]
-
-        self.requirement_dict = requirement_dict
-        self.requirements = {}
-        experiences_grouped_by_subtype = {}
-        for experience in self.experience_set.all():
-            for sub in experience.subtypes.all():
-                experiences_grouped_by_subtype[sub] = experiences_grouped_by_subtype.get(sub, []) + [experience]
-
-        for subtype, requirements in requirement_dict.items():
-            for requirement in requirements:
-                requirement.current = requirement.start_datetime < now() and requirement.end_datetime > now()
-
-                e = []
-                # loop over a copy of the original since we're deleting things from it
-                for experience in list(experiences_grouped_by_subtype.get(subtype, [])):
-                    # The below if statement might need to be reworked
-                    # We might want to check if the end_datetime is within the requirement
-                    # datetime range (ask Travis)
-                    if requirement.start_datetime <= experience.start_datetime <= requirement.end_datetime:
-                        experiences_grouped_by_subtype[subtype].remove(experience)
-                        e.append(experience)
-                needed = max(0, requirement.total_needed - len(e))
-                self.requirements[requirement.pk] = (e, requirement.total_needed, needed)
+        from exdb.completion import cache_requirements
+        cache_requirements([self], semester)
 
     def save(self, *args, **kwargs):
         self.order = self.name.lower()
@@ -263,9 +242,94 @@ class Experience(models.Model):
     # the user evaluates it.
     last_evaluation_email_datetime = models.DateTimeField(null=True, blank=True)
 
+    # The semester the experience starts in, kept in sync on save and when semesters change
+    semester = models.ForeignKey('Semester', on_delete=models.SET_NULL, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['semester', 'status']),
+            models.Index(fields=['start_datetime', 'end_datetime']),
+        ]
+
+    class ExperienceQuerySet(models.QuerySet):
+        """
+        Visibility rules for experiences. Every rule is a correlated EXISTS
+        subquery against the access index or a through table, so the results
+        never contain duplicates and never need DISTINCT.
+        """
+
+        def _filter_exists(self, condition, **subqueries):
+            # Django 2.2 can only filter on EXISTS through an annotation
+            return self.annotate(**subqueries).filter(condition)
+
+        def _access(self, user, capability, **kwargs):
+            return Exists(ExperienceAccess.objects.filter(
+                experience=OuterRef('pk'), user=user, capability=capability, **kwargs))
+
+        def visible_to(self, user, capability='view'):
+            """Experiences the user has the capability for; 'view' means listed on their pages"""
+            name = 'has_%s_access' % capability
+            return self._filter_exists(Q(**{name: True}), **{name: self._access(user, capability)})
+
+        def listed_for(self, user):
+            return self.visible_to(user).exclude(status='ca')
+
+        def approvable_by(self, user):
+            return self.visible_to(user, 'approve')
+
+        def evaluatable_by(self, user):
+            return self.visible_to(user, 'evaluate').filter(end_datetime__lte=now())
+
+        def needing_evaluation_by(self, user):
+            return self.visible_to(user, 'evaluate').filter(end_datetime__lt=now())
+
+        def editable_by(self, user):
+            event_already_occurred = Q(status='ad') & Q(start_datetime__lte=now())
+            # Access granted through an approval is kept regardless of time
+            editable = Q(has_unrestricted_edit_access=True) | (Q(has_edit_access=True) & ~event_already_occurred)
+            if user.is_hallstaff():
+                # Let the staff do whatever they want to non-drafts that can still be edited
+                editable |= ~Q(status__in=('dr', 'ca', 'co')) & ~event_already_occurred
+            return self._filter_exists(
+                editable,
+                has_edit_access=self._access(user, 'edit'),
+                has_unrestricted_edit_access=self._access(user, 'edit', unrestricted=True),
+            )
+
+        def dashboard_counts(self, current_time, until):
+            """
+            Count the experiences of every home page bucket in a single query.
+            Returns a dictionary keyed by status, 'needs_evaluation' and 'upcoming'.
+            """
+            buckets = {status: Q(status=status) for status, _label, _slug in Experience.STATUS_TYPES}
+            buckets['needs_evaluation'] = Q(status='ad', end_datetime__lte=current_time)
+            buckets['upcoming'] = Q(status='ad', start_datetime__gt=current_time, start_datetime__lt=until)
+            counts = self.aggregate(**{
+                'count_%s' % bucket: Count('pk', filter=condition) for bucket, condition in buckets.items()
+            })
+            return {bucket: counts['count_%s' % bucket] for bucket in buckets}
+
+        def upcoming_for(self, user, until):
+            upcoming = self.filter(status='ad', start_datetime__gt=now(), start_datetime__lt=until)
+            visible = Q(has_view_access=True)
+            subqueries = {'has_view_access': self._access(user, 'view')}
+            if user.is_hallstaff() and user.affiliation_id is not None:
+                # Hall staff also see everything recognizing a section of their affiliation
+                visible |= Q(recognizes_affiliation=True)
+                subqueries['recognizes_affiliation'] = Exists(Experience.recognition.through.objects.filter(
+                    experience=OuterRef('pk'), section__affiliation=user.affiliation_id))
+            return upcoming._filter_exists(visible, **subqueries)
+
+    objects = ExperienceQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Queried rather than read from the cached calendar, which may be stale in this process
+        self.semester_id = Semester.get_pk_for_datetime(self.start_datetime)
+        super(Experience, self).save(*args, **kwargs)
+
     def needs_evaluation(self):
         return self.status == 'ad' and self.end_datetime <= now()
 
@@ -278,6 +342,33 @@ class Experience(models.Model):
             return reverse('edit', args=[self.pk])
         return reverse('view_experience', args=[self.pk])
 
+    @classmethod
+    def attach_urls(cls, experiences, user):
+        """
+        Resolve get_url() for many experiences at once and store the result under
+        experience.url. Each permission set is only looked up for the given pks.
+        """
+        experiences = list(experiences)
+        pks = {experience.pk for experience in experiences}
+
+        def pk_set(queryset):
+            return set(queryset.filter(pk__in=pks).values_list('pk', flat=True))
+
+        approvable = pk_set(user.approvable_experiences()) if user.is_hallstaff() else set()
+        evaluatable = pk_set(user.evaluatable_experiences())
+        editable = pk_set(user.editable_experiences())
+
+        for experience in experiences:
+            if experience.pk in approvable:
+                experience.url = reverse('approval', args=[experience.pk])
+            elif experience.pk in evaluatable:
+                experience.url = reverse('conclusion', args=[experience.pk])
+            elif experience.pk in editable:
+                experience.url = reverse('edit', args=[experience.pk])
+            else:
+                experience.url = reverse('view_experience', args=[experience.pk])
+        return experiences
+
     def convert_to_dict(self, keys):
         row = model_to_dict(self, fields=keys)
         for key in row:
@@ -304,6 +395,29 @@ class ExperienceApproval(models.Model):
         ordering = ['timestamp']
 
 
+class ExperienceAccess(models.Model):
+    """
+    A materialized index of what each user can do with an experience, maintained
+    by exdb.access. "view" means the experience is listed on the user's pages.
+    """
+    CAPABILITIES = (
+        ('view', _('View')),
+        ('edit', _('Edit')),
+        ('approve', _('Approve')),
+        ('evaluate', _('Evaluate')),
+    )
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='experience_access')
+    experience = models.ForeignKey(Experience, on_delete=models.CASCADE, related_name='access')
+    capability = models.CharField(max_length=8, choices=CAPABILITIES)
+    # Edit access granted through an approval does not end when the event starts
+    unrestricted = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('user', 'experience', 'capability')
+        indexes = [models.Index(fields=['user', 'capability', 'experience'])]
+
+
 class ExperienceComment(models.Model):
     experience = models.ForeignKey(Experience, on_delete=models.CASCADE, related_name='comment_set')
     message = models.TextField()
@@ -333,16 +447,87 @@ class Semester(models.Model):
     start_datetime = models.DateTimeField()
     end_datetime = models.DateTimeField()
 
+    CALENDAR_CACHE_KEY = 'exdb:semesters:calendar'
+
+    @classmethod
+    def get_calendar(cls):
+        """
+        Return every semester ordered by start. The calendar is cached until a
+        semester is saved or deleted, or for PROCESS_CACHE_TIMEOUT seconds, so
+        resolving semesters for display needs no queries. Anything stored uses
+        get_pk_for_datetime instead.
+        """
+        calendar = cache.get(cls.CALENDAR_CACHE_KEY)
+        if calendar is None:
+            calendar = list(cls.objects.order_by('start_datetime', 'pk').values_list(
+                'pk', 'start_datetime', 'end_datetime'))
+            cache.set(cls.CALENDAR_CACHE_KEY, calendar, settings.PROCESS_CACHE_TIMEOUT)
+        return [cls(pk=pk, start_datetime=start, end_datetime=end) for pk, start, end in calendar]
+
+    @classmethod
+    def invalidate_calendar(cls):
+        cache.delete(cls.CALENDAR_CACHE_KEY)
+
+    @classmethod
+    def get_for_datetime(cls, moment, calendar=None):
+        """Return the first semester containing moment, or None"""
+        if moment is None:
+            return None
+        for semester in cls.get_calendar() if calendar is None else calendar:
+            if semester.start_datetime <= moment <= semester.end_datetime:
+                return semester
+        return None
+
+    @classmethod
+    def get_pk_for_datetime(cls, moment):
+        """Return the pk of the first semester containing moment, or None, read from the database"""
+        if moment is None:
+            return None
+        return cls.objects.filter(start_datetime__lte=moment, end_datetime__gte=moment).order_by(
+            'start_datetime', 'pk').values_list('pk', flat=True).first()
+
     @classmethod
     def get_current(cls):
+        calendar = cls.get_calendar()
         current_time = now()
-        semester = cls.objects.filter(start_datetime__lte=current_time, end_datetime__gte=current_time).first()
-        if semester is None:
-            semester = cls.objects.filter(start_datetime__lte=current_time).order_by('-end_datetime').first()
+        semester = cls.get_for_datetime(current_time, calendar)
         if semester is None:
-            semester = cls.objects.order_by('-start_datetime').first()
+            started = [s for s in calendar if s.start_datetime <= current_time]
+            if started:
+                semester = max(started, key=lambda s: s.end_datetime)
+        if semester is None and calendar:
+            semester = max(calendar, key=lambda s: s.start_datetime)
         return semester
 
+    @classmethod
+    def assign_experiences(cls, experiences=None):
+        """
+        Point experiences at the semester they start in, with one update per
+        semester. Returns {experience pk: (old semester pk, new semester pk)}
+        of the experiences that changed semester.
+        """
+        if experiences is None:
+            experiences = Experience.objects.all()
+        calendar = cls.get_calendar()
+        moves = {}
+
+        def move(queryset, semester_pk):
+            for pk, old_semester_pk in queryset.values_list('pk', 'semester_id'):
+                moves[pk] = (moves.get(pk, (old_semester_pk,))[0], semester_pk)
+            queryset.update(semester_id=semester_pk)
+
+        # Later semesters first, so the earliest one wins where semesters overlap
+        for semester in reversed(calendar):
+            move(experiences.filter(
+                start_datetime__gte=semester.start_datetime,
+                start_datetime__lte=semester.end_datetime,
+            ).exclude(semester_id=semester.pk), semester.pk)
+        outside = Q()
+        for semester in calendar:
+            outside &= ~Q(start_datetime__gte=semester.start_datetime, start_datetime__lte=semester.end_datetime)
+        move(experiences.filter(outside, semester__isnull=False), None)
+        return {pk: semesters for pk, semesters in moves.items() if semesters[0] != semesters[1]}
+
     def __str__(self):
         return str(self.start_datetime.strftime("%B %d, %Y") + " - " + self.end_datetime.strftime("%B %d, %Y"))
 
@@ -359,3 +544,104 @@ class Requirement(models.Model):
     def __str__(self):
         return self.description or '%s - %s' % (self.start_datetime.strftime("%b %d"),
                                                 self.end_datetime.strftime("%b %d"))
+
+
+class CompletionSummary(models.Model):
+    """The persisted completion of a Requirement by a Section, maintained by exdb.completion"""
+    section = models.ForeignKey(Section, on_delete=models.CASCADE)
+    requirement = models.ForeignKey(Requirement, on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+    needed = models.PositiveIntegerField(default=0)
+    # Comma separated pks of the experiences counted toward the requirement
+    experience_ids = models.TextField(blank=True)
+
+    def get_experience_ids(self):
+        return [int(pk) for pk in self.experience_ids.split(',') if pk]
+
+    class Meta:
+        unique_together = ('section', 'requirement')
+
+
+class ExperienceSearchDocument(models.Model):
+    """
+    The searchable text of an experience and everything it relates to, maintained
+    by exdb.search. On SQLite the text is mirrored into an FTS5 table by triggers,
+    on PostgreSQL it is indexed through the vector column.
+    """
+    experience = models.OneToOneField(Experience, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    body = models.TextField(blank=True)
+    # Keyword names again, so that keyword matches can be ranked above the rest
+    keywords = models.TextField(blank=True)
+    vector = SearchVectorField(null=True)
+
+
+class SearchWord(models.Model):
+    """A word of the search documents, which fuzzy search corrects misspelled tokens to"""
+    word = models.CharField(max_length=100, unique=True)
+    trigram_count = models.PositiveSmallIntegerField()
+
+
+class SearchWordTrigram(models.Model):
+    """The trigrams of every SearchWord, only used where pg_trgm is not available"""
+    word = models.ForeignKey(SearchWord, on_delete=models.CASCADE, related_name='trigrams')
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        indexes = [models.Index(fields=['trigram', 'word'])]
+
+
+class ExportJob(models.Model):
+    """
+    An export of search results run in the background by the run_export_jobs
+    command, which writes the csv under EXPORT_ROOT for its user to download.
+    """
+    STATUS_TYPES = (
+        ('qu', _('Queued')),
+        ('ru', _('Running')),
+        ('do', _('Done')),
+        ('fa', _('Failed')),
+    )
+    # Jobs in those statuses count toward the limit of concurrent jobs of their user
+    ACTIVE_STATUSES = ('qu', 'ru')
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='export_jobs')
+    # The query string of the search being exported, as taken by SearchExperienceReport
+    query = models.TextField()
+    status = models.CharField(max_length=2, choices=STATUS_TYPES, default='qu')
+    created_datetime = models.DateTimeField(default=now)
+    started_datetime = models.DateTimeField(null=True, blank=True)
+    finished_datetime = models.DateTimeField(null=True, blank=True)
+    total_rows = models.PositiveIntegerField(null=True, blank=True)
+    rows_written = models.PositiveIntegerField(default=0)
+    # Path of the csv relative to EXPORT_ROOT, set once it is complete
+    file_name = models.CharField(max_length=200, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-created_datetime', '-pk']
+        indexes = [
+            models.Index(fields=['status', 'created_datetime']),
+            models.Index(fields=['user', 'status']),
+        ]
+
+    @classmethod
+    def submit(cls, user, query):
+        """Queue an export for user, raising ValueError when they already have too many running"""
+        with transaction.atomic(using=cls.objects.db):
+            # Locking the user makes concurrent submits count one after the other
+            list(EXDBUser.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+            if cls.objects.filter(user=user, status__in=cls.ACTIVE_STATUSES).count() >= settings.EXPORT_JOB_LIMIT:
+                raise ValueError('You already have %d exports in progress.' % settings.EXPORT_JOB_LIMIT)
+            return cls.objects.create(user=user, query=query)
+
+    @property
+    def percent(self):
+        if not self.total_rows:
+            return 100 if self.status == 'do' else 0
+        return 100 * self.rows_written // self.total_rows
+
+    def get_path(self):
+        return os.path.join(settings.EXPORT_ROOT, self.file_name) if self.file_name else None
+
+    def __str__(self):
+        return 'Export %d (%s)' % (self.pk, self.get_status_display())
@@ -0,0 +1,127 @@
+"""
+Keyset pagination. A page is located by the key of the last row of the previous
+page rather than by an OFFSET, so every page costs the same no matter how deep
+it is, and rows inserted before the cursor do not shift the following pages.
+Keys default to (start_datetime, pk); the last key must be unique.
+"""
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_KEYS = ('start_datetime', 'pk')
+
+
+def encode_cursor(*values):
+    # Datetimes are tagged so that they can be told apart from strings when decoding
+    encoded = [['d', value.isoformat()] if isinstance(value, datetime) else ['v', value] for value in values]
+    return urlsafe_b64encode(json.dumps(encoded, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the key values of a cursor, raising ValueError if it is malformed"""
+    try:
+        encoded = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+        values = []
+        for tag, value in encoded:
+            if tag == 'd':
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError('bad datetime')
+            elif tag != 'v':
+                raise ValueError('unknown tag')
+            values.append(value)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError('Invalid cursor: %s' % e)
+    return tuple(values)
+
+
+def after_key(keys, values, descending=False):
+    """A Q selecting the rows that come after values in (keys) order"""
+    if len(keys) != len(values):
+        raise ValueError('Invalid cursor: expected %d values' % len(keys))
+    lookup = 'lt' if descending else 'gt'
+    after = Q()
+    for i, key in enumerate(keys):
+        condition = Q(**{'%s__%s' % (key, lookup): values[i]})
+        for previous_key, previous_value in zip(keys[:i], values[:i]):
+            condition &= Q(**{previous_key: previous_value})
+        after |= condition
+    return after
+
+
+def _key_field(queryset, key):
+    if key == 'pk':
+        return queryset.model._meta.pk
+    if key in queryset.query.annotations:
+        return queryset.query.annotations[key].output_field
+    return queryset.model._meta.get_field(key)
+
+
+def clean_values(queryset, keys, values):
+    """
+    Convert the values of a cursor to the types of the fields or annotations of
+    queryset named by keys, raising ValueError for values they can not take.
+    Cursors can be edited by hand, so nothing is assumed about what they hold.
+    """
+    if len(keys) != len(values):
+        raise ValueError('Invalid cursor: expected %d values' % len(keys))
+    cleaned = []
+    for key, value in zip(keys, values):
+        if value is None or isinstance(value, (list, dict)):
+            raise ValueError('Invalid cursor: bad value for %s' % key)
+        try:
+            cleaned.append(_key_field(queryset, key).to_python(value))
+        except ValidationError:
+            raise ValueError('Invalid cursor: bad value for %s' % key)
+    return cleaned
+
+
+class KeysetPage(object):
+
+    def __init__(self, object_list, next_cursor, cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def is_first(self):
+        return self.cursor is None
+
+
+def paginate_keyset(queryset, cursor=None, page_size=30, keys=DEFAULT_KEYS, descending=False):
+    """
+    Return the KeysetPage of queryset that follows cursor. Only page_size + 1
+    rows are fetched, the extra row telling whether there is a next page.
+    Keys may name annotations of queryset.
+    """
+    queryset = queryset.order_by(*[('-%s' if descending else '%s') % key for key in keys])
+    if cursor:
+        values = clean_values(queryset, keys, decode_cursor(cursor))
+        try:
+            queryset = queryset.filter(after_key(keys, values, descending))
+        except (TypeError, ValidationError) as e:
+            raise ValueError('Invalid cursor: %s' % e)
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(*[getattr(rows[-1], key) for key in keys])
+    return KeysetPage(rows, next_cursor, cursor)
+
+
+def cached_count(queryset, key, timeout):
+    """Count queryset, reusing the count stored under key for timeout seconds"""
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
@@ -0,0 +1,109 @@
+"""
+Field qualified search terms such as author:smith, type:social or
+after:2026-09-01. A qualifier is resolved to primary keys, a status code or a
+date and compiled to an equality or range filter on an indexed column, instead
+of being matched against the whole search document like the plain terms.
+"""
+import re
+from collections import OrderedDict
+from datetime import datetime, time
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.translation import gettext_lazy as _
+
+from exdb.models import Experience, Type, Subtype, Keyword, Section
+
+QUALIFIERS = OrderedDict([
+    ('author', _('Author')),
+    ('type', _('Type')),
+    ('subtype', _('Subtype')),
+    ('keyword', _('Keyword')),
+    ('section', _('Section')),
+    ('status', _('Status')),
+    ('after', _('Starting on or after')),
+    ('before', _('Starting before')),
+])
+
+QUALIFIER_RE = re.compile(r'(?<!\S)(?P<name>[a-zA-Z]+):(?:"(?P<quoted>[^"]*)"|(?P<value>\S+))')
+
+
+def _parse_status(value):
+    value = value.lower()
+    for status, label, slug in Experience.STATUS_TYPES:
+        if value in (status, slug, str(label).lower()):
+            return status
+    raise ValueError('Unknown status "%s"' % value)
+
+
+def _parse_date(value):
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise ValueError('Invalid date "%s", expected YYYY-MM-DD' % value)
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+def parse_query(text):
+    """
+    Split a search query into (tokens, qualifiers), where qualifiers is a list
+    of (name, value) in query order. Words that look like a qualifier of an
+    unknown name stay plain tokens. Raises ValueError for an invalid status or
+    date.
+    """
+    qualifiers = []
+
+    def extract(match):
+        name = match.group('name').lower()
+        if name not in QUALIFIERS:
+            return match.group(0)
+        value = match.group('quoted') if match.group('quoted') is not None else match.group('value')
+        value = value.strip()
+        if value:
+            if name == 'status':
+                value = _parse_status(value)
+            elif name in ('after', 'before'):
+                value = _parse_date(value)
+            qualifiers.append((name, value))
+        return ' '
+
+    tokens = QUALIFIER_RE.sub(extract, text).split()
+    return tokens, qualifiers
+
+
+def _pks(queryset):
+    return list(queryset.values_list('pk', flat=True))
+
+
+def filter_qualifiers(queryset, qualifiers):
+    """
+    Narrow queryset to the experiences satisfying every qualifier. Names are
+    resolved to primary keys with one query on the small table they belong to,
+    so the experiences are only ever filtered on foreign keys, the status and
+    the start time.
+    """
+    for name, value in qualifiers:
+        if name == 'status':
+            queryset = queryset.filter(status=value)
+        elif name == 'after':
+            queryset = queryset.filter(start_datetime__gte=value)
+        elif name == 'before':
+            queryset = queryset.filter(start_datetime__lt=value)
+        elif name == 'author':
+            queryset = queryset.filter(author_id__in=_pks(get_user_model().objects.filter(
+                Q(username__iexact=value) | Q(last_name__iexact=value) | Q(first_name__iexact=value))))
+        elif name == 'type':
+            queryset = queryset.filter(type_id__in=_pks(Type.objects.filter(name__iexact=value)))
+        elif name == 'subtype':
+            queryset = queryset.filter(pk__in=Experience.subtypes.through.objects.filter(
+                subtype_id__in=_pks(Subtype.objects.filter(name__iexact=value))).values('experience_id'))
+        elif name == 'keyword':
+            queryset = queryset.filter(pk__in=Experience.keywords.through.objects.filter(
+                keyword_id__in=_pks(Keyword.objects.filter(name__iexact=value))).values('experience_id'))
+        elif name == 'section':
+            queryset = queryset.filter(pk__in=Experience.recognition.through.objects.filter(
+                section_id__in=_pks(Section.objects.filter(name__iexact=value))).values('experience_id'))
+    return queryset
@@ -0,0 +1,69 @@
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+
+SESSION_KEY = '_exdb_roles'
+GLOBAL_VERSION_KEY = 'exdb:roles:version'
+USER_VERSION_KEY = 'exdb:roles:version:%s'
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        version = uuid4().hex
+        # add() so that concurrent requests agree on the first version. Versions expire so that
+        # processes not sharing the cache of the one invalidating them eventually see a new version.
+        cache.add(key, version, settings.PROCESS_CACHE_TIMEOUT)
+        version = cache.get(key, version)
+    return version
+
+
+def get_role_version(user_pk):
+    """
+    The version of a user's roles changes whenever that user's group membership
+    changes, or when any group is renamed or deleted.
+    """
+    return '%s:%s' % (_get_version(GLOBAL_VERSION_KEY), _get_version(USER_VERSION_KEY % user_pk))
+
+
+def invalidate_user_roles(user_pks):
+    for pk in user_pks:
+        cache.set(USER_VERSION_KEY % pk, uuid4().hex, settings.PROCESS_CACHE_TIMEOUT)
+
+
+def invalidate_all_roles():
+    cache.set(GLOBAL_VERSION_KEY, uuid4().hex, settings.PROCESS_CACHE_TIMEOUT)
+
+
+def load_session_roles(request):
+    """
+    Attach the roles stored in the session to request.user, refreshing the
+    session copy when the user's role version has changed.
+    """
+    user = request.user
+    version = get_role_version(user.pk)
+    stored = request.session.get(SESSION_KEY)
+    if stored and stored.get('user') == user.pk and stored.get('version') == version:
+        user._roles = frozenset(stored['roles'])
+    else:
+        user._roles = None
+        request.session[SESSION_KEY] = {
+            'user': user.pk,
+            'version': version,
+            'roles': sorted(user.get_roles()),
+        }
+
+
+class RoleCache(object):
+    """
+    This middleware resolves the roles of the logged in user once per session,
+    so that every is_hallstaff() check made while handling a request is free.
+    """
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.user.is_authenticated:
+            load_session_roles(request)
+        return self.get_response(request)
@@ -0,0 +1,410 @@
+"""
+The experience search index.
+
+Every experience has an ExperienceSearchDocument holding the text of the fields
+search looks at, including those of its keywords, sections, planners, author,
+type and subtypes. Documents are rewritten whenever any of those change. A search
+token matches an experience when it is contained in its document, ignoring case.
+
+On SQLite the documents are mirrored by triggers into an FTS5 table using the
+trigram tokenizer, which answers substring queries from the index. On PostgreSQL
+the bodies are indexed by pg_trgm, which answers the same substring queries
+from a GIN index; the tsvector of the documents only matches the whole words of
+fuzzy search. Other backends fall back to scanning the documents.
+
+Fuzzy search corrects every token to the most similar words of the documents,
+by trigram similarity as defined by pg_trgm. The words are kept in SearchWord,
+indexed by pg_trgm on PostgreSQL and through the SearchWordTrigram table
+everywhere else.
+"""
+import re
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from django.apps import apps as global_apps
+from django.db import connections, transaction, DatabaseError, OperationalError
+from django.db.models import Case, When, Value, IntegerField, Count, Q
+from django.contrib.postgres.search import SearchVector, SearchQuery, TrigramSimilarity
+
+from exdb.access import deleting
+
+FTS_TABLE = 'exdb_experiencesearchindex'
+DOCUMENT_TABLE = 'exdb_experiencesearchdocument'
+VECTOR_INDEX = 'exdb_experiencesearchdocument_vector'
+BODY_INDEX = 'exdb_experiencesearchdocument_body_trigram'
+WORD_TABLE = 'exdb_searchword'
+WORD_INDEX = 'exdb_searchword_trigram'
+# The trigram tokenizer can not match anything shorter than this from the index
+TRIGRAM_LENGTH = 3
+
+SQLITE_INDEX_SQL = [
+    "CREATE VIRTUAL TABLE %s USING fts5(body, tokenize='trigram')" % FTS_TABLE,
+    "CREATE TRIGGER %s_insert AFTER INSERT ON %s BEGIN "
+    "INSERT INTO %s(rowid, body) VALUES (new.experience_id, new.body); END" % (FTS_TABLE, DOCUMENT_TABLE, FTS_TABLE),
+    "CREATE TRIGGER %s_delete AFTER DELETE ON %s BEGIN "
+    "DELETE FROM %s WHERE rowid = old.experience_id; END" % (FTS_TABLE, DOCUMENT_TABLE, FTS_TABLE),
+    "CREATE TRIGGER %s_update AFTER UPDATE OF body ON %s BEGIN "
+    "UPDATE %s SET body = new.body WHERE rowid = old.experience_id; END" % (FTS_TABLE, DOCUMENT_TABLE, FTS_TABLE),
+]
+
+# Points a token earns depending on where it matched, every result matched each token somewhere
+NAME_WEIGHT = 5
+KEYWORD_WEIGHT = 3
+TEXT_WEIGHT = 1
+# Points for experiences starting within the given distance of now, checked in order
+RECENCY_BOOSTS = ((timedelta(days=30), 3), (timedelta(days=180), 1))
+
+# Words shorter than this are not corrected by fuzzy search
+FUZZY_MIN_LENGTH = 3
+# Most similar words a token is corrected to
+FUZZY_WORDS_PER_TOKEN = 10
+
+_fts_available = {}
+
+
+def create_index(schema_editor):
+    """Create the backend specific part of the index, used by the migration"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                for sql in SQLITE_INDEX_SQL:
+                    schema_editor.execute(sql)
+        except DatabaseError:
+            # SQLite before 3.34 has no trigram tokenizer, search scans the documents instead
+            pass
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE INDEX %s ON %s USING GIN (vector)' % (VECTOR_INDEX, DOCUMENT_TABLE))
+
+
+def create_word_index(schema_editor):
+    """Index SearchWord with pg_trgm where available, used by the migration"""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute('CREATE INDEX %s ON %s USING GIN (word gin_trgm_ops)' % (WORD_INDEX, WORD_TABLE))
+
+
+def create_body_index(schema_editor):
+    """Index the document bodies with pg_trgm where available, used by the migration"""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute('CREATE INDEX %s ON %s USING GIN (body gin_trgm_ops)' % (BODY_INDEX, DOCUMENT_TABLE))
+
+
+def drop_body_index(schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % BODY_INDEX)
+
+
+def drop_word_index(schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % WORD_INDEX)
+
+
+def drop_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for suffix in ('_insert', '_delete', '_update'):
+            schema_editor.execute('DROP TRIGGER IF EXISTS %s%s' % (FTS_TABLE, suffix))
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % VECTOR_INDEX)
+
+
+def has_fts_table(connection):
+    if connection.alias not in _fts_available:
+        _fts_available[connection.alias] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available[connection.alias]
+
+
+def build_documents(experience_pks, apps=global_apps):
+    """Return {experience_pk: (body, keywords)} for the given experiences"""
+    Experience = apps.get_model('exdb', 'Experience')
+    Section = apps.get_model('exdb', 'Section')
+
+    parts = {}
+    for row in Experience.objects.filter(pk__in=experience_pks).values_list(
+            'pk', 'name', 'description', 'goals', 'guest', 'guest_office', 'conclusion',
+            'type__name', 'author__first_name', 'author__last_name'):
+        parts[row[0]] = list(row[1:])
+
+    def add(pairs):
+        for experience_pk, *values in pairs:
+            if experience_pk in parts:
+                parts[experience_pk].extend(values)
+
+    keywords = {}
+    for experience_pk, name in Experience.keywords.through.objects.filter(
+            experience_id__in=parts).values_list('experience_id', 'keyword__name'):
+        keywords.setdefault(experience_pk, []).append(name)
+        parts[experience_pk].append(name)
+    add(Experience.subtypes.through.objects.filter(
+        experience_id__in=parts).values_list('experience_id', 'subtype__name'))
+    add(Experience.planners.through.objects.filter(
+        experience_id__in=parts).values_list('experience_id', 'exdbuser__first_name', 'exdbuser__last_name'))
+    section_names = dict((pk, (name, affiliation)) for pk, name, affiliation in Section.objects.filter(
+        experience__in=parts).values_list('pk', 'name', 'affiliation__name').distinct())
+    add((experience_pk, ) + section_names[section_pk] for experience_pk, section_pk in
+        Experience.recognition.through.objects.filter(experience_id__in=parts).values_list('experience_id', 'section_id'))
+
+    # Tokens never contain whitespace, so a token can not match across two values
+    return {
+        pk: ('\n'.join(value for value in values if value), '\n'.join(keywords.get(pk, [])))
+        for pk, values in parts.items()
+    }
+
+
+def refresh_documents(experience_pks, apps=global_apps):
+    """Rewrite the search documents of the given experiences"""
+    ExperienceSearchDocument = apps.get_model('exdb', 'ExperienceSearchDocument')
+
+    experience_pks = set(experience_pks) - deleting('experience')
+    if not experience_pks:
+        return 0
+
+    documents = build_documents(experience_pks, apps=apps)
+    ExperienceSearchDocument.objects.filter(experience_id__in=experience_pks).delete()
+    ExperienceSearchDocument.objects.bulk_create(
+        ExperienceSearchDocument(experience_id=pk, body=body, keywords=keywords)
+        for pk, (body, keywords) in documents.items())
+    if connections[ExperienceSearchDocument.objects.db].vendor == 'postgresql':
+        ExperienceSearchDocument.objects.filter(experience_id__in=experience_pks).update(
+            vector=SearchVector('body', config='simple'))
+    add_words([body for body, _keywords in documents.values()], apps=apps)
+    return len(documents)
+
+
+def rebuild_index(chunk_size=500, apps=global_apps):
+    """Rewrite every search document, one chunk of experiences at a time"""
+    Experience = apps.get_model('exdb', 'Experience')
+
+    pks = list(Experience.objects.order_by('pk').values_list('pk', flat=True))
+    total = 0
+    for i in range(0, len(pks), chunk_size):
+        total += refresh_documents(pks[i:i + chunk_size], apps=apps)
+    return total
+
+
+def _escape_like(token):
+    return token.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def matching(tokens, apps=global_apps):
+    """
+    Return a queryset of experience pks, usable as pk__in, selecting the
+    experiences whose documents contain every token.
+    """
+    ExperienceSearchDocument = apps.get_model('exdb', 'ExperienceSearchDocument')
+    connection = connections[ExperienceSearchDocument.objects.db]
+
+    if connection.vendor == 'sqlite' and has_fts_table(connection):
+        conditions = []
+        params = []
+        phrases = ['"%s"' % token.replace('"', '""') for token in tokens if len(token) >= TRIGRAM_LENGTH]
+        if phrases:
+            conditions.append('%s MATCH %%s' % FTS_TABLE)
+            params.append(' AND '.join(phrases))
+        for token in tokens:
+            if len(token) < TRIGRAM_LENGTH:
+                conditions.append("body LIKE %s ESCAPE '\\'")
+                params.append('%%%s%%' % _escape_like(token))
+        # A RawSQL right hand side would be wrapped as IN ((SELECT ...)), which SQLite
+        # reads as a list holding a single scalar subquery
+        return ExperienceSearchDocument.objects.extra(
+            where=['experience_id IN (SELECT rowid FROM %s WHERE %s)' % (FTS_TABLE, ' AND '.join(conditions))],
+            params=params,
+        ).values('experience_id')
+
+    # Served by the trigram index of the bodies on PostgreSQL
+    documents = ExperienceSearchDocument.objects.all()
+    for token in tokens:
+        documents = documents.filter(body__icontains=token)
+    return documents.values('experience_id')
+
+
+def rank(queryset, tokens, current_time):
+    """
+    Annotate queryset with an integer score: NAME_WEIGHT, KEYWORD_WEIGHT or
+    TEXT_WEIGHT per token depending on the best place it matched, plus a
+    recency boost. The score is computed by the database so results can be
+    ordered and paged on it.
+    """
+    score = Value(0, output_field=IntegerField())
+    for token in tokens:
+        score = score + Case(
+            When(name__icontains=token, then=Value(NAME_WEIGHT)),
+            When(search_document__keywords__icontains=token, then=Value(KEYWORD_WEIGHT)),
+            default=Value(TEXT_WEIGHT),
+            output_field=IntegerField(),
+        )
+    return queryset.annotate(score=score + _recency(current_time))
+
+
+def _recency(current_time):
+    recency = [
+        When(start_datetime__gte=current_time - distance, start_datetime__lte=current_time + distance, then=Value(boost))
+        for distance, boost in RECENCY_BOOSTS
+    ]
+    return Case(*recency, default=Value(0), output_field=IntegerField())
+
+
+def trigrams(word):
+    """The trigrams of a word, padded the way pg_trgm pads them"""
+    padded = '  %s ' % word.lower()
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def words_of(text):
+    return {word for word in re.findall(r'\w+', text.lower()) if FUZZY_MIN_LENGTH <= len(word) <= 100}
+
+
+def add_words(texts, chunk_size=500, apps=global_apps):
+    """
+    Add the words of texts to the fuzzy search vocabulary. Words are never
+    removed here, a word no document contains anymore simply matches nothing.
+    """
+    SearchWord = apps.get_model('exdb', 'SearchWord')
+    SearchWordTrigram = apps.get_model('exdb', 'SearchWordTrigram')
+    with_trigram_table = connections[SearchWord.objects.db].vendor != 'postgresql'
+
+    words = sorted(set().union(*[words_of(text) for text in texts])) if texts else []
+    for i in range(0, len(words), chunk_size):
+        chunk = words[i:i + chunk_size]
+        known = set(SearchWord.objects.filter(word__in=chunk).values_list('word', flat=True))
+        new_words = [SearchWord(word=word, trigram_count=len(trigrams(word))) for word in chunk if word not in known]
+        if not new_words:
+            continue
+        # Documents saved at the same time may share new words, the first to insert a word wins
+        SearchWord.objects.bulk_create(new_words, ignore_conflicts=True)
+        if with_trigram_table:
+            # Conflicting rows get no pk back, so the pks are read again. A word whose trigrams were
+            # inserted twice by concurrent saves still counts each of its trigrams once, see similar_words().
+            created = SearchWord.objects.filter(
+                word__in=[word.word for word in new_words], trigrams__isnull=True).values_list('pk', 'word')
+            SearchWordTrigram.objects.bulk_create(
+                SearchWordTrigram(word_id=pk, trigram=trigram) for pk, word in created for trigram in trigrams(word))
+
+
+def rebuild_words(chunk_size=500, apps=global_apps):
+    """Rebuild the fuzzy search vocabulary from the search documents"""
+    SearchWord = apps.get_model('exdb', 'SearchWord')
+    ExperienceSearchDocument = apps.get_model('exdb', 'ExperienceSearchDocument')
+
+    SearchWord.objects.all().delete()
+    pks = list(ExperienceSearchDocument.objects.order_by('pk').values_list('pk', flat=True))
+    for i in range(0, len(pks), chunk_size):
+        add_words(ExperienceSearchDocument.objects.filter(pk__in=pks[i:i + chunk_size]).values_list('body', flat=True),
+                  chunk_size=chunk_size, apps=apps)
+    return SearchWord.objects.count()
+
+
+@contextmanager
+def time_budget(connection, seconds):
+    """
+    Abort the queries run inside the block with an OperationalError once they
+    have taken more than seconds in total.
+    """
+    if connection.vendor == 'sqlite':
+        connection.ensure_connection()
+        deadline = time.monotonic() + seconds
+        # The handler runs every 1000 virtual machine instructions, a non zero result interrupts the query
+        connection.connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 1000)
+        try:
+            yield
+        finally:
+            connection.connection.set_progress_handler(None, 0)
+    elif connection.vendor == 'postgresql':
+        # A cancelled statement aborts the transaction, the savepoint contains it
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL statement_timeout = %d' % max(1, int(seconds * 1000)))
+            yield
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL statement_timeout = DEFAULT')
+    else:
+        yield
+
+
+def similar_words(token, threshold, limit=FUZZY_WORDS_PER_TOKEN, apps=global_apps):
+    """Return up to limit (word, similarity) of the vocabulary, most similar first"""
+    SearchWord = apps.get_model('exdb', 'SearchWord')
+    SearchWordTrigram = apps.get_model('exdb', 'SearchWordTrigram')
+
+    if connections[SearchWord.objects.db].vendor == 'postgresql':
+        return list(SearchWord.objects.annotate(similarity=TrigramSimilarity('word', token)).filter(
+            similarity__gte=threshold).order_by('-similarity', 'word').values_list('word', 'similarity')[:limit])
+
+    token_trigrams = trigrams(token)
+    # similarity = shared / (len(token_trigrams) + trigram_count - shared) can only reach
+    # the threshold for words with a comparable number of trigrams
+    rows = SearchWordTrigram.objects.filter(
+        trigram__in=token_trigrams,
+        word__trigram_count__gte=len(token_trigrams) * threshold,
+        word__trigram_count__lte=len(token_trigrams) / threshold,
+    ).values('word__word', 'word__trigram_count').annotate(shared=Count('trigram', distinct=True))
+    similar = []
+    for row in rows:
+        similarity = row['shared'] / (len(token_trigrams) + row['word__trigram_count'] - row['shared'])
+        if similarity >= threshold:
+            similar.append((row['word__word'], similarity))
+    similar.sort(key=lambda pair: (-pair[1], pair[0]))
+    return similar[:limit]
+
+
+def matching_any(words, apps=global_apps):
+    """Like matching(), selecting the experiences whose documents contain any of the words"""
+    ExperienceSearchDocument = apps.get_model('exdb', 'ExperienceSearchDocument')
+    connection = connections[ExperienceSearchDocument.objects.db]
+
+    if connection.vendor == 'sqlite' and has_fts_table(connection):
+        return ExperienceSearchDocument.objects.extra(
+            where=['experience_id IN (SELECT rowid FROM %s WHERE %s MATCH %%s)' % (FTS_TABLE, FTS_TABLE)],
+            params=[' OR '.join('"%s"' % word.replace('"', '""') for word in words)],
+        ).values('experience_id')
+    if connection.vendor == 'postgresql':
+        query = ' | '.join(re.sub(r'\W', '', word) for word in words)
+        return ExperienceSearchDocument.objects.filter(
+            vector=SearchQuery(query, config='simple', search_type='raw')).values('experience_id')
+    condition = Q()
+    for word in words:
+        condition |= Q(body__icontains=word)
+    return ExperienceSearchDocument.objects.filter(condition).values('experience_id')
+
+
+def fuzzy(queryset, tokens, current_time, threshold, budget):
+    """
+    Narrow queryset to the experiences containing, for every token, one of the
+    words most similar to it, and annotate a score like rank() does: the
+    similarity of the best word per token as a percentage, plus the recency
+    boost. Returns None when a token has no similar word or when looking the
+    words and the matching experiences up takes longer than budget seconds.
+    Only the scoring is left outside the budget, it is computed when the
+    results are read and only over the experiences that matched.
+    """
+    connection = connections[queryset.db]
+    deadline = time.monotonic() + budget
+    corrections = []
+    try:
+        with time_budget(connection, budget):
+            for token in tokens:
+                if time.monotonic() >= deadline:
+                    return None
+                corrections.append(similar_words(token, threshold))
+            if not corrections or not all(corrections):
+                return None
+            matched = queryset
+            for words in corrections:
+                matched = matched.filter(pk__in=matching_any([word for word, _similarity in words]))
+            if time.monotonic() >= deadline:
+                return None
+            pks = list(matched.values_list('pk', flat=True))
+    except OperationalError:
+        return None
+
+    score = Value(0, output_field=IntegerField())
+    for words in corrections:
+        score = score + Case(*[
+            When(search_document__body__icontains=word, then=Value(int(similarity * 100)))
+            for word, similarity in words
+        ], default=Value(0), output_field=IntegerField())
+    return queryset.filter(pk__in=pks).annotate(score=score + _recency(current_time))
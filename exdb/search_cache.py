@@ -0,0 +1,85 @@
+"""
+A per process cache of search results. The same few searches are run over and
+over by many people, and only the drafts in their results depend on who runs
+them, so the pks matching a normalized query are cached once for everybody
+along with the drafts and their authors.
+
+Entries are kept in least recently used order up to SEARCH_CACHE_SIZE. Any
+write to an experience or to its search document bumps a generation token in
+the default cache, which empties the cache of every process sharing it on its
+next search. Processes that do not share it, as with the default LocMemCache,
+drop their entries once they are PROCESS_CACHE_TIMEOUT seconds old.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+GENERATION_KEY = 'exdb:search:generation'
+
+# public holds the pks of the results everybody sees, drafts holds (pk, author pk) pairs
+SearchResults = namedtuple('SearchResults', ['public', 'drafts'])
+
+_lock = threading.Lock()
+_state = {'entries': OrderedDict(), 'generation': None}
+
+
+def normalize(tokens, qualifiers):
+    """The key of a query, results do not depend on the case nor on the order of its terms"""
+    return repr((
+        sorted({token.lower() for token in tokens}),
+        sorted({(name, str(value).lower()) for name, value in qualifiers}),
+    ))
+
+
+def _bump():
+    cache.set(GENERATION_KEY, uuid4().hex, settings.PROCESS_CACHE_TIMEOUT)
+
+
+def invalidate():
+    """
+    Empty the cache of every process. Bumped again once the transaction commits,
+    as another process may have cached what it read before the commit.
+    """
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, uuid4().hex, settings.PROCESS_CACHE_TIMEOUT)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def get_results(key, compute):
+    """
+    Return the SearchResults cached under key, or those returned by compute(),
+    which may return None for results not worth caching.
+    """
+    generation = get_generation()
+    with _lock:
+        if _state['generation'] != generation:
+            _state['entries'].clear()
+            _state['generation'] = generation
+        entry = _state['entries'].get(key)
+        if entry is not None:
+            results, expires = entry
+            if time.monotonic() < expires:
+                _state['entries'].move_to_end(key)
+                return results
+            del _state['entries'][key]
+
+    results = compute()
+    if results is not None:
+        with _lock:
+            # Results computed while the generation changed may already be stale
+            if _state['generation'] == generation:
+                _state['entries'][key] = (results, time.monotonic() + settings.PROCESS_CACHE_TIMEOUT)
+                while len(_state['entries']) > settings.SEARCH_CACHE_SIZE:
+                    _state['entries'].popitem(last=False)
+    return results
@@ -0,0 +1,305 @@
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+from django.db.models import Q
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+
+from exdb import roles, access, completion, search, search_cache, suggest
+from exdb.models import Experience, ExperienceApproval, Requirement, Section, Semester, CompletionSummary, Affiliation, Keyword, Type, Subtype
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # The members of a cleared group are only known before the clear happens
+        instance._cleared_user_pks = set(instance.user_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:
+        if action == 'post_clear':
+            user_pks = getattr(instance, '_cleared_user_pks', set())
+        else:
+            user_pks = pk_set or set()
+    else:
+        user_pks = {instance.pk}
+        instance._roles = None
+    roles.invalidate_user_roles(user_pks)
+    access.refresh_user_access(user_pks)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    instance._deleted_user_pks = set(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, created=False, **kwargs):
+    roles.invalidate_all_roles()
+    if not created:
+        # A renamed or deleted group may change the roles of all its members
+        user_pks = getattr(instance, '_deleted_user_pks', None)
+        if user_pks is None:
+            user_pks = set(instance.user_set.values_list('pk', flat=True))
+        access.refresh_user_access(user_pks)
+
+
+@receiver(pre_delete, sender=Experience)
+def experience_deleting(sender, instance, **kwargs):
+    access.deleting('experience').add(instance.pk)
+
+
+@receiver(post_delete, sender=Experience)
+def experience_deleted(sender, instance, **kwargs):
+    access.deleting('experience').discard(instance.pk)
+
+
+@receiver(pre_delete, sender=get_user_model())
+def user_deleting(sender, instance, **kwargs):
+    access.deleting('user').add(instance.pk)
+
+
+@receiver(post_delete, sender=get_user_model())
+def user_deleted(sender, instance, **kwargs):
+    access.deleting('user').discard(instance.pk)
+
+
+@receiver(post_save, sender=Experience)
+def experience_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        access.refresh_experience_access([instance.pk])
+
+
+@receiver(m2m_changed, sender=Experience.planners.through)
+def experience_planners_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._cleared_experience_pks = set(instance.planner_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        experience_pks = [instance.pk]
+    elif action == 'post_clear':
+        experience_pks = getattr(instance, '_cleared_experience_pks', set())
+    else:
+        experience_pks = pk_set or set()
+    access.refresh_experience_access(experience_pks)
+
+
+@receiver(post_save, sender=ExperienceApproval)
+@receiver(post_delete, sender=ExperienceApproval)
+def experience_approval_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        access.refresh_experience_access([instance.experience_id])
+
+
+@receiver(pre_save, sender=Experience)
+def experience_completion_saving(sender, instance, raw=False, **kwargs):
+    instance._completion_before = None
+    if not raw and instance.pk:
+        instance._completion_before = Experience.objects.filter(pk=instance.pk).values_list(
+            'status', 'semester_id').first()
+
+
+@receiver(post_save, sender=Experience)
+def experience_completion_saved(sender, instance, raw=False, created=False, **kwargs):
+    if raw or created:
+        # A new experience is not recognized by any section yet
+        return
+    semester_pks = set()
+    before = getattr(instance, '_completion_before', None)
+    if before and before[0] == 'co':
+        semester_pks.add(before[1])
+    if instance.status == 'co':
+        semester_pks.add(instance.semester_id)
+    if semester_pks:
+        completion.refresh_experience_summaries(
+            instance.pk, instance.recognition.values_list('pk', flat=True), semester_pks)
+
+
+@receiver(m2m_changed, sender=Experience.recognition.through)
+def experience_recognition_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            completion.refresh_summaries([instance])
+        return
+    if instance.status != 'co':
+        return
+    if action == 'pre_clear':
+        instance._cleared_section_pks = set(instance.recognition.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        completion.refresh_experience_summaries(instance.pk, pk_set or set(), [instance.semester_id])
+    elif action == 'post_clear':
+        completion.refresh_experience_summaries(
+            instance.pk, getattr(instance, '_cleared_section_pks', set()), [instance.semester_id])
+
+
+@receiver(m2m_changed, sender=Experience.subtypes.through)
+def experience_subtypes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # A subtype lost or gained experiences, refresh every section that recognized them
+        if action == 'post_clear':
+            completion.refresh_summaries(Section.objects.all())
+        else:
+            completion.refresh_summaries(Section.objects.filter(
+                experience__pk__in=pk_set or set(), experience__status='co').distinct())
+    elif instance.status == 'co':
+        completion.refresh_experience_summaries(
+            instance.pk, instance.recognition.values_list('pk', flat=True), [instance.semester_id])
+
+
+@receiver(pre_delete, sender=Experience)
+def experience_completion_deleting(sender, instance, **kwargs):
+    instance._completion_section_pks = set()
+    if instance.status == 'co':
+        instance._completion_section_pks = set(instance.recognition.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Experience)
+def experience_completion_deleted(sender, instance, **kwargs):
+    section_pks = getattr(instance, '_completion_section_pks', set())
+    if section_pks:
+        completion.refresh_experience_summaries(instance.pk, section_pks, [instance.semester_id])
+
+
+@receiver(pre_save, sender=Requirement)
+def requirement_saving(sender, instance, raw=False, **kwargs):
+    instance._completion_before = None
+    if not raw and instance.pk:
+        instance._completion_before = Requirement.objects.filter(pk=instance.pk).values_list(
+            'affiliation_id', 'semester_id').first()
+
+
+@receiver(post_save, sender=Requirement)
+@receiver(post_delete, sender=Requirement)
+def requirement_changed(sender, instance, raw=False, **kwargs):
+    """Assignment is first come first served, so every requirement of the semester may change"""
+    if raw:
+        return
+    targets = {(instance.affiliation_id, instance.semester_id)}
+    before = getattr(instance, '_completion_before', None)
+    if before:
+        targets.add(before)
+    for affiliation_pk, semester_pk in targets:
+        completion.refresh_summaries(
+            Section.objects.filter(affiliation_id=affiliation_pk),
+            Semester.objects.filter(pk=semester_pk))
+
+
+@receiver(post_save, sender=Section)
+def section_saved(sender, instance, raw=False, created=False, **kwargs):
+    if not raw and not created:
+        # The section may have moved to another affiliation
+        CompletionSummary.objects.filter(section=instance).delete()
+        completion.refresh_summaries([instance])
+
+
+@receiver(post_save, sender=Semester)
+@receiver(post_delete, sender=Semester)
+def semester_changed(sender, instance, raw=False, **kwargs):
+    Semester.invalidate_calendar()
+    if raw:
+        return
+    moves = Semester.assign_experiences()
+    # Only the semesters completed experiences left or joined, for the sections recognizing them
+    section_pks = set(Experience.recognition.through.objects.filter(
+        experience_id__in=list(moves), experience__status='co').values_list('section_id', flat=True))
+    semester_pks = {pk for semesters in moves.values() for pk in semesters if pk is not None}
+    if section_pks and semester_pks:
+        completion.refresh_summaries(Section.objects.filter(pk__in=section_pks),
+                                     Semester.objects.filter(pk__in=semester_pks))
+
+
+def _refresh_search(experience_pks):
+    """Rewrite the search documents of experiences, dropping the cached results they may be part of"""
+    if search.refresh_documents(experience_pks):
+        search_cache.invalidate()
+
+
+@receiver(post_save, sender=Experience)
+def experience_search_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # The status and author of an experience decide who sees it even when its document is unchanged
+        search.refresh_documents([instance.pk])
+        search_cache.invalidate()
+
+
+@receiver(post_delete, sender=Experience)
+def experience_search_deleted(sender, instance, **kwargs):
+    search_cache.invalidate()
+
+
+# Through model -> name of its foreign key to the related model
+_search_through_fields = {
+    getattr(Experience, field_name).through: Experience._meta.get_field(field_name).m2m_reverse_field_name()
+    for field_name in ('keywords', 'recognition', 'planners', 'subtypes')
+}
+
+
+def experience_search_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _refresh_search([instance.pk])
+        return
+    related_name = _search_through_fields[sender]
+    if action == 'pre_clear':
+        instance._cleared_search_pks = set(sender.objects.filter(
+            **{related_name: instance}).values_list('experience_id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        _refresh_search(pk_set or set())
+    elif action == 'post_clear':
+        _refresh_search(getattr(instance, '_cleared_search_pks', set()))
+
+
+for through in _search_through_fields:
+    m2m_changed.connect(experience_search_m2m_changed, sender=through, dispatch_uid='search_%s' % through.__name__)
+
+
+@receiver(post_save, sender=Keyword)
+@receiver(post_save, sender=Section)
+@receiver(post_save, sender=Affiliation)
+@receiver(post_save, sender=Type)
+@receiver(post_save, sender=Subtype)
+@receiver(post_save, sender=get_user_model())
+def search_related_saved(sender, instance, raw=False, created=False, update_fields=None, **kwargs):
+    """Names shown in search documents changed, rewrite the documents that include them"""
+    if raw or created:
+        return
+    experiences = Experience.objects.all()
+    if sender is Keyword:
+        experiences = experiences.filter(keywords=instance)
+    elif sender is Section:
+        experiences = experiences.filter(recognition=instance)
+    elif sender is Affiliation:
+        experiences = experiences.filter(recognition__affiliation=instance)
+    elif sender is Type:
+        experiences = experiences.filter(type=instance)
+    elif sender is Subtype:
+        experiences = experiences.filter(subtypes=instance)
+    else:
+        # Logging in saves the user too, only names matter here
+        if update_fields is not None and not {'first_name', 'last_name'} & set(update_fields):
+            return
+        experiences = experiences.filter(Q(author=instance) | Q(planners=instance))
+    _refresh_search(set(experiences.values_list('pk', flat=True)))
+
+
+@receiver(post_save, sender=Keyword)
+@receiver(post_delete, sender=Keyword)
+@receiver(post_save, sender=Type)
+@receiver(post_delete, sender=Type)
+@receiver(post_save, sender=Subtype)
+@receiver(post_delete, sender=Subtype)
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Section)
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def suggestion_vocabulary_changed(sender, update_fields=None, **kwargs):
+    if update_fields is not None and not {'name', 'removed', 'first_name', 'last_name', 'is_active'} & set(update_fields):
+        return
+    suggest.invalidate()
@@ -2,4 +2,23 @@
 
 $(document).ready(function () {
     $(document).foundation();
+
+    var pending = null;
+    $('input[data-suggest-url]').on('input', function () {
+        var input = $(this);
+        var query = input.val().split(/\s+/).pop();
+        clearTimeout(pending);
+        if (query.length < 2) {
+            return;
+        }
+        pending = setTimeout(function () {
+            $.getJSON(input.data('suggest-url'), {q: query}, function (data) {
+                var prefix = input.val().slice(0, input.val().length - query.length);
+                var list = $('#' + input.attr('list')).empty();
+                $.each(data.suggestions, function (i, suggestion) {
+                    list.append($('<option>').attr('value', prefix + suggestion.label));
+                });
+            });
+        }, 150);
+    });
 });
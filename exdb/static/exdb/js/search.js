@@ -8,6 +8,24 @@ function get_experiences() {
     return experiences;
 }
 
+// Query string parameters of the column filters an export applies, in column order
+var EXPORT_FILTER_PARAMS = [
+    'column_name', 'column_planners', 'column_type', 'column_subtypes',
+    'column_building', 'column_keywords', 'column_status',
+];
+
+function get_export_url(url) {
+    var params = new URLSearchParams(window.location.search);
+    var filters = $.tablesorter.getFilters($('table#search-results')) || [];
+    params.delete('cursor');
+    EXPORT_FILTER_PARAMS.forEach(function (name, i) {
+        if (filters[i]) {
+            params.set(name, filters[i]);
+        }
+    });
+    return url + '?' + params.toString();
+}
+
 $(document).ready(function () {
     $('#search-results').tablesorter({
         widgets: ["saveSort", "columns", "filter"],
@@ -25,10 +43,16 @@ $(document).ready(function () {
     );
 
 
-    $('button#export').on('click', function () {
+    $('form#background-export').on('submit', function () {
+        // Include the column filters of the table
+        $(this).find('input[name=query]').val(get_export_url('').substring(1));
+    });
+
+    $('button#export, button#export-xlsx').on('click', function () {
         var experiences = get_experiences();
         if (experiences.length) {
-            window.location = $(this).data('url') + "?experiences=" + JSON.stringify(experiences);
+            // The search runs again on the server, exporting every result rather than this page only
+            window.location = get_export_url($(this).data('url')) + (this.id === 'export-xlsx' ? '&format=xlsx' : '');
             $('div#no-experience-warning').toggleClass('hide', true);
         } else {
             $('div#no-experience-warning').toggleClass('hide', false);
@@ -0,0 +1,111 @@
+"""
+In-memory typeahead suggestions for the search box.
+
+Every process keeps a sorted array of (prefix key, rank, label, kind) tuples,
+with one key for every word a label can be found from, so a suggestion lookup
+is a bisect followed by a short scan and never touches the database.
+
+The vocabulary (keywords, types, subtypes, sections and people) is rebuilt as
+soon as any of it changes, which bumps a version token in the default cache.
+Every process sharing that cache rebuilds on its next lookup; processes that do
+not share it, as with the default LocMemCache, rebuild once their token expires
+after PROCESS_CACHE_TIMEOUT seconds. Experience names change far more often, so
+they are only picked up once the index is older than SUGGEST_REFRESH_INTERVAL
+seconds.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+
+from exdb.models import Experience, Keyword, Type, Subtype, Section
+
+VERSION_KEY = 'exdb:suggest:version'
+KINDS = ('keyword', 'type', 'subtype', 'section', 'person', 'experience')
+
+_lock = threading.Lock()
+_state = {'index': None, 'version': None, 'built': 0}
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def _keys(label):
+    """Every suffix of the label that starts a word, so that 'Origami Night' is found from 'ni'"""
+    label = normalize(label)
+    return [label[match.start():] for match in re.finditer(r'\b\w', label)] or [label]
+
+
+class SuggestionIndex(object):
+
+    def __init__(self, entries):
+        """entries is an iterable of (label, kind), kinds earlier in KINDS are suggested first"""
+        rows = set()
+        for label, kind in entries:
+            if label and label.strip():
+                for key in _keys(label):
+                    rows.add((key, KINDS.index(kind), label.strip(), kind))
+        self.rows = sorted(rows)
+        self.keys = [row[0] for row in self.rows]
+
+    def lookup(self, prefix, limit=10, kind=None):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        matches = []
+        seen = set()
+        for i in range(bisect_left(self.keys, prefix), len(self.keys)):
+            if not self.keys[i].startswith(prefix):
+                break
+            _, rank, label, row_kind = self.rows[i]
+            if (kind is None or row_kind == kind) and (label, row_kind) not in seen:
+                seen.add((label, row_kind))
+                matches.append((rank, len(label), label, row_kind))
+        # Shorter labels first within a kind, they are the closest completions
+        return [{'label': label, 'kind': row_kind} for _, _, label, row_kind in sorted(matches)[:limit]]
+
+
+def load_entries():
+    entries = []
+    entries.extend((name, 'keyword') for name in Keyword.valid_objects.values_list('name', flat=True))
+    entries.extend((name, 'type') for name in Type.valid_objects.values_list('name', flat=True))
+    entries.extend((name, 'subtype') for name in Subtype.valid_objects.values_list('name', flat=True))
+    entries.extend((name, 'section') for name in Section.objects.values_list('name', flat=True))
+    entries.extend(('%s %s' % names, 'person') for names in get_user_model().objects.filter(
+        is_active=True).values_list('first_name', 'last_name'))
+    # Only names that search would show to everybody
+    entries.extend((name, 'experience') for name in Experience.objects.exclude(
+        status__in=('dr', 'ca')).values_list('name', flat=True).distinct())
+    return entries
+
+
+def invalidate():
+    """Make the processes sharing the cache rebuild their index on their next lookup"""
+    cache.set(VERSION_KEY, uuid4().hex, settings.PROCESS_CACHE_TIMEOUT)
+
+
+def get_index():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = uuid4().hex
+        cache.add(VERSION_KEY, version, settings.PROCESS_CACHE_TIMEOUT)
+        version = cache.get(VERSION_KEY, version)
+
+    state = _state
+    if (state['index'] is None or state['version'] != version
+            or time.monotonic() - state['built'] > settings.SUGGEST_REFRESH_INTERVAL):
+        with _lock:
+            # Another thread may have rebuilt the index while this one waited
+            if (_state['index'] is None or _state['version'] != version
+                    or time.monotonic() - _state['built'] > settings.SUGGEST_REFRESH_INTERVAL):
+                _state.update(index=SuggestionIndex(load_entries()), version=version, built=time.monotonic())
+    return _state['index']
+
+
+def suggest(prefix, limit=10, kind=None):
+    return get_index().lookup(prefix, limit, kind)
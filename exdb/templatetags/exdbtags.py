@@ -12,8 +12,11 @@ class ExperienceNode(template.Node):
 
     def render(self, context):
         ex = self.experience.resolve(context)
-        user = self.user.resolve(context)
-        return ex.get_url(user)
+        # Views resolve the urls of everything they render up front with Experience.attach_urls
+        url = getattr(ex, 'url', None)
+        if url is None:
+            url = ex.get_url(self.user.resolve(context))
+        return url
 
 
 @register.tag
@@ -15,6 +15,7 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions
 
 from django.test import Client
+from django.core.cache import cache
 from django.test.runner import DiscoverRunner
 from django.utils.translation import gettext as _
 from django.contrib.auth import get_user_model
@@ -379,6 +380,7 @@ class DefaultLiveServerTestCase(StaticLiveServerTestCase):
         self.client = self.SeleniumClient(self.driver, self.live_server_url)
 
     def setUp(self):
+        cache.clear()
         self.get_client_and_driver()
         self.client.force_login()
 
@@ -774,7 +776,8 @@ class ExperienceSearchBrowserTest(DefaultLiveServerTestCase):
         self.client.get(reverse('search') + '?search=Export')
         export_btn = self.driver.find_element(By.ID, 'export')
         export_url = export_btn.get_attribute('data-url')
-        self.driver.execute_script("window.location = arguments[0];", export_url + "?experiences=[]")
+        self.driver.execute_script("window.location = get_export_url(arguments[0]);", export_url)
+        self.assertIn('search=Export', self.driver.current_url)
         self.assertIn(export_url, self.driver.current_url,
                       'Export button should redirect to export URL')
 
@@ -1,6 +1,14 @@
 from django.test import TestCase, Client, override_settings
 from django.utils.timezone import datetime, timedelta, now, make_aware, utc, localtime
 from io import StringIO, BytesIO
+from base64 import urlsafe_b64encode
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from unittest import mock
 from django.urls import reverse
 from django.core import mail
 from django.contrib.auth import get_user_model
@@ -8,15 +16,21 @@ from django.contrib.auth.models import Group
 from django.shortcuts import get_object_or_404
 from django.core.management import call_command
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, IntegrityError, OperationalError
+from django.test.utils import CaptureQueriesContext
 
-from exdb.models import Affiliation, Experience, Type, Subtype, Section, Keyword, ExperienceComment, ExperienceApproval, EmailTask, Semester, Requirement
+from exdb.models import Affiliation, Experience, Type, Subtype, Section, Keyword, ExperienceComment, ExperienceApproval, EmailTask, Semester, Requirement, ExperienceAccess, CompletionSummary, ExperienceSearchDocument, ExportJob
 from exdb.forms import ExperienceSubmitForm
+from exdb.archive import iter_archive
 from exdb.views import SearchExperienceReport
 
 
 class StandardTestCase(TestCase):
 
     def setUp(self):
+        # Cached data like the semester calendar does not roll back with the test database
+        cache.clear()
 
         self.test_date = make_aware(datetime(2015, 1, 1, 16, 1), timezone=utc)
 
@@ -151,6 +165,156 @@ class ModelCoverageTest(StandardTestCase):
         self.assertEqual(e.get_url(self.clients['ra'].user_object), reverse('edit', args=[e.pk]),
                          "The edit url for draft experience set to the past should have been returned")
 
+    def test_attach_urls_matches_get_url(self):
+        user = self.clients['hs'].user_object
+        experiences = [
+            self.create_experience('pe'),
+            self.create_experience('ad', start=(now() - timedelta(days=2)), end=(now() - timedelta(days=1))),
+            self.create_experience('co'),
+            self.create_experience('dr', author=user),
+        ]
+        ExperienceApproval.objects.create(experience=experiences[1], approver=user)
+        for experience in Experience.attach_urls(experiences, user):
+            self.assertEqual(experience.url, experience.get_url(user),
+                             "attach_urls should resolve the same url as get_url")
+
+    def test_attach_urls_query_count(self):
+        user = get_user_model().objects.get(pk=self.clients['hs'].user_object.pk)
+        user.is_hallstaff()
+        experiences = [self.create_experience('pe', start=self.test_date + timedelta(days=i)) for i in range(5)]
+        with self.assertNumQueries(3):
+            Experience.attach_urls(experiences, user)
+
+
+class UserRoleCacheTest(StandardTestCase):
+
+    def test_roles_are_loaded_once_per_instance(self):
+        user = get_user_model().objects.get(pk=self.clients['hs'].user_object.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(user.is_hallstaff())
+            self.assertTrue(user.is_hallstaff())
+
+    def test_instance_roles_invalidated_when_groups_change(self):
+        user = self.clients['hs'].user_object
+        self.assertTrue(user.is_hallstaff())
+        user.groups.remove(self.groups['hs'])
+        self.assertFalse(user.is_hallstaff(), "Removing the hallstaff group should revoke the role")
+
+    def test_session_stores_roles(self):
+        self.clients['hs'].get(reverse('home'))
+        self.assertEqual(self.clients['hs'].session['_exdb_roles']['roles'], ['hallstaff'],
+                         "The user's roles should be cached in the session")
+
+    def test_session_roles_invalidated_when_group_membership_changes(self):
+        self.clients['hs'].get(reverse('home'))
+        self.groups['hs'].user_set.remove(self.clients['hs'].user_object)
+        response = self.clients['hs'].get(reverse('home'))
+        self.assertFalse(response.context['user'].is_hallstaff(),
+                         "Cached session roles should be refreshed after the group membership changes")
+        self.assertEqual(self.clients['hs'].session['_exdb_roles']['roles'], [])
+
+
+@override_settings(PROCESS_CACHE_TIMEOUT=0)
+class ExpiringRoleVersionTest(StandardTestCase):
+
+    def test_session_roles_refreshed_when_version_expires(self):
+        self.clients['hs'].get(reverse('home'))
+        # Changed without the signals, like a change made by a process with its own cache
+        self.clients['hs'].user_object.groups.through.objects.filter(
+            exdbuser=self.clients['hs'].user_object).delete()
+        response = self.clients['hs'].get(reverse('home'))
+        self.assertFalse(response.context['user'].is_hallstaff(),
+                         "Session roles should be refreshed once the role version expires")
+
+
+class ExperienceAccessTest(StandardTestCase):
+
+    def capabilities(self, experience, user):
+        return set(ExperienceAccess.objects.filter(experience=experience, user=user).values_list('capability', flat=True))
+
+    def test_planner_gets_access_when_added(self):
+        e = self.create_experience('ad', author=self.clients['hs'].user_object)
+        e.planners.add(self.clients['ra'].user_object)
+        self.assertEqual(self.capabilities(e, self.clients['ra'].user_object), {'view', 'edit', 'evaluate'},
+                         "Adding a planner should grant them access to the experience")
+
+    def test_planner_does_not_get_access_to_drafts(self):
+        e = self.create_experience('dr', author=self.clients['hs'].user_object)
+        e.planners.add(self.clients['ra'].user_object)
+        self.assertEqual(self.capabilities(e, self.clients['ra'].user_object), set(),
+                         "Planners should not have access to drafts")
+
+    def test_next_approver_loses_approve_access_once_approved(self):
+        e = self.create_experience('pe')
+        self.assertIn('approve', self.capabilities(e, self.clients['hs'].user_object))
+        e.status = 'ad'
+        e.save()
+        self.assertNotIn('approve', self.capabilities(e, self.clients['hs'].user_object),
+                         "The approve capability should be removed when the status changes")
+
+    def test_approval_grants_unrestricted_edit(self):
+        e = self.create_experience('ad')
+        ExperienceApproval.objects.create(experience=e, approver=self.clients['hs'].user_object)
+        self.assertTrue(ExperienceAccess.objects.get(
+            experience=e, user=self.clients['hs'].user_object, capability='edit').unrestricted)
+
+    def test_approver_access_revoked_when_leaving_hallstaff(self):
+        e = self.create_experience('ad')
+        ExperienceApproval.objects.create(experience=e, approver=self.clients['hs'].user_object)
+        self.clients['hs'].user_object.groups.remove(self.groups['hs'])
+        self.assertEqual(self.capabilities(e, self.clients['hs'].user_object), set(),
+                         "Access granted through approvals should only be kept by hall staff")
+
+    def test_rebuild_access_command(self):
+        e = self.create_experience('pe')
+        expected = set(ExperienceAccess.objects.values_list('user', 'experience', 'capability'))
+        ExperienceAccess.objects.all().delete()
+        call_command('rebuild_access', stdout=StringIO())
+        self.assertEqual(set(ExperienceAccess.objects.values_list('user', 'experience', 'capability')), expected,
+                         "The rebuild command should restore the access index")
+        self.assertTrue(ExperienceAccess.objects.filter(experience=e).exists())
+
+    def test_deleting_approved_experience(self):
+        e = self.create_experience('ad')
+        ExperienceApproval.objects.create(experience=e, approver=self.clients['hs'].user_object)
+        e.delete()
+        self.assertFalse(ExperienceAccess.objects.exists(), "Deleting an experience should remove its access rows")
+
+    def test_failed_refresh_keeps_access_rows(self):
+        from exdb.access import refresh_experience_access
+        e = self.create_experience('ad')
+        expected = set(ExperienceAccess.objects.filter(experience=e).values_list('user', 'capability'))
+        with mock.patch.object(ExperienceAccess.objects, 'bulk_create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                refresh_experience_access([e.pk])
+        self.assertEqual(set(ExperienceAccess.objects.filter(experience=e).values_list('user', 'capability')), expected,
+                         "Access rows should only be replaced once the new rows are written")
+
+
+class ExperienceVisibilityTest(StandardTestCase):
+
+    @override_settings(HALLSTAFF_UPCOMING_TIMEDELTA=timedelta(days=7))
+    def test_upcoming_has_no_duplicates_with_several_recognized_sections(self):
+        a = self.create_affiliation()
+        e = self.create_experience('ad', start=now() + timedelta(days=1), end=now() + timedelta(days=2),
+                                   author=self.clients['hs'].user_object)
+        e.recognition.add(self.create_section(affiliation=a), self.create_section(name='Other Section', affiliation=a))
+        self.clients['hs'].user_object.affiliation = a
+        self.clients['hs'].user_object.save()
+        response = self.clients['hs'].get(reverse('upcoming_list'))
+        self.assertEqual(list(response.context['experiences']), [e],
+                         'An experience matching several visibility rules should be listed once')
+
+    def test_editable_has_no_duplicates_with_several_planners(self):
+        e = self.create_experience('pe', start=now() + timedelta(days=1), end=now() + timedelta(days=2))
+        e.planners.add(self.clients['hs'].user_object, self.clients['llc'].user_object)
+        self.assertEqual(list(Experience.objects.editable_by(self.clients['hs'].user_object)), [e])
+
+    def test_listed_for_excludes_cancelled(self):
+        e = self.create_experience('ca')
+        self.assertNotIn(e, Experience.objects.listed_for(self.clients['ra'].user_object))
+        self.assertIn(e, Experience.objects.visible_to(self.clients['ra'].user_object))
+
 
 class ExperienceCreationFormTest(StandardTestCase):
 
@@ -485,6 +649,35 @@ class RAHomeViewTest(StandardTestCase):
         self.assertEqual(len(response.context["experience_dict"]["Upcoming"]),
                          1, "There should be 1 experience in the next month")
 
+    def test_cards_are_limited_and_counted(self):
+        for i in range(5):
+            self.create_experience('pe', start=self.test_date + timedelta(days=i), end=self.test_date + timedelta(days=i + 1))
+        evaluations = [self.create_experience('ad', start=self.test_date + timedelta(days=i), end=self.test_date + timedelta(days=i + 1))
+                       for i in range(4)]
+        response = self.clients['ra'].get(reverse('home'))
+        self.assertEqual(len(response.context['experience_dict']['Pending Approval']), 3)
+        self.assertEqual(response.context['experience_total'], 9)
+        cards = {str(status): (experiences, count) for status, experiences, count in response.context['experience_cards']}
+        self.assertEqual(cards['Pending Approval'][1], 5, 'Cards should carry the count of the whole bucket')
+        self.assertContains(response, 'View All Pending Approval Engagements (5)')
+        self.assertEqual(cards['Needs Evaluation'][0], evaluations[:3])
+        self.assertEqual(cards['Approved'][0], evaluations[3:],
+                         'Approved experiences shown as needing evaluation should not be repeated')
+
+    def test_home_query_count_does_not_grow(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.clients['ra'].get(reverse('home'))
+            return len(queries)
+
+        self.create_experience('pe')
+        # The first request also stores the user's roles in the session
+        count_queries()
+        before = count_queries()
+        for i in range(10):
+            self.create_experience('pe', start=self.test_date + timedelta(days=i), end=self.test_date + timedelta(days=i + 1))
+        self.assertEqual(count_queries(), before)
+
 
 class ExperienceApprovalViewTest(StandardTestCase):
 
@@ -916,6 +1109,284 @@ class ExperienceSearchViewTest(StandardTestCase):
         e, context = self.search_view_test_helper('ca')
         self.assertNotIn(e, context, 'Search should not return cancelled experiences')
 
+    def search(self, query):
+        return list(self.clients['ra'].get(reverse('search'), data={'search': query}).context['experiences'])
+
+    def test_search_matches_related_names(self):
+        e = self.create_experience('pe')
+        e.keywords.add(self.create_keyword(name='Origami'))
+        e.recognition.add(self.create_section(name='Maple Hall'))
+        self.assertEqual(self.search('origami'), [e])
+        self.assertEqual(self.search('plehall'), [], 'A token should not match across words')
+        self.assertEqual(self.search('APL origa'), [e], 'Tokens should match inside words regardless of case')
+        self.assertEqual(self.search('ma'), [e], 'Tokens shorter than a trigram should still match')
+        self.assertEqual(self.search('origami nothing'), [])
+
+    def test_search_matches_inside_words_without_fts_index(self):
+        from exdb import search
+        e = self.create_experience('pe')
+        e.keywords.add(self.create_keyword(name='Origami'))
+        # The path PostgreSQL takes, served there by the trigram index of the bodies
+        with mock.patch.object(search, 'has_fts_table', return_value=False):
+            self.assertEqual(self.search('IGAM'), [e], 'Tokens should match inside words on every backend')
+            self.assertEqual(self.search('origami nothing'), [])
+
+    def test_search_returns_every_match(self):
+        first = self.create_experience('pe')
+        second = self.create_experience('pe')
+        second.pk = None
+        second.name = 'Origami Two'
+        second.save()
+        first.name = 'Origami One'
+        first.save()
+        self.assertEqual(set(self.search('origami')), {first, second})
+
+    def test_search_document_follows_changes(self):
+        e = self.create_experience('pe')
+        keyword = self.create_keyword(name='Origami')
+        e.keywords.add(keyword)
+        keyword.name = 'Kirigami'
+        keyword.save()
+        self.assertEqual(self.search('kirigami'), [e], 'Renaming a keyword should update the documents using it')
+        keyword.keyword_set.clear()
+        self.assertEqual(self.search('kirigami'), [])
+        user = self.clients['ra'].user_object
+        user.last_name = 'Zyzzyva'
+        user.save()
+        self.assertEqual(self.search('zyzzyva'), [e])
+
+    def create_named(self, name, start=None):
+        e = self.create_experience('pe', start=start)
+        e.pk = None
+        e.name = name
+        e.save()
+        e.subtypes.add(self.create_subtype())
+        return e
+
+    def test_search_ranks_name_then_keyword_matches(self):
+        in_text = self.create_named('Plain')
+        in_text.description = 'all about origami'
+        in_text.save()
+        in_keyword = self.create_named('Paper')
+        in_keyword.keywords.add(self.create_keyword(name='Origami'))
+        in_name = self.create_named('Origami Night')
+        self.assertEqual(self.search('origami'), [in_name, in_keyword, in_text])
+
+    def test_search_boosts_recent_experiences(self):
+        old = self.create_named('Origami', start=now() - timedelta(days=400))
+        recent = self.create_named('Origami', start=now() - timedelta(days=2))
+        self.assertEqual(self.search('origami'), [recent, old])
+
+    @override_settings(SEARCH_PAGE_SIZE=2)
+    def test_search_pages(self):
+        created = [self.create_named('Origami %d' % i, start=self.test_date + timedelta(days=i)) for i in range(5)]
+        seen = []
+        response = self.clients['ra'].get(reverse('search'), data={'search': 'origami'})
+        while True:
+            self.assertLessEqual(len(response.context['experiences']), 2)
+            seen.extend(response.context['experiences'])
+            page = response.context['page']
+            if not page.has_next:
+                break
+            response = self.clients['ra'].get(reverse('search'), data={'search': 'origami', 'cursor': page.next_cursor})
+        self.assertEqual(seen, created[::-1], 'Equally scored results should page from the most recent')
+
+    def facet(self, response, title):
+        return {str(option['label']): (option['count'], option['selected'])
+                for facet_title, options in response.context['facets'] if str(facet_title) == title
+                for option in options}
+
+    def test_search_facet_counts(self):
+        pending = self.create_named('Origami One')
+        approved = self.create_named('Origami Two')
+        approved.status = 'ad'
+        approved.save()
+        other_subtype = self.create_subtype(name='Other Subtype')
+        approved.subtypes.add(other_subtype)
+        approved.recognition.add(self.create_section(name='North', affiliation=self.create_affiliation(name='North Campus')))
+        self.create_named('Unrelated')
+        response = self.clients['ra'].get(reverse('search'), data={'search': 'origami'})
+        self.assertEqual(self.facet(response, 'Status'), {'Pending Approval': (1, False), 'Approved': (1, False)})
+        self.assertEqual(self.facet(response, 'Subtype'), {'Test Subtype': (2, False), 'Other Subtype': (1, False)})
+        self.assertEqual(self.facet(response, 'Affiliation'), {'North Campus': (1, False)})
+
+        response = self.clients['ra'].get(reverse('search'), data={'search': 'origami', 'subtype': other_subtype.pk})
+        self.assertEqual(list(response.context['experiences']), [approved])
+        self.assertEqual(self.facet(response, 'Subtype'), {'Test Subtype': (1, False), 'Other Subtype': (1, True)})
+        self.assertEqual(self.facet(response, 'Status'), {'Approved': (1, False)})
+
+    def test_search_facet_filters(self):
+        pending = self.create_named('Origami One')
+        approved = self.create_named('Origami Two')
+        approved.status = 'ad'
+        approved.save()
+        self.assertEqual(self.search('origami'), [approved, pending])
+        response = self.clients['ra'].get(reverse('search'), data={'search': 'origami', 'status': 'pe'})
+        self.assertEqual(list(response.context['experiences']), [pending])
+        response = self.clients['ra'].get(reverse('search'), data={'search': 'origami', 'type': approved.type_id + 1})
+        self.assertEqual(list(response.context['experiences']), [])
+        response = self.clients['ra'].get(reverse('search'), data={'search': 'origami', 'status': 'zz'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_rebuild_search_index_command(self):
+        e = self.create_experience('pe')
+        ExperienceSearchDocument.objects.all().delete()
+        self.assertEqual(self.search('test'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('1 search document(s) written.', out.getvalue())
+        self.assertEqual(self.search('test'), [e])
+
+    def test_search_qualifiers(self):
+        social = self.create_named('Origami Night', start=self.test_date + timedelta(days=30))
+        social.type = self.create_type(name='Social Hour')
+        social.save()
+        social.keywords.add(self.create_keyword(name='Paper'))
+        social.recognition.add(self.create_section(name='Wells House'))
+        other = self.create_named('Origami Practice')
+        other.status = 'ad'
+        other.author = self.clients['hs'].user_object
+        other.save()
+        self.assertEqual(self.search('origami type:"social hour"'), [social])
+        self.assertEqual(self.search('keyword:paper'), [social], 'Qualifiers alone should be a search')
+        self.assertEqual(self.search('section:"wells house"'), [social])
+        self.assertEqual(self.search('origami status:approved'), [other])
+        self.assertEqual(self.search('status:ad author:hs'), [other])
+        self.assertEqual(self.search('origami after:2015-01-15'), [social])
+        self.assertEqual(self.search('origami before:2015-01-15'), [other])
+        self.assertEqual(self.search('type:nothing'), [])
+        self.assertEqual(self.search('subtype:"test subtype" origami'), [social, other])
+
+    def test_search_qualifier_syntax(self):
+        from exdb.qualifiers import parse_query
+        self.assertEqual(parse_query('night type:"Social Hour" status:Completed'),
+                         (['night'], [('type', 'Social Hour'), ('status', 'co')]))
+        self.assertEqual(parse_query('http://example.com color:red'), (['http://example.com', 'color:red'], []),
+                         'Unknown qualifiers should stay plain tokens')
+        response = self.clients['ra'].get(reverse('search'), data={'search': 'after:someday'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Invalid date')
+        self.assertEqual(list(response.context['experiences']), [])
+
+    def test_search_results_are_cached(self):
+        e = self.create_named('Origami Night')
+        self.assertEqual(self.search('Origami  night'), [e])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.search('NIGHT origami'), [e])
+        self.assertFalse([query for query in queries if 'exdb_experiencesearchindex' in query['sql']],
+                         'A normalized query seen before should not be matched again')
+        other = self.create_named('Origami Night Two')
+        self.assertEqual(set(self.search('origami night')), {e, other}, 'Writes should invalidate cached results')
+        other.name = 'Board Games'
+        other.save()
+        self.assertEqual(self.search('origami night'), [e])
+        other.delete()
+        e.keywords.add(self.create_keyword(name='Paper'))
+        self.assertEqual(self.search('paper'), [e])
+
+    def test_cached_results_merge_own_drafts(self):
+        published = self.create_named('Origami Night')
+        draft = self.create_named('Origami Draft')
+        draft.status = 'dr'
+        draft.save()
+        self.assertEqual(set(self.search('origami')), {published, draft})
+        response = self.clients['hs'].get(reverse('search'), data={'search': 'origami'})
+        self.assertEqual(list(response.context['experiences']), [published],
+                         'Drafts of the cached results should only be shown to their author')
+
+    def test_cached_results_expire(self):
+        e = self.create_named('Origami Night')
+        with self.settings(PROCESS_CACHE_TIMEOUT=0):
+            self.assertEqual(self.search('origami'), [e])
+            # Cancelled without the signals, like by a process with its own cache
+            Experience.objects.filter(pk=e.pk).update(status='ca')
+            self.assertEqual(self.search('origami'), [], 'Cached results should expire')
+
+    def test_search_cache_evicts_least_recently_used(self):
+        from exdb import search_cache
+        computed = []
+
+        def compute(key):
+            def compute():
+                computed.append(key)
+                return search_cache.SearchResults([], [])
+            return compute
+
+        with self.settings(SEARCH_CACHE_SIZE=2):
+            for key in ('a', 'b', 'a', 'c', 'a', 'b'):
+                search_cache.get_results(key, compute(key))
+        self.assertEqual(computed, ['a', 'b', 'c', 'b'])
+        with self.settings(SEARCH_CACHE_MAX_RESULTS=0):
+            self.create_named('Origami Night')
+            self.assertEqual(len(self.search('origami')), 1, 'Searches with too many results should not be cached')
+
+    def test_fuzzy_search_corrects_misspellings(self):
+        e = self.create_named('Origami Night')
+        e.recognition.add(self.create_section(name='Wells House'))
+        self.create_named('Board Games')
+        response = self.clients['ra'].get(reverse('search'), data={'search': 'wells hosue'})
+        self.assertFalse(response.context['fuzzy'], 'Fuzzy search should only run on request')
+        self.assertContains(response, 'Search for close matches instead')
+        response = self.clients['ra'].get(reverse('search') + response.context['fuzzy_url'])
+        self.assertTrue(response.context['fuzzy'])
+        self.assertEqual(list(response.context['experiences']), [e])
+        self.assertContains(response, 'Showing close matches')
+        response = self.clients['ra'].get(reverse('search'), data={'search': 'origmai nihgt', 'fuzzy': '1'})
+        self.assertEqual(list(response.context['experiences']), [e])
+
+    def test_fuzzy_search_ranks_closer_words_first(self):
+        exact = self.create_named('Origami Night')
+        close = self.create_named('Origamy Social')
+        self.assertEqual(self.search('origami'), [exact])
+        response = self.clients['ra'].get(reverse('search'), data={'search': 'origami', 'fuzzy': '1'})
+        self.assertTrue(response.context['fuzzy'])
+        self.assertEqual(list(response.context['experiences']), [exact, close],
+                         'Closer words should rank first')
+
+    def test_fuzzy_search_gives_up_after_time_budget(self):
+        self.create_named('Origami Night')
+        with self.settings(FUZZY_SEARCH_TIME_BUDGET=0):
+            response = self.clients['ra'].get(reverse('search'), data={'search': 'origmai', 'fuzzy': '1'})
+        self.assertFalse(response.context['fuzzy'])
+        self.assertEqual(list(response.context['experiences']), [])
+
+    def test_fuzzy_search_budget_covers_matching(self):
+        from exdb import search
+        self.create_named('Origami Night')
+        matching_any = search.matching_any
+
+        def slow(*args, **kwargs):
+            time.sleep(0.2)
+            return matching_any(*args, **kwargs)
+
+        with self.settings(FUZZY_SEARCH_TIME_BUDGET=0.1), mock.patch('exdb.search.matching_any', side_effect=slow):
+            response = self.clients['ra'].get(reverse('search'), data={'search': 'origmai', 'fuzzy': '1'})
+        self.assertFalse(response.context['fuzzy'], 'Matching the corrected words should count toward the budget')
+
+    def test_add_words_tolerates_words_added_meanwhile(self):
+        from exdb.models import SearchWord
+        from exdb.search import add_words, similar_words
+        bulk_create = SearchWord.objects.bulk_create
+
+        def racing(*args, **kwargs):
+            # Another document with the same new word is saved first
+            SearchWord.objects.create(word='origami', trigram_count=8)
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(SearchWord.objects, 'bulk_create', side_effect=racing):
+            add_words(['Origami Night'])
+        self.assertEqual(sorted(SearchWord.objects.values_list('word', flat=True)), ['night', 'origami'])
+        self.assertEqual(similar_words('origami', 0.3)[0], ('origami', 1.0))
+        add_words(['Origami Night'])
+        self.assertEqual(similar_words('origami', 0.3)[0], ('origami', 1.0))
+
+    def test_trigram_similarity(self):
+        from exdb.search import trigrams, similar_words
+        self.assertEqual(trigrams('cat'), {'  c', ' ca', 'cat', 'at '})
+        self.create_named('Origami Night')
+        self.assertEqual(similar_words('origami', 0.3)[0], ('origami', 1.0))
+        self.assertEqual(similar_words('zzzzzz', 0.3), [])
+
 
 class LogoutTest(StandardTestCase):
 
@@ -1067,6 +1538,56 @@ class ListExperienceByStatusViewTest(StandardTestCase):
         self.assertIn(e, response.context['experiences'],
                       'When the status is approved, the view should return experiences the user has approved')
 
+    @override_settings(EXPERIENCE_LIST_PAGE_SIZE=2)
+    def test_keyset_pages(self):
+        # Two experiences share a start, so pages must also be ordered by pk
+        starts = [self.test_date, self.test_date, self.test_date + timedelta(days=1), self.test_date + timedelta(days=2)]
+        created = []
+        for i, start in enumerate(starts):
+            e = self.create_experience('pe', start=start, end=start + timedelta(days=1))
+            if e in created:
+                e.pk = None
+                e.name = 'Another %d' % i
+                e.save()
+                e.subtypes.add(self.create_subtype())
+            created.append(e)
+        url = reverse('status_list', kwargs={'status': 'pending-approval'})
+        seen = []
+        response = self.clients['ra'].get(url)
+        while True:
+            seen.extend(response.context['experiences'])
+            self.assertEqual(response.context['total'], 4)
+            page = response.context['page']
+            if not page.has_next:
+                break
+            response = self.clients['ra'].get(url, {'cursor': page.next_cursor})
+        self.assertEqual(seen, sorted(created, key=lambda e: (e.start_datetime, e.pk)))
+
+    def test_invalid_cursor(self):
+        response = self.clients['ra'].get(reverse('status_list', kwargs={'status': 'pending-approval'}), {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 404, 'A malformed cursor should respond with a 404')
+
+    def test_cursor_of_wrong_types(self):
+        def cursor(values):
+            return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+        response = self.clients['ra'].get(reverse('search'), {
+            'search': 'test', 'cursor': cursor([['v', {'a': 1}], ['v', 'x'], ['v', 1]])})
+        self.assertEqual(response.status_code, 404, 'A cursor holding values of the wrong type should respond with a 404')
+        response = self.clients['ra'].get(reverse('status_list', kwargs={'status': 'pending-approval'}), {
+            'cursor': cursor([['v', 'notadate'], ['v', 1]])})
+        self.assertEqual(response.status_code, 404)
+        response = self.clients['ra'].get(reverse('status_list', kwargs={'status': 'pending-approval'}), {
+            'cursor': cursor([['d', 5], ['v', 1]])})
+        self.assertEqual(response.status_code, 404)
+        response = self.clients['ra'].get(reverse('search'), {
+            'search': 'test', 'cursor': cursor([['s', {'a': 1}], ['s', 'x'], ['s', 1]])})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_round_trip(self):
+        from exdb.pagination import encode_cursor, decode_cursor
+        self.assertEqual(decode_cursor(encode_cursor(self.test_date, 42)), (self.test_date, 42))
+
 
 class SearchExperienceReportTest(StandardTestCase):
 
@@ -1075,7 +1596,7 @@ class SearchExperienceReportTest(StandardTestCase):
         e.planners.add(self.clients['ra'].user_object)
         e.recognition.add(self.create_section())
         e.keywords.add(self.create_keyword())
-        response = self.clients['hs'].get(reverse('search_report') + "?experiences=[" + str(e.pk) + "]")
+        response = self.clients['hs'].post(reverse('search_report'), {'experiences': '[%d]' % e.pk})
         self.assertEqual(response.get('Content-Disposition'), 'attachment; filename="experiences.csv"',
                          'The response should be an attached csv file')
 
@@ -1085,7 +1606,7 @@ class SearchExperienceReportTest(StandardTestCase):
                          'Trying to get a report without a querystring should return a 404')
 
     def test_get_experience_report_no_experiences(self):
-        response = self.clients['hs'].get(reverse('search_report') + "?experiences=[]")
+        response = self.clients['hs'].post(reverse('search_report'), {'experiences': '[]'})
         self.assertEqual(response.status_code, 404,
                          'Trying to get a report without experiences should return a 404')
 
@@ -1097,8 +1618,8 @@ class SearchExperienceReportTest(StandardTestCase):
         keys = SearchExperienceReport.keys
         experience_dict = e.convert_to_dict(keys)
         row = ','.join([experience_dict[key] for key in keys])
-        response = self.clients['hs'].get(reverse('search_report') + "?experiences=[" + str(e.pk) + "]")
-        self.assertIn(row, str(response.content), "The experience should be returned in a csv download")
+        response = self.clients['hs'].post(reverse('search_report'), {'experiences': '[%d]' % e.pk})
+        self.assertIn(row, str(b''.join(response.streaming_content)), "The experience should be returned in a csv download")
 
     def test_does_not_get_cancelled_experiences(self):
         e = self.create_experience('ca')
@@ -1108,8 +1629,8 @@ class SearchExperienceReportTest(StandardTestCase):
         keys = SearchExperienceReport.keys
         experience_dict = e.convert_to_dict(keys)
         row = ','.join([experience_dict[key] for key in keys])
-        response = self.clients['hs'].get(reverse('search_report') + "?experiences=[" + str(e.pk) + "]")
-        self.assertNotIn(row, str(response.content),
+        response = self.clients['hs'].post(reverse('search_report'), {'experiences': '[%d]' % e.pk})
+        self.assertNotIn(row, str(b''.join(response.streaming_content)),
                          "The cancelled experience should not be returned in a csv download")
 
     def test_does_not_return_draft_with_different_author(self):
@@ -1120,10 +1641,353 @@ class SearchExperienceReportTest(StandardTestCase):
         keys = SearchExperienceReport.keys
         experience_dict = e.convert_to_dict(keys)
         row = ','.join([experience_dict[key] for key in keys])
-        response = self.clients['hs'].get(reverse('search_report') + "?experiences=[" + str(e.pk) + "]")
-        self.assertNotIn(row, str(response.content),
+        response = self.clients['hs'].post(reverse('search_report'), {'experiences': '[%d]' % e.pk})
+        self.assertNotIn(row, str(b''.join(response.streaming_content)),
                          "The draft experience with a different author should not be returned in a csv download")
 
+    def test_report_is_streamed_from_one_query(self):
+        experiences = []
+        for i in range(5):
+            e = self.create_experience('ad')
+            e.pk = None
+            e.name = 'Exported %d' % i
+            e.save()
+            e.keywords.add(self.create_keyword(name='Keyword %d' % i))
+            experiences.append(e)
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            response = self.clients['hs'].post(reverse('search_report'),
+                                               {'experiences': json.dumps([e.pk for e in experiences])})
+            self.assertTrue(response.streaming)
+            with CaptureQueriesContext(connection) as queries:
+                lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['name', 'status'])
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['Exported %d' % i for i in range(5)])
+        self.assertIn('Keyword 3', lines[4])
+        self.assertEqual(len(queries), 1, 'Related names should be joined by the database')
+
+    def test_aggregated_rows_match_convert_to_dict(self):
+        from exdb.exports import AggregatedRowSerializer, RowSerializer, label_expression
+        keys = SearchExperienceReport.keys
+        named = get_user_model().objects.create(username='named', first_name='Zed', last_name='Planner')
+        mailed = get_user_model().objects.create(username='mailed', email='amy@example.com')
+        full = self.create_experience('ad', attendance=12)
+        full.planners.add(named, mailed, self.clients['hs'].user_object)
+        full.recognition.add(self.create_section(name='West'), self.create_section(name='East'))
+        full.keywords.add(self.create_keyword(name='Paper'), self.create_keyword(name='Origami'))
+        full.subtypes.add(self.create_subtype(name='Another Subtype'))
+        full.next_approver = named
+        full.save()
+        empty = self.create_experience('dr')
+        empty.pk = None
+        empty.name = 'Empty'
+        empty.attendance = None
+        empty.next_approver = None
+        empty.audience = ''
+        empty.save()
+        experiences = Experience.objects.filter(pk__in=[full.pk, empty.pk]).order_by('pk')
+        rows = list(AggregatedRowSerializer(keys).rows(experiences))
+        serializer = RowSerializer(keys)
+        self.assertEqual(rows, [serializer.serialize(e) for e in serializer.prepare(experiences)])
+        self.assertEqual(rows[0][keys.index('planners')], 'hs, amy@example.com, Zed Planner')
+        with self.assertRaises(ValueError, msg='Labels of models with their own __str__ can not be guessed'):
+            label_expression(Semester)
+
+    def export_lines(self, client, data):
+        response = client.get(reverse('search_report'), data)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_exports_every_result_of_a_search(self):
+        names = []
+        for name, type_name in (('Origami Night', 'Social'), ('Origami Day', 'Social'), ('Origami Talk', 'Lecture')):
+            e = self.create_experience('ad')
+            e.pk = None
+            e.name = name
+            e.type = self.create_type(name=type_name)
+            e.save()
+            names.append(name)
+        self.create_experience('ad')
+        draft = self.create_experience('dr')
+        draft.pk = None
+        draft.name = 'Origami Draft'
+        draft.save()
+        lines = self.export_lines(self.clients['hs'], {'search': 'origami', 'cursor': 'ignored'})
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], names,
+                         'Every result should be exported whatever the page, without drafts of others')
+        lines = self.export_lines(self.clients['ra'], {'search': 'origami', 'column_type': 'soc', 'column_name': 'n'})
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['Origami Night'])
+        lines = self.export_lines(self.clients['ra'], {'search': 'origami', 'column_status': 'draft'})
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['Origami Draft'])
+        self.assertEqual(self.clients['hs'].get(reverse('search_report'), {'search': 'after:never'}).status_code, 404)
+
+    def test_exports_search_as_xlsx(self):
+        from xml.etree import ElementTree
+        e = self.create_experience('ad', attendance=12)
+        e.planners.add(self.clients['ra'].user_object, self.clients['hs'].user_object)
+        e.keywords.add(self.create_keyword(name='Paper, Scissors'))
+        other = self.create_experience('ad')
+        other.pk = None
+        other.name = 'Test Other'
+        other.save()
+
+        response = self.clients['hs'].get(reverse('search_report'), {'search': 'test', 'format': 'xlsx'})
+        self.assertEqual(response.get('Content-Disposition'), 'attachment; filename="experiences.xlsx"')
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1, 'The workbook should be streamed')
+        workbook = zipfile.ZipFile(BytesIO(b''.join(chunks)))
+        self.assertIsNone(workbook.testzip())
+        namespace = {'x': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+        sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+        rows = [{cell.get('r').rstrip('0123456789'): cell for cell in row.findall('x:c', namespace)}
+                for row in sheet.findall('x:sheetData/x:row', namespace)]
+
+        def text(cell):
+            return ''.join(cell.itertext())
+
+        header = {text(cell): column for column, cell in rows[0].items()}
+        self.assertIn('planners 2', header, 'Every planner should have a column of its own')
+        self.assertEqual(text(rows[1][header['keywords']]), 'Paper, Scissors')
+        self.assertEqual({text(rows[1][header['planners 1']]), text(rows[1][header['planners 2']])}, {'ra', 'hs'})
+        self.assertNotIn(header['planners 2'], rows[2], 'Missing names should leave empty cells')
+        self.assertEqual(text(rows[1][header['attendance']]), '12')
+        start = rows[1][header['start_datetime']]
+        self.assertEqual(start.get('s'), '2', 'Dates should be typed cells')
+        days = float(text(start))
+        self.assertEqual(datetime(1899, 12, 30) + timedelta(days=days), localtime(e.start_datetime).replace(tzinfo=None))
+
+    def test_picked_export_is_capped(self):
+        e = self.create_experience('ad')
+        with self.settings(EXPORT_MAX_SELECTED=1):
+            response = self.clients['hs'].post(reverse('search_report'), {'experiences': '[%d, %d]' % (e.pk, e.pk + 1)})
+        self.assertEqual(response.status_code, 404)
+        response = self.clients['hs'].post(reverse('search_report'), {'experiences': 'not json'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_row_serializer_matches_convert_to_dict(self):
+        from exdb.exports import RowSerializer
+        keys = SearchExperienceReport.keys
+        full = self.create_experience('ad', attendance=12)
+        full.planners.add(self.clients['ra'].user_object, self.clients['hs'].user_object)
+        full.recognition.add(self.create_section())
+        full.keywords.add(self.create_keyword())
+        full.audience = ''
+        full.save()
+        empty = self.create_experience('dr')
+        empty.pk = None
+        empty.name = 'Empty'
+        empty.attendance = None
+        empty.next_approver = None
+        empty.save()
+        serializer = RowSerializer(keys)
+        self.assertEqual(serializer.select_related, ['author', 'type', 'next_approver'])
+        for experience in serializer.prepare(Experience.objects.filter(pk__in=[full.pk, empty.pk])):
+            expected = experience.convert_to_dict(keys)
+            self.assertEqual(serializer.serialize(experience), tuple(expected[key] for key in keys))
+
+
+class ExportJobTest(StandardTestCase):
+
+    def setUp(self):
+        super(ExportJobTest, self).setUp()
+        self.export_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_root)
+        overrides = self.settings(EXPORT_ROOT=self.export_root, EXPORT_CHUNK_SIZE=2)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def create_named(self, name):
+        e = self.create_experience('ad')
+        e.pk = None
+        e.name = name
+        e.save()
+        return e
+
+    def test_export_job_is_written_by_the_worker(self):
+        names = ['Origami %d' % i for i in range(5)]
+        for name in names:
+            self.create_named(name)
+        response = self.clients['ra'].post(reverse('create_export_job'), {'query': '?search=origami&cursor=x'})
+        self.assertRedirects(response, reverse('export_jobs'))
+        job = ExportJob.objects.get()
+        self.assertEqual((job.user, job.status), (self.clients['ra'].user_object, 'qu'))
+
+        out = StringIO()
+        call_command('run_export_jobs', '--once', stdout=out)
+        self.assertIn('1 export job(s) run.', out.getvalue())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total_rows, job.rows_written, job.percent), ('do', 5, 5, 100))
+        self.assertEqual(os.listdir(self.export_root), [job.file_name], 'No partial file should be left behind')
+
+        self.assertContains(self.clients['ra'].get(reverse('export_jobs')), reverse('download_export_job', args=[job.pk]))
+        response = self.clients['ra'].get(reverse('download_export_job', args=[job.pk]))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([line.split(',')[0] for line in lines], ['name'] + names)
+        self.assertEqual(self.clients['hs'].get(reverse('download_export_job', args=[job.pk])).status_code, 404,
+                         'Only the user who asked for an export should download it')
+
+    def test_export_jobs_are_capped_per_user(self):
+        with self.settings(EXPORT_JOB_LIMIT=1):
+            self.clients['ra'].post(reverse('create_export_job'), {'query': 'search=origami'})
+            response = self.clients['ra'].post(reverse('create_export_job'), {'query': 'search=other'}, follow=True)
+            self.assertContains(response, 'You already have 1 exports in progress.')
+            self.clients['hs'].post(reverse('create_export_job'), {'query': 'search=origami'})
+        self.assertEqual(ExportJob.objects.count(), 2)
+        response = self.clients['ra'].post(reverse('create_export_job'), {'query': 'page=1'})
+        self.assertEqual(response.status_code, 404, 'An export needs a search')
+
+    def test_abandoned_export_jobs_are_failed(self):
+        user = self.clients['ra'].user_object
+        with self.settings(EXPORT_JOB_LIMIT=1):
+            job = ExportJob.submit(user, 'search=origami')
+            # Claimed by a worker that died
+            ExportJob.objects.filter(pk=job.pk).update(
+                status='ru', started_datetime=now() - settings.EXPORT_JOB_TIMEOUT - timedelta(minutes=1))
+            with self.assertRaises(ValueError):
+                ExportJob.submit(user, 'search=origami')
+            out = StringIO()
+            call_command('run_export_jobs', '--once', stdout=out)
+            self.assertIn('1 abandoned export job(s) failed.', out.getvalue())
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.error), ('fa', 'The export was interrupted.'))
+            ExportJob.submit(user, 'search=origami')
+
+    def test_export_job_failed_while_running_stays_failed(self):
+        from exdb.export_jobs import claim_next, run_job
+        self.create_named('Origami')
+        job = ExportJob.submit(self.clients['ra'].user_object, 'search=origami')
+        job = claim_next()
+        ExportJob.objects.filter(pk=job.pk).update(status='fa', error='The export was interrupted.')
+        self.assertFalse(run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'fa')
+        self.assertEqual(os.listdir(self.export_root), [])
+
+    def test_export_worker_survives_database_errors(self):
+        from exdb.management.commands import run_export_jobs
+
+        class Stop(Exception):
+            pass
+
+        with mock.patch.object(run_export_jobs, 'run_pending', side_effect=[OperationalError('lost'), 1]) as run, \
+                mock.patch.object(run_export_jobs, 'close_old_connections') as close, \
+                mock.patch.object(run_export_jobs.time, 'sleep', side_effect=[None, Stop]), \
+                self.assertLogs(run_export_jobs.__name__, 'ERROR'):
+            with self.assertRaises(Stop):
+                call_command('run_export_jobs', stdout=StringIO())
+        self.assertEqual(run.call_count, 2, 'The worker should keep running after a database error')
+        close.assert_called_once_with()
+
+    def test_failed_and_expired_export_jobs(self):
+        failed = ExportJob.submit(self.clients['ra'].user_object, 'search=after:never')
+        call_command('run_export_jobs', '--once', stdout=StringIO())
+        failed.refresh_from_db()
+        self.assertEqual((failed.status, failed.error), ('fa', 'Invalid search'))
+        self.assertEqual(os.listdir(self.export_root), [])
+
+        self.create_named('Origami')
+        done = ExportJob.submit(self.clients['ra'].user_object, 'search=origami')
+        call_command('run_export_jobs', '--once', stdout=StringIO())
+        done.refresh_from_db()
+        ExportJob.objects.update(finished_datetime=now() - settings.EXPORT_RETENTION_TIMEDELTA - timedelta(minutes=1))
+        out = StringIO()
+        call_command('run_export_jobs', '--once', stdout=out)
+        self.assertIn('2 expired export job(s) removed.', out.getvalue())
+        self.assertFalse(ExportJob.objects.exists())
+        self.assertEqual(os.listdir(self.export_root), [])
+
+
+class SemesterArchiveTest(StandardTestCase):
+
+    def setUp(self):
+        super(SemesterArchiveTest, self).setUp()
+        self.semester = Semester.objects.create(
+            start_datetime=self.test_date - timedelta(days=30), end_datetime=self.test_date + timedelta(days=120))
+        self.experience = self.create_experience('co')
+        self.experience.recognition.add(self.create_section())
+        self.create_experience_comment(self.experience, message='Well done')
+        ExperienceApproval.objects.create(
+            experience=self.experience, approver=self.clients['hs'].user_object, timestamp=self.test_date)
+        Requirement.objects.create(
+            start_datetime=self.semester.start_datetime, end_datetime=self.semester.end_datetime,
+            semester=self.semester, affiliation=self.create_affiliation(), subtype=self.create_subtype(),
+            total_needed=2, description='Community')
+        # Experiences of other semesters are left out
+        self.create_experience('co', start=self.test_date + timedelta(days=365),
+                               end=self.test_date + timedelta(days=366))
+
+    def read_archive(self, data):
+        archive = zipfile.ZipFile(BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        return {name: archive.read(name).decode() for name in archive.namelist()}
+
+    @override_settings(EXPORT_CHUNK_SIZE=1)
+    def test_archive_holds_every_table_of_the_semester(self):
+        response = self.clients['hs'].get(reverse('semester_archive', args=[self.semester.pk]))
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertIn('semester-2014-12-02.zip', response['Content-Disposition'])
+        files = self.read_archive(b''.join(response.streaming_content))
+        self.assertEqual(list(files), [
+            'experiences.csv', 'comments.ndjson', 'approvals.ndjson', 'requirements.csv', 'completion.csv'])
+
+        experiences = files['experiences.csv'].splitlines()
+        self.assertEqual(experiences[0].split(',')[:2], ['id', 'name'])
+        self.assertEqual([line.split(',')[0] for line in experiences[1:]], [str(self.experience.pk)])
+
+        comment, = [json.loads(line) for line in files['comments.ndjson'].splitlines()]
+        self.assertEqual((comment['experience_id'], comment['author_name'], comment['message']),
+                         (self.experience.pk, 'ra', 'Well done'))
+        approval, = [json.loads(line) for line in files['approvals.ndjson'].splitlines()]
+        self.assertEqual((approval['approver_name'], approval['timestamp']), ('hs', '2015-01-01T16:01:00Z'))
+
+        requirements = files['requirements.csv'].splitlines()
+        self.assertEqual(len(requirements), 2)
+        self.assertTrue(requirements[1].endswith('Test Affiliation,Test Subtype,2,Community'))
+        self.assertEqual(files['completion.csv'].splitlines()[1],
+                         'Test Affiliation,Test Section,Test Subtype,Community,1,2')
+
+    def test_archive_is_for_hall_staff_only(self):
+        self.assertEqual(self.clients['ra'].get(reverse('semester_archive', args=[self.semester.pk])).status_code, 404)
+        self.assertEqual(self.clients['hs'].get(reverse('semester_archive', args=[self.semester.pk + 1])).status_code,
+                         404)
+
+    def test_archive_command_writes_the_archive(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'archive.zip')
+        out = StringIO()
+        call_command('archive_semester', str(self.semester.pk), '--output', path, stdout=out)
+        self.assertIn('Semester archive written to %s.' % path, out.getvalue())
+        with open(path, 'rb') as archive:
+            files = self.read_archive(archive.read())
+        self.assertEqual(len(files['experiences.csv'].splitlines()), 2)
+
+    def test_archive_leaves_out_the_drafts_of_others(self):
+        own_draft = self.create_experience('dr', author=self.clients['hs'].user_object)
+        other_draft = self.create_experience('dr')
+        self.create_experience_comment(other_draft, message='Private')
+        response = self.clients['hs'].get(reverse('semester_archive', args=[self.semester.pk]))
+        files = self.read_archive(b''.join(response.streaming_content))
+        self.assertEqual([line.split(',')[0] for line in files['experiences.csv'].splitlines()[1:]],
+                         [str(self.experience.pk), str(own_draft.pk)])
+        self.assertNotIn('Private', files['comments.ndjson'])
+
+        # Without a user nobody's drafts are archived
+        files = self.read_archive(b''.join(iter_archive(self.semester)))
+        self.assertEqual(len(files['experiences.csv'].splitlines()), 2)
+
+    def test_archive_follows_the_semester_of_experiences(self):
+        # An earlier overlapping semester takes the experience over, as it does on the completion board
+        earlier = Semester.objects.create(
+            start_datetime=self.test_date - timedelta(days=60), end_datetime=self.test_date + timedelta(days=10))
+        self.assertEqual(Experience.objects.get(pk=self.experience.pk).semester, earlier)
+        files = self.read_archive(b''.join(iter_archive(self.semester)))
+        self.assertEqual(len(files['experiences.csv'].splitlines()), 1)
+        self.assertEqual(files['comments.ndjson'], '')
+        files = self.read_archive(b''.join(iter_archive(earlier)))
+        self.assertEqual([line.split(',')[0] for line in files['experiences.csv'].splitlines()[1:]],
+                         [str(self.experience.pk)])
+        self.assertIn('Well done', files['comments.ndjson'])
+
 
 class FormsCoverageTest(StandardTestCase):
 
@@ -1212,3 +2076,347 @@ class FormsCoverageTest(StandardTestCase):
         section.cache_requirements(semester)
         self.assertTrue(hasattr(section, 'requirement_dict'))
         self.assertTrue(hasattr(section, 'requirements'))
+
+
+class CompletionEngineTest(StandardTestCase):
+
+    def setUp(self):
+        super(CompletionEngineTest, self).setUp()
+        self.semester = Semester.objects.create(
+            start_datetime=make_aware(datetime(2025, 1, 1), timezone=utc),
+            end_datetime=make_aware(datetime(2025, 12, 31), timezone=utc))
+        self.affiliation = self.create_affiliation()
+        self.section = self.create_section(affiliation=self.affiliation)
+        self.subtype = self.create_subtype()
+
+    def create_requirement(self, start, end, total_needed=2):
+        return Requirement.objects.create(
+            start_datetime=make_aware(start, timezone=utc), end_datetime=make_aware(end, timezone=utc),
+            semester=self.semester, affiliation=self.affiliation, subtype=self.subtype, total_needed=total_needed)
+
+    def create_completed(self, start, section=None):
+        start = make_aware(start, timezone=utc)
+        e = Experience.objects.create(
+            author=self.clients['ra'].user_object, name='Completed', start_datetime=start,
+            end_datetime=start + timedelta(hours=1), type=self.create_type(), status='co')
+        e.subtypes.add(self.subtype)
+        e.recognition.add(section or self.section)
+        return e
+
+    def test_each_experience_counts_toward_one_requirement(self):
+        first = self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        second = self.create_requirement(datetime(2025, 6, 10), datetime(2025, 7, 10))
+        e1 = self.create_completed(datetime(2025, 6, 5))
+        e2 = self.create_completed(datetime(2025, 6, 15))
+        e3 = self.create_completed(datetime(2025, 7, 5))
+        self.section.cache_requirements(self.semester)
+        self.assertEqual(self.section.requirements[first.pk], ([e1, e2], 2, 0))
+        self.assertEqual(self.section.requirements[second.pk], ([e3], 2, 1),
+                         'Experiences counted toward an earlier requirement should not count again')
+
+    def test_incomplete_experiences_do_not_count(self):
+        requirement = self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        e = self.create_completed(datetime(2025, 6, 5))
+        e.status = 'ad'
+        e.save()
+        self.section.cache_requirements(self.semester)
+        self.assertEqual(self.section.requirements[requirement.pk], ([], 2, 2))
+
+    def test_query_count_does_not_grow_with_sections(self):
+        from exdb.completion import cache_requirements
+        self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        sections = [self.section] + [self.create_section(name='Section %d' % i, affiliation=self.affiliation)
+                                     for i in range(3)]
+        for section in sections:
+            self.create_completed(datetime(2025, 6, 5), section=section)
+        with self.assertNumQueries(3):
+            cache_requirements(sections, self.semester)
+        for section in sections:
+            self.assertEqual([len(value[0]) for value in section.requirements.values()], [1])
+
+    def test_completion_board_view(self):
+        requirement = self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        self.create_completed(datetime(2025, 6, 5))
+        response = self.clients['hs'].get(reverse('completion_board', args=[self.affiliation.pk]))
+        self.assertEqual(response.status_code, 200)
+        section = response.context['sections'][0]
+        self.assertEqual(section.requirements[requirement.pk][2], 1, 'One more experience should be needed')
+
+    def test_summary_follows_completed_experiences(self):
+        from exdb.completion import load_summaries
+        requirement = self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        e = self.create_completed(datetime(2025, 6, 5))
+        summary = CompletionSummary.objects.get(section=self.section, requirement=requirement)
+        self.assertEqual((summary.count, summary.needed, summary.get_experience_ids()), (1, 1, [e.pk]))
+        e.status = 'ca'
+        e.save()
+        summary = CompletionSummary.objects.get(section=self.section, requirement=requirement)
+        self.assertEqual((summary.count, summary.needed), (0, 2), 'Summary should be refreshed when an experience leaves completion')
+        e.status = 'co'
+        e.save()
+        e.recognition.clear()
+        load_summaries([self.section], self.semester)
+        self.assertEqual(self.section.requirements[requirement.pk], ([], 2, 2))
+
+    def test_summary_follows_requirements(self):
+        first = self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        e = self.create_completed(datetime(2025, 6, 5))
+        second = self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        first.delete()
+        summary = CompletionSummary.objects.get(section=self.section, requirement=second)
+        self.assertEqual(summary.get_experience_ids(), [e.pk], 'Experience should move to the remaining requirement')
+
+    def test_summary_follows_semester_changes(self):
+        from exdb import completion
+        requirement = self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        self.create_completed(datetime(2025, 6, 5))
+        self.create_section(name='Other Section', affiliation=self.affiliation)
+        with mock.patch.object(completion, 'refresh_summaries', wraps=completion.refresh_summaries) as refresh:
+            self.semester.save()
+            refresh.assert_not_called()
+            self.semester.end_datetime = make_aware(datetime(2025, 5, 31), timezone=utc)
+            self.semester.save()
+        (sections, semesters), _kwargs = refresh.call_args
+        self.assertEqual((list(sections), list(semesters)), ([self.section], [self.semester]),
+                         'Only the sections and semesters of moved experiences should be refreshed')
+        summary = CompletionSummary.objects.get(section=self.section, requirement=requirement)
+        self.assertEqual((summary.count, summary.needed), (0, 2), 'Summary should drop the experience that moved out')
+
+    def test_load_summaries_matches_cache_requirements(self):
+        from exdb.completion import load_summaries
+        requirement = self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        self.create_completed(datetime(2025, 6, 5))
+        CompletionSummary.objects.all().delete()
+        loaded = Section.objects.get(pk=self.section.pk)
+        load_summaries([loaded], self.semester, with_experiences=True)
+        self.section.cache_requirements(self.semester)
+        self.assertEqual(loaded.requirements, self.section.requirements)
+        with self.assertNumQueries(2):
+            load_summaries([loaded], self.semester)
+        self.assertEqual(loaded.requirements[requirement.pk][2], 1)
+
+    def test_load_summaries_tolerates_summaries_written_meanwhile(self):
+        from exdb.completion import load_summaries
+        requirement = self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        e = self.create_completed(datetime(2025, 6, 5))
+        CompletionSummary.objects.all().delete()
+        bulk_create = CompletionSummary.objects.bulk_create
+
+        def racing(*args, **kwargs):
+            # Another request opening the same board fills the summary first
+            CompletionSummary.objects.create(
+                section=self.section, requirement=requirement, count=1, needed=1, experience_ids=str(e.pk))
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(CompletionSummary.objects, 'bulk_create', side_effect=racing):
+            load_summaries([self.section], self.semester)
+        self.assertEqual(self.section.requirements[requirement.pk], ([e.pk], 2, 1))
+        self.assertEqual(CompletionSummary.objects.count(), 1)
+
+    def test_rebuild_completion_command(self):
+        self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        self.create_completed(datetime(2025, 6, 5))
+        CompletionSummary.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_completion', stdout=out)
+        self.assertIn('1 completion summary row(s) written.', out.getvalue())
+
+    def test_completion_matrix_cells(self):
+        from exdb.completion import CompletionMatrix
+        first = self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30), total_needed=1)
+        second = self.create_requirement(datetime(2025, 7, 1), datetime(2025, 7, 30))
+        self.create_completed(datetime(2025, 6, 5))
+        self.create_completed(datetime(2025, 7, 5))
+        self.section.cache_requirements(self.semester)
+        matrix = CompletionMatrix([self.section], self.section.requirement_dict)
+        self.assertEqual([requirement for _, requirement in matrix.columns], [first, second])
+        self.assertEqual([(cell.count, cell.total, cell.shade) for cell in matrix.rows[0].cells],
+                         [(1, 1, 'full'), (1, 2, 'partial')])
+
+    def test_completion_board_exports(self):
+        self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        self.create_completed(datetime(2025, 6, 5))
+        url = reverse('completion_board', args=[self.affiliation.pk])
+        data = self.clients['hs'].get(url, {'format': 'json'}).json()
+        self.assertEqual(data['rows'][0]['section'], str(self.section))
+        self.assertEqual(data['rows'][0]['cells'], [{'count': 1, 'total': 2, 'needed': 1, 'shade': 'partial'}])
+        response = self.clients['hs'].get(url, {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response.content.decode().splitlines()[1], '%s,1/2' % self.section)
+
+    def test_completion_board_links_campus_for_hall_staff(self):
+        from django.template.loader import render_to_string
+        self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        response = self.clients['hs'].get(reverse('completion_board', args=[self.affiliation.pk]))
+        self.assertContains(response, reverse('campus_completion_board'))
+        context = response.context[0].flatten()
+        context['user'] = self.clients['ra'].user_object
+        self.assertNotIn(reverse('campus_completion_board'), render_to_string('exdb/completion_board.html', context),
+                         'Only hall staff can open the campus completion board')
+
+    def test_section_completion_board_view(self):
+        self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        e = self.create_completed(datetime(2025, 6, 5))
+        response = self.clients['hs'].get(reverse('section_completion_board', args=[self.section.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, reverse('view_experience', kwargs={'pk': e.pk}))
+        self.assertEqual(response.context['matrix'].rows[0].cells[0].needed, 1)
+
+    def test_campus_completion(self):
+        from exdb.completion import CampusCompletion
+        self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        self.create_completed(datetime(2025, 6, 5))
+        other = self.create_affiliation(name='Other')
+        other_section = self.create_section(name='Other Section', affiliation=other)
+        Requirement.objects.create(
+            start_datetime=make_aware(datetime(2025, 6, 1), timezone=utc),
+            end_datetime=make_aware(datetime(2025, 6, 30), timezone=utc),
+            semester=self.semester, affiliation=other, subtype=self.subtype, total_needed=3)
+        self.create_completed(datetime(2025, 6, 5), section=other_section)
+        with self.assertNumQueries(3):
+            campus = CampusCompletion(self.semester)
+        self.assertEqual({str(r.label): (r.count, r.total) for r in campus.affiliation_rollups},
+                         {str(self.affiliation): (1, 2), 'Other': (1, 3)})
+        self.assertEqual([(r.label, r.count, r.total, r.percent) for r in campus.subtype_rollups],
+                         [(self.subtype, 2, 5, 40)])
+
+    def test_campus_completion_orders_sections(self):
+        from exdb.completion import CampusCompletion
+        self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        eleventh = self.create_section(name='Eleventh Floor', affiliation=self.affiliation)
+        second = self.create_section(name='Second Floor', affiliation=self.affiliation)
+        campus = CampusCompletion(self.semester)
+        self.assertEqual([row.section for row in campus.matrices[0][1].rows], [second, eleventh, self.section],
+                         'Sections should follow their order, not their name')
+
+    def test_campus_completion_board_view(self):
+        self.create_requirement(datetime(2025, 6, 1), datetime(2025, 6, 30))
+        self.create_completed(datetime(2025, 6, 5))
+        url = reverse('campus_completion_board')
+        self.assertEqual(self.clients['ra'].get(url).status_code, 404)
+        self.assertEqual(self.clients['hs'].get(url).status_code, 200)
+        data = self.clients['hs'].get(url, {'format': 'json'}).json()
+        self.assertEqual(data['affiliations'][0]['rollup']['count'], 1)
+        lines = self.clients['hs'].get(url, {'format': 'csv'}).content.decode().splitlines()
+        self.assertEqual(lines[1].split(',')[-2:], ['1', '2'])
+
+
+class SemesterAssignmentTest(StandardTestCase):
+
+    def setUp(self):
+        super(SemesterAssignmentTest, self).setUp()
+        self.spring = Semester.objects.create(
+            start_datetime=make_aware(datetime(2025, 1, 1), timezone=utc),
+            end_datetime=make_aware(datetime(2025, 5, 31), timezone=utc))
+
+    def test_semester_assigned_on_save(self):
+        e = self.create_experience('dr', start=make_aware(datetime(2025, 3, 1), timezone=utc),
+                                   end=make_aware(datetime(2025, 3, 2), timezone=utc))
+        self.assertEqual(e.semester_id, self.spring.pk)
+        e.start_datetime = make_aware(datetime(2025, 7, 1), timezone=utc)
+        e.end_datetime = e.start_datetime + timedelta(hours=1)
+        e.save()
+        self.assertIsNone(Experience.objects.get(pk=e.pk).semester)
+
+    def test_semester_assigned_on_save_ignores_stale_calendar(self):
+        Semester.get_calendar()
+        # Created behind the back of the cached calendar, like by a process with its own cache
+        Semester.objects.bulk_create([Semester(
+            start_datetime=make_aware(datetime(2025, 6, 1), timezone=utc),
+            end_datetime=make_aware(datetime(2025, 8, 31), timezone=utc))])
+        summer = Semester.objects.get(start_datetime__month=6)
+        e = self.create_experience('dr', start=make_aware(datetime(2025, 7, 1), timezone=utc),
+                                   end=make_aware(datetime(2025, 7, 2), timezone=utc))
+        self.assertEqual(e.semester_id, summer.pk)
+
+    def test_semester_changes_reassign_experiences(self):
+        e = self.create_experience('dr', start=make_aware(datetime(2025, 7, 1), timezone=utc),
+                                   end=make_aware(datetime(2025, 7, 2), timezone=utc))
+        self.spring.end_datetime = make_aware(datetime(2025, 8, 31), timezone=utc)
+        self.spring.save()
+        self.assertEqual(Experience.objects.get(pk=e.pk).semester_id, self.spring.pk)
+        self.spring.delete()
+        self.assertIsNone(Experience.objects.get(pk=e.pk).semester)
+
+    def test_current_semester_is_cached(self):
+        Semester.get_current()
+        with self.assertNumQueries(0):
+            semester = Semester.get_current()
+        self.assertEqual(semester, self.spring)
+        later = Semester.objects.create(
+            start_datetime=make_aware(datetime(2026, 1, 1), timezone=utc),
+            end_datetime=make_aware(datetime(2026, 5, 31), timezone=utc))
+        self.assertEqual(Semester.get_current(), later, 'Saving a semester should refresh the calendar')
+
+    def test_assign_semesters_command(self):
+        e = self.create_experience('dr', start=make_aware(datetime(2025, 3, 1), timezone=utc),
+                                   end=make_aware(datetime(2025, 3, 2), timezone=utc))
+        Experience.objects.filter(pk=e.pk).update(semester=None)
+        out = StringIO()
+        call_command('assign_semesters', stdout=out)
+        self.assertIn('1 experience(s) assigned.', out.getvalue())
+        self.assertEqual(Experience.objects.get(pk=e.pk).semester_id, self.spring.pk)
+
+
+class SearchSuggestTest(StandardTestCase):
+
+    def suggest(self, query, **params):
+        params['q'] = query
+        response = self.clients['ra'].get(reverse('search_suggest'), params)
+        return [(s['label'], s['kind']) for s in response.json()['suggestions']]
+
+    def test_suggests_vocabulary_by_word_prefix(self):
+        self.create_keyword(name='Origami')
+        self.create_section(name='Maple Hall')
+        e = self.create_experience('pe')
+        e.name = 'Origami Night'
+        e.save()
+        self.assertEqual(self.suggest('ori'), [('Origami', 'keyword'), ('Origami Night', 'experience')])
+        self.assertEqual(self.suggest('HAL'), [('Maple Hall', 'section')], 'Any word of a label should match')
+        self.assertEqual(self.suggest('ori', kind='experience'), [('Origami Night', 'experience')])
+
+    def test_suggestions_do_not_query_the_database(self):
+        from exdb import suggest
+        self.create_keyword(name='Origami')
+        suggest.suggest('o')
+        with self.assertNumQueries(0):
+            self.assertEqual(suggest.suggest('orig'), [{'label': 'Origami', 'kind': 'keyword'}])
+
+    def test_vocabulary_changes_rebuild_suggestions(self):
+        keyword = self.create_keyword(name='Origami')
+        self.assertEqual(self.suggest('kiri'), [])
+        keyword.name = 'Kirigami'
+        keyword.save()
+        self.assertEqual(self.suggest('kiri'), [('Kirigami', 'keyword')])
+
+    def test_suggestions_rebuilt_when_version_expires(self):
+        with self.settings(PROCESS_CACHE_TIMEOUT=0):
+            keyword = self.create_keyword(name='Origami')
+            self.assertEqual(self.suggest('kiri'), [])
+            # Renamed without the signals, like by a process with its own cache
+            Keyword.objects.filter(pk=keyword.pk).update(name='Kirigami')
+            self.assertEqual(self.suggest('kiri'), [('Kirigami', 'keyword')],
+                             'Suggestions should be rebuilt once the version expires')
+
+    def test_does_not_suggest_drafts(self):
+        e = self.create_experience('dr')
+        e.name = 'Secret Plans'
+        e.save()
+        self.assertEqual(self.suggest('secret'), [])
+
+    @override_settings(SUGGEST_REFRESH_INTERVAL=0)
+    def test_experience_names_refresh_on_interval(self):
+        self.assertEqual(self.suggest('origami'), [])
+        e = self.create_experience('pe')
+        e.name = 'Origami Night'
+        e.save()
+        self.assertEqual(self.suggest('origami'), [('Origami Night', 'experience')])
+
+    def test_unknown_kind(self):
+        response = self.clients['ra'].get(reverse('search_suggest'), {'q': 'a', 'kind': 'nonsense'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_limit_below_one(self):
+        for limit in ('0', '-1'):
+            response = self.clients['ra'].get(reverse('search_suggest'), {'q': 'a', 'limit': limit})
+            self.assertEqual(response.status_code, 404, 'A limit of %s should respond with a 404' % limit)
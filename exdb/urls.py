@@ -30,7 +30,13 @@ urlpatterns = [
     path('list/needs-evaluation', views.ListExperienceByStatusView.as_view(readable_status="Needs Evaluation"), name="eval_list"),
     re_path(r'^list/(?P<status>[a-zA-Z\-]+)$', views.ListExperienceByStatusView.as_view(), name='status_list'),
     path('experience/search/', views.SearchExperienceResultsView.as_view(), name='search'),
+    path('experience/search/suggest', views.SearchSuggestView.as_view(), name='search_suggest'),
     path('experience/search/report', views.SearchExperienceReport.as_view(), name='search_report'),
+    path('export/jobs', views.ExportJobListView.as_view(), name='export_jobs'),
+    path('export/jobs/create', views.CreateExportJobView.as_view(), name='create_export_job'),
+    path('export/jobs/<int:pk>/download', views.DownloadExportJobView.as_view(), name='download_export_job'),
+    path('complete/campus', views.CampusCompletionBoardView.as_view(), name='campus_completion_board'),
+    path('semester/<int:pk>/archive', views.SemesterArchiveView.as_view(), name='semester_archive'),
     re_path(r'^complete/(?P<pk>\d+)?$', views.CompletionBoardView.as_view(), name='completion_board'),
     path('requirement/view/<int:pk>', views.ViewRequirementView.as_view(), name='view_requirement'),
     re_path(r'^section/complete/(?P<pk>\d+)?$', views.SectionCompletionBoardView.as_view(), name='section_completion_board'),
@@ -5,16 +5,21 @@ from django.views.generic import View, TemplateView, ListView, RedirectView
 from django.views.generic.edit import CreateView, UpdateView
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
-from django.contrib import auth
-from django.http import HttpResponseRedirect, Http404, HttpResponse
+from django.contrib import auth, messages
+from django.http import HttpResponseRedirect, Http404, HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse, QueryDict
 from django.utils import timezone
+from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth import get_user_model
 from django.conf import settings
-from django.db.models import Q, Prefetch
+from django.db.models import Q
 
-from exdb.models import Experience, ExperienceComment, ExperienceApproval, Subtype, Requirement, Affiliation, Semester, Section
+from exdb.models import Experience, ExperienceComment, ExperienceApproval, Subtype, Requirement, Affiliation, Semester, Section, ExportJob
 from .forms import ExperienceSubmitForm, ExperienceSaveForm, ApprovalForm, ExperienceConclusionForm
+from . import suggest, facets, exports, xlsx, archive
+from .pagination import paginate_keyset, cached_count
+from .experience_search import ExperienceSearch, InvalidSearch, get_experiences
+from .completion import load_summaries, CompletionMatrix, CampusCompletion
 
 
 class CreateExperienceView(CreateView):
@@ -50,26 +55,8 @@ class HomeView(ListView):
     access_level = 'basic'
     context_object_name = 'experiences'
 
-    def get_hs_queryset(self):
-        experience_approvals = ExperienceApproval.objects.filter(
-            approver=self.request.user, experience__status='ad'
-        )
-        next_approver_queue = Q(next_approver=self.request.user) & Q(status='pe')
-        experiences = Experience.objects.filter(
-            next_approver_queue |
-            Q(pk__in=experience_approvals.values('experience'))
-        )
-        return experiences.distinct() | self.get_ra_queryset()
-
-    def get_ra_queryset(self):
-        return Experience.objects.filter((Q(author=self.request.user) | (Q(planners=self.request.user) &
-                                                                         ~Q(status__in=('dr',)))) & ~Q(status='ca')).order_by('created_datetime').distinct()
-
     def get_queryset(self):
-        if self.request.user.is_hallstaff():
-            return self.get_hs_queryset().order_by('start_datetime')
-        else:
-            return self.get_ra_queryset().order_by('start_datetime')
+        return Experience.objects.listed_for(self.request.user).order_by('start_datetime')
 
     def get_context_data(self, *args, **kwargs):
         context = super(HomeView, self).get_context_data(*args, **kwargs)
@@ -85,23 +72,40 @@ class HomeView(ListView):
 
         status_to_display.insert(status_to_display.index(_('Pending Approval')), _('Upcoming'))
 
-        # Grouping of experiences for display
-        experience_dict = OrderedDict()
-        time_ahead = timezone.now()
+        # Each card only needs its first few experiences, so every bucket is a LIMIT query
+        # and all of the counts come from a single aggregate
+        listed = context[self.context_object_name]
+        current_time = timezone.now()
+        time_ahead = current_time
         time_ahead += settings.HALLSTAFF_UPCOMING_TIMEDELTA if self.request.user.is_hallstaff() else settings.RA_UPCOMING_TIMEDELTA
+        counts = listed.dashboard_counts(current_time, time_ahead)
+
+        buckets = OrderedDict([
+            (_('Needs Evaluation'), ('needs_evaluation', listed.filter(status='ad', end_datetime__lte=current_time))),
+            (_('Upcoming'), ('upcoming', listed.filter(status='ad', start_datetime__gt=current_time, start_datetime__lt=time_ahead))),
+        ])
+        for status, label, _slug in Experience.STATUS_TYPES:
+            buckets[label] = (status, listed.filter(status=status))
+
+        experience_dict = OrderedDict()
+        experience_counts = OrderedDict()
         for status in status_to_display:
-            experience_dict[status] = []
-        for experience in context[self.context_object_name]:
-            if experience.needs_evaluation() and len(experience_dict[_('Needs Evaluation')]) < experiences_shown:
-                experience_dict[_('Needs Evaluation')].append(experience)
-            else:
-                if (experience.get_status_display() in experience_dict) and (
-                        len(experience_dict[experience.get_status_display()]) < experiences_shown):
-                    experience_dict[experience.get_status_display()].append(experience)
-            if experience.status == 'ad' and experience.start_datetime > timezone.now() and experience.start_datetime < time_ahead\
-                    and len(experience_dict[_('Upcoming')]) < experiences_shown and (experience not in experience_dict[_('Upcoming')]):
-                experience_dict[_('Upcoming')].append(experience)
+            bucket, queryset = buckets[status]
+            if status == _('Approved'):
+                # Approved experiences already shown as needing evaluation are not repeated
+                queryset = queryset.exclude(pk__in=[e.pk for e in experience_dict[_('Needs Evaluation')]])
+            experience_dict[status] = list(queryset[:experiences_shown]) if counts[bucket] else []
+            experience_counts[status] = counts[bucket]
+
+        Experience.attach_urls(
+            [e for experiences in experience_dict.values() for e in experiences],
+            self.request.user,
+        )
         context['experience_dict'] = experience_dict
+        context['experience_cards'] = [
+            (status, experience_dict[status], experience_counts[status]) for status in experience_dict
+        ]
+        context['experience_total'] = sum(counts[status] for status, _label, _slug in Experience.STATUS_TYPES)
 
         return context
 
@@ -247,47 +251,15 @@ class ListExperienceByStatusView(ListView):
     status_code = ''
 
     def needs_eval_queryset(self):
-        experience_approvals = ExperienceApproval.objects.filter(
-            approver=self.request.user, experience__status='ad'
-        )
-        Qs = Q(end_datetime__lt=timezone.now()) & Q(status='ad')
-        user_Qs = Q(author=self.request.user) | Q(planners=self.request.user)
-        Qs = Qs & user_Qs
-        if self.request.user.is_hallstaff():
-            hallstaff_Qs = Q(
-                pk__in=experience_approvals.values('experience')) & Q(
-                end_datetime__lt=timezone.now(), status="ad")
-            Qs = Qs | hallstaff_Qs
-        return Experience.objects.filter(Qs).distinct().order_by('start_datetime')
+        return Experience.objects.needing_evaluation_by(self.request.user).order_by('start_datetime')
 
     def upcoming_queryset(self):
-        experience_approvals = ExperienceApproval.objects.filter(
-            approver=self.request.user, experience__status='ad'
-        )
         time_ahead = timezone.now()
         time_ahead += settings.HALLSTAFF_UPCOMING_TIMEDELTA if self.request.user.is_hallstaff() else settings.RA_UPCOMING_TIMEDELTA
-        Qs = Q(status='ad') & Q(start_datetime__gt=timezone.now()) & Q(start_datetime__lt=time_ahead)
-        user_Qs = (
-            Q(author=self.request.user) |
-            Q(planners=self.request.user) |
-            Q(pk__in=experience_approvals.values('experience'))
-        )
-        if self.request.user.is_hallstaff():
-            user_Qs = user_Qs | Q(recognition__affiliation=self.request.user.affiliation)
-        Qs = Qs & user_Qs
-        return Experience.objects.filter(Qs).distinct().order_by('start_datetime')
+        return Experience.objects.upcoming_for(self.request.user, time_ahead).order_by('start_datetime')
 
     def status_queryset(self):
-        Qs = Q(author=self.request.user) | (Q(planners=self.request.user)
-                                            & ~Q(status='dr')) | Q(next_approver=self.request.user, status='pe')
-        Qs = Qs & Q(status=self.status)
-        if self.request.user.is_hallstaff() and self.status == 'ad':
-            experience_approvals = ExperienceApproval.objects.filter(
-                approver=self.request.user, experience__status='ad'
-            )
-            Qs |= Q(pk__in=experience_approvals.values('experience'))
-
-        return Experience.objects.filter(Qs).distinct().order_by('start_datetime')
+        return Experience.objects.visible_to(self.request.user).filter(status=self.status).order_by('start_datetime')
 
     def get_queryset(self):
         if not self.readable_status:
@@ -306,69 +278,137 @@ class ListExperienceByStatusView(ListView):
 
     def get_context_data(self, *args, **kwargs):
         context = super(ListExperienceByStatusView, self).get_context_data()
+        try:
+            page = paginate_keyset(self.object_list, self.request.GET.get('cursor'), settings.EXPERIENCE_LIST_PAGE_SIZE)
+        except ValueError as e:
+            raise Http404(str(e))
+        context['page'] = page
+        context['experiences'] = Experience.attach_urls(page.object_list, self.request.user)
+        if settings.EXPERIENCE_LIST_COUNT_TIMEOUT is not None:
+            key = 'exdb:list-count:%s:%s' % (self.request.user.pk, slugify(self.readable_status))
+            context['total'] = cached_count(self.object_list, key, settings.EXPERIENCE_LIST_COUNT_TIMEOUT)
         context['status'] = self.readable_status
         return context
 
 
-class SearchExperienceResultsView(ListView):
+class ExperienceSearchMixin(object):
+    """Runs the search described by the query string: terms, qualifiers, facets and fuzzy mode"""
+
+    def search(self):
+        """
+        Run the search of the request. Sets self.matched to the matching
+        experiences and returns them annotated with their score.
+        """
+        try:
+            experience_search = ExperienceSearch(self.request.GET, self.request.user)
+        except ValueError as e:
+            raise Http404(str(e))
+        ranked = experience_search.run()
+        self.selected_facets = experience_search.selected_facets
+        self.qualifiers = experience_search.qualifiers
+        self.search_error = experience_search.search_error
+        self.fuzzy = experience_search.fuzzy
+        self.matched = experience_search.matched
+        return ranked
+
+
+class SearchExperienceResultsView(ExperienceSearchMixin, ListView):
     access_level = 'basic'
     context_object_name = 'experiences'
     template_name = 'exdb/search.html'
     model = Experience
+    # Best matches first, then the most recent
+    ranking_keys = ('score', 'start_datetime', 'pk')
 
     def get_queryset(self):
-        tokens = self.request.GET.get('search', '').split()
-        if not tokens:
-            return Experience.objects.none()
-
-        search_fields = [
-            'name',
-            'description',
-            'goals',
-            'guest',
-            'guest_office',
-            'conclusion',
-            'keywords__name',
-            'recognition__name',
-            'recognition__affiliation__name',
-            'planners__first_name',
-            'planners__last_name',
-            'author__first_name',
-            'author__last_name',
-            'type__name',
-            'subtypes__name',
-        ]
-
-        filter_Qs = Q()
-        for token in tokens:
-            or_Qs = Q()
-            for field in search_fields:
-                or_Qs |= Q(**{field + '__icontains': token})
-            filter_Qs &= or_Qs
-        # This will look something like:
-        # WHERE
-        #     (column_1 ILIKE '%token_1%' OR column_2 ILIKE '%token_1%')
-        # AND (column_1 ILIKE '%token_2%' OR column_2 ILIKE '%token_2%')
-        # AND (column_1 ILIKE '%token_3%' OR column_2 ILIKE '%token_3%')
-        queryset = Experience.objects.filter(filter_Qs).exclude(status='ca')
-
-        # get rid of a users drafts for everyone else
-        queryset = queryset.exclude(~Q(author=self.request.user), status='dr')
-
-        return queryset.select_related('type').prefetch_related(
+        return self.search().select_related('type').prefetch_related(
             'planners',
             'keywords',
             'recognition__affiliation',
             'subtypes',
-        ).distinct()
+        )
+
+    def facet_url(self, name, value):
+        """The url of the current search with the facet selected, or cleared when value is None"""
+        params = self.request.GET.copy()
+        params.pop('cursor', None)
+        if value is None:
+            params.pop(name, None)
+        else:
+            params[name] = value
+        return '?' + params.urlencode()
+
+    def get_facets(self):
+        counts = facets.count_facets(self.matched)
+        result = []
+        for name, title in facets.FACETS.items():
+            selected = self.selected_facets.get(name)
+            options = [{
+                'label': label,
+                'count': count,
+                'selected': value == selected,
+                'url': self.facet_url(name, None if value == selected else value),
+            } for value, label, count in counts[name]]
+            if options:
+                result.append((title, options))
+        return result
 
     def get_context_data(self, *args, **kwargs):
         context = super(SearchExperienceResultsView, self).get_context_data(*args, **kwargs)
+        try:
+            page = paginate_keyset(self.object_list, self.request.GET.get('cursor'), settings.SEARCH_PAGE_SIZE,
+                                   keys=self.ranking_keys, descending=True)
+        except ValueError as e:
+            raise Http404(str(e))
+        context['page'] = page
+        context['experiences'] = Experience.attach_urls(page.object_list, self.request.user)
         context['search_query'] = self.request.GET.get('search', '')
+        context['fuzzy'] = self.fuzzy
+        context['search_error'] = self.search_error
+        context['fuzzy_url'] = self.facet_url('fuzzy', '1')
+        context['facets'] = self.get_facets()
+        context['next_page_url'] = page.has_next and self.facet_url('cursor', page.next_cursor)
+        context['first_page_url'] = self.facet_url('cursor', None)
+        context['export_query'] = self.facet_url('cursor', None)[1:]
         return context
 
 
-class CompletionBoardView(TemplateView):
+class SearchSuggestView(View):
+    access_level = 'basic'
+    max_suggestions = 20
+
+    def get(self, *args, **kwargs):
+        kind = self.request.GET.get('kind')
+        if kind is not None and kind not in suggest.KINDS:
+            raise Http404('Unknown suggestion kind')
+        try:
+            limit = int(self.request.GET.get('limit', 10))
+        except ValueError:
+            raise Http404('Invalid limit')
+        if limit < 1:
+            raise Http404('Invalid limit')
+        limit = min(limit, self.max_suggestions)
+        return JsonResponse({'suggestions': suggest.suggest(self.request.GET.get('q', ''), limit, kind)})
+
+
+class CompletionExportMixin(object):
+    """Renders the completion matrix of the context as CSV or JSON when asked for with ?format="""
+    export_filename = 'completion'
+
+    def render_to_response(self, context, **response_kwargs):
+        export_format = self.request.GET.get('format')
+        matrix = context['matrix']
+        if export_format == 'json':
+            return JsonResponse(matrix.to_dict())
+        if export_format == 'csv':
+            response = HttpResponse(content_type="text/csv")
+            response['Content-Disposition'] = 'attachment; filename="%s.csv"' % self.export_filename
+            csv.writer(response).writerows(matrix.get_csv_rows())
+            return response
+        return super(CompletionExportMixin, self).render_to_response(context, **response_kwargs)
+
+
+class CompletionBoardView(CompletionExportMixin, TemplateView):
     access_level = 'basic'
     template_name = 'exdb/completion_board.html'
 
@@ -391,30 +431,55 @@ class CompletionBoardView(TemplateView):
         if semester is None:
             raise Http404('No Semester objects found')
 
-        prefetch = Prefetch(
-            'experience_set',
-            queryset=Experience.objects.filter(
-                start_datetime__lte=semester.end_datetime,
-                end_datetime__gte=semester.start_datetime,
-                status='co'))
-
-        sections = affiliation.section_set.prefetch_related(prefetch, 'experience_set__subtypes')
+        sections = list(affiliation.section_set.all())
 
         if not sections:
             raise Http404('No Section objects found')
 
-        for section in sections:
-            section.cache_requirements(semester)
+        load_summaries(sections, semester)
 
         context['sections'] = sections
         context['requirements'] = sections[0].requirement_dict
+        context['matrix'] = CompletionMatrix(sections, sections[0].requirement_dict)
         context['affiliations'] = Affiliation.objects.all()
         context['current_affiliation'] = affiliation.pk
 
         return context
 
 
-class SectionCompletionBoardView(TemplateView):
+class CampusCompletionBoardView(CompletionExportMixin, TemplateView):
+    access_level = 'basic'
+    template_name = 'exdb/campus_completion_board.html'
+    export_filename = 'campus_completion'
+
+    def get_context_data(self, **kwargs):
+        context = super(CampusCompletionBoardView, self).get_context_data(**kwargs)
+
+        if not self.request.user.is_hallstaff():
+            raise Http404('User does not have access to the campus completion board')
+
+        semester = Semester.get_current()
+        if semester is None:
+            raise Http404('No Semester objects found')
+
+        context['matrix'] = CampusCompletion(semester)
+        return context
+
+
+class SemesterArchiveView(View):
+    """Streams the zip archive of a semester to hall staff"""
+    access_level = 'basic'
+
+    def get(self, *args, **kwargs):
+        if not self.request.user.is_hallstaff():
+            raise Http404('User does not have access to semester archives')
+        semester = get_object_or_404(Semester, pk=self.kwargs['pk'])
+        response = StreamingHttpResponse(archive.iter_archive(semester, self.request.user), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="%s"' % archive.get_filename(semester)
+        return response
+
+
+class SectionCompletionBoardView(CompletionExportMixin, TemplateView):
     access_level = 'basic'
     template_name = 'exdb/section_completion_board.html'
 
@@ -425,29 +490,19 @@ class SectionCompletionBoardView(TemplateView):
         if semester is None:
             raise Http404('No Semester objects found')
 
-        prefetch = Prefetch(
-            'experience_set',
-            queryset=Experience.objects.filter(
-                start_datetime__lte=semester.end_datetime,
-                end_datetime__gte=semester.start_datetime,
-                status='co'))
-
         section_pk = self.kwargs.get('pk') or self.request.user.section_id
         if section_pk is not None:
-            section = get_object_or_404(
-                Section.objects.prefetch_related(
-                    prefetch,
-                    'experience_set__subtypes'),
-                pk=section_pk)
+            section = get_object_or_404(Section, pk=section_pk)
         else:
             raise Http404('No Section objects found')
         if section.pk != self.request.user.section_id and not self.request.user.is_hallstaff():
             raise Http404('User does not have access to completion boards other than their own')
 
-        section.cache_requirements(semester)
+        load_summaries([section], semester, with_experiences=True)
 
         context['requirements'] = section.requirement_dict
         context['sections'] = [section]
+        context['matrix'] = CompletionMatrix([section], section.requirement_dict)
 
         return context
 
@@ -463,37 +518,79 @@ class ViewRequirementView(TemplateView):
 
 
 class SearchExperienceReport(View):
+    """
+    Exports experiences as csv, or xlsx with format=xlsx. A GET exports every
+    result of the search in its query string, narrowed by the column filters of
+    the results table. A POST exports the hand picked experiences listed in its
+    experiences field.
+    """
     access_level = 'basic'
-    keys = [
-        'name', 'status', 'author', 'planners', 'recognition', 'start_datetime',
-        'end_datetime', 'type', 'subtypes', 'description', 'goals', 'keywords',
-        'audience', 'guest', 'guest_office', 'attendance', 'created_datetime',
-        'next_approver', 'funds', 'conclusion',
-    ]
+    keys = exports.EXPERIENCE_KEYS
 
     def get(self, *args, **kwargs):
-        if not self.request.GET.get('experiences'):
+        try:
+            experiences = get_experiences(self.request.GET, self.request.user)
+        except InvalidSearch as e:
+            raise Http404(str(e))
+        return self.export(experiences)
+
+    def post(self, *args, **kwargs):
+        try:
+            pks = [int(pk) for pk in json.loads(self.request.POST.get('experiences', '[]'))]
+        except (TypeError, ValueError):
             raise Http404
-        pks = json.loads(self.request.GET.get('experiences'))
-        if not pks:
+        if not pks or len(pks) > settings.EXPORT_MAX_SELECTED:
             raise Http404
-        experiences = Experience.objects.filter(pk__in=pks).prefetch_related(
-            'planners',
-            'recognition',
-            'subtypes',
-            'keywords',
-        )
         # Filter out canceled experiences and drafts not authored by the current user.
-        experiences = experiences.exclude(status='ca')
+        experiences = Experience.objects.filter(pk__in=pks).exclude(status='ca')
         experiences = experiences.exclude(~Q(author=self.request.user), status='dr')
-
-        response = HttpResponse(content_type="text/csv")
+        return self.export(experiences)
+
+    def export(self, experiences):
+        """Stream experiences as csv, or as xlsx when asked for with format=xlsx"""
+        if self.request.GET.get('format', self.request.POST.get('format')) == 'xlsx':
+            header, rows = exports.TypedRowSerializer(self.keys).spread(experiences)
+            response = StreamingHttpResponse(xlsx.iter_xlsx(header, rows, 'Experiences'),
+                                             content_type=xlsx.CONTENT_TYPE)
+            response['Content-Disposition'] = 'attachment; filename="experiences.xlsx"'
+            return response
+        response = StreamingHttpResponse(exports.iter_csv(self.keys, exports.iter_rows(experiences, self.keys)),
+                                         content_type="text/csv")
         response['Content-Disposition'] = 'attachment; filename="experiences.csv"'
+        return response
 
-        writer = csv.DictWriter(response, fieldnames=self.keys)
-        writer.writeheader()
 
-        for experience in experiences:
-            writer.writerow(experience.convert_to_dict(self.keys))
+class ExportJobListView(ListView):
+    access_level = 'basic'
+    context_object_name = 'jobs'
+    template_name = 'exdb/export_jobs.html'
 
-        return response
+    def get_queryset(self):
+        return ExportJob.objects.filter(user=self.request.user)
+
+
+class CreateExportJobView(View):
+    """Queue a background export of the search in the query field"""
+    access_level = 'basic'
+
+    def post(self, *args, **kwargs):
+        query = self.request.POST.get('query', '').lstrip('?')
+        if not QueryDict(query).get('search', '').strip():
+            raise Http404
+        try:
+            ExportJob.submit(self.request.user, query)
+        except ValueError as e:
+            messages.error(self.request, str(e))
+        return HttpResponseRedirect(reverse('export_jobs'))
+
+
+class DownloadExportJobView(View):
+    access_level = 'basic'
+
+    def get(self, *args, **kwargs):
+        job = get_object_or_404(ExportJob, pk=self.kwargs['pk'], user=self.request.user, status='do')
+        try:
+            export = open(job.get_path(), 'rb')
+        except (OSError, TypeError):
+            raise Http404('The export has been removed.')
+        return FileResponse(export, as_attachment=True, filename='experiences.csv', content_type='text/csv')
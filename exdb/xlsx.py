@@ -0,0 +1,167 @@
+"""
+A streaming XLSX writer built on the standard library. The worksheet XML is
+written row by row into a zip stream whose compressed bytes are handed out as
+soon as they are produced, so a workbook of any size is written with flat memory
+and starts downloading right away. Strings are written inline, which spares the
+shared strings table that would otherwise have to be held until the end.
+"""
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+from django.utils import timezone
+
+CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Days are counted from this date in the 1900 date system, leap year bug included
+EPOCH = datetime(1899, 12, 30)
+# Style indices of styles.xml
+HEADER_STYLE = 1
+DATETIME_STYLE = 2
+# Rows of worksheet XML compressed before the output stream is drained
+ROWS_PER_FLUSH = 100
+
+# Characters XML 1.0 does not allow, even escaped
+INVALID_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+STATIC_PARTS = [
+    ('[Content_Types].xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+     '<Default Extension="xml" ContentType="application/xml"/>'
+     '<Override PartName="/xl/workbook.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+     '<Override PartName="/xl/worksheets/sheet1.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+     '<Override PartName="/xl/styles.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+     '</Types>'),
+    ('_rels/.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+     'Target="xl/workbook.xml"/>'
+     '</Relationships>'),
+    ('xl/_rels/workbook.xml.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+     'Target="worksheets/sheet1.xml"/>'
+     '<Relationship Id="rId2" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+     'Target="styles.xml"/>'
+     '</Relationships>'),
+    ('xl/styles.xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+     '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm"/></numFmts>'
+     '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+     '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+     '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+     '<fill><patternFill patternType="gray125"/></fill></fills>'
+     '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+     '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+     '<cellXfs count="3">'
+     '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+     '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+     '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+     '</cellXfs>'
+     '</styleSheet>'),
+]
+
+WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="%s" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" state="frozen"/>'
+    '</sheetView></sheetViews>'
+    '<sheetData>'
+)
+SHEET_END = '</sheetData></worksheet>'
+
+
+class StreamOutput(object):
+    """An unseekable file the zip is written to, holding its bytes until they are drained"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def column_letter(index):
+    """The letters of the column at index, counted from 0"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def cell_xml(reference, value, style=0):
+    """A cell holding value, typed after its Python type. None makes an empty cell."""
+    if value is None or value == '':
+        return ''
+    if isinstance(value, bool):
+        return '<c r="%s" t="b"><v>%d</v></c>' % (reference, value)
+    if isinstance(value, (int, float)):
+        return '<c r="%s"><v>%r</v></c>' % (reference, value)
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value)
+        return '<c r="%s" s="%d"><v>%r</v></c>' % (
+            reference, DATETIME_STYLE, (value - EPOCH).total_seconds() / 86400)
+    text = escape(INVALID_XML_RE.sub('', str(value)))
+    return '<c r="%s" t="inlineStr"%s><is><t xml:space="preserve">%s</t></is></c>' % (
+        reference, ' s="%d"' % style if style else '', text)
+
+
+def row_xml(number, values, letters, style=0):
+    return '<row r="%d">%s</row>' % (number, ''.join(
+        cell_xml('%s%d' % (letter, number), value, style) for letter, value in zip(letters, values)))
+
+
+def iter_xlsx(header, rows, sheet_name='Sheet1'):
+    """
+    Yield the bytes of a workbook with a single sheet holding the header and
+    the rows, as they are compressed. Datetimes are written as date cells in
+    the current time zone.
+    """
+    output = StreamOutput()
+    letters = [column_letter(i) for i in range(len(header))]
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in STATIC_PARTS:
+            workbook.writestr(name, content)
+        workbook.writestr('xl/workbook.xml', WORKBOOK_XML % escape(sheet_name, {'"': '&quot;'}))
+        yield output.drain()
+
+        # force_zip64 as the size of the sheet is not known before it is written
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(SHEET_START.encode())
+            sheet.write(row_xml(1, header, letters, HEADER_STYLE).encode())
+            for number, row in enumerate(rows, 2):
+                sheet.write(row_xml(number, row, letters).encode())
+                if number % ROWS_PER_FLUSH == 0:
+                    yield output.drain()
+            sheet.write(SHEET_END.encode())
+    yield output.drain()
@@ -55,6 +55,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'exdb.roles.RoleCache',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -183,6 +184,45 @@ HALLSTAFF_UPCOMING_TIMEDELTA = timezone.timedelta(days=7)
 # For RA users, display the Experiences that are occuring within the next 31 days
 RA_UPCOMING_TIMEDELTA = timezone.timedelta(days=31)
 
+# Seconds a process may go on using data cached in the default cache, like role versions, after
+# another process changed it. The default cache (LocMemCache) is per process, so an invalidation
+# only reaches the process making it and the others catch up once their copy expires. Configure
+# a shared CACHES backend (memcached, redis or the database) for invalidations to reach every
+# process at once.
+PROCESS_CACHE_TIMEOUT = 60
+
+# Number of experiences shown per page on the experience lists
+EXPERIENCE_LIST_PAGE_SIZE = 30
+# Seconds the total of an experience list is cached for, None to not show totals
+EXPERIENCE_LIST_COUNT_TIMEOUT = 60
+# Number of experiences shown per page of search results
+SEARCH_PAGE_SIZE = 50
+# Number of experiences an export reads from the database at once
+EXPORT_CHUNK_SIZE = 500
+# Directory the background exports are written to
+EXPORT_ROOT = os.path.join(BASE_DIR, 'exports')
+# Queued or running background exports a user may have at once
+EXPORT_JOB_LIMIT = 3
+# How long finished background exports are kept for download
+EXPORT_RETENTION_TIMEDELTA = timezone.timedelta(days=7)
+# Background exports still running this long after they started are taken as abandoned by a worker that died
+EXPORT_JOB_TIMEOUT = timezone.timedelta(hours=2)
+# Seconds the export worker waits before looking for new jobs again
+EXPORT_WORKER_SLEEP = 5
+# Most experiences that can be picked by pk for an export, larger exports go through a search
+EXPORT_MAX_SELECTED = 1000
+# Number of searches whose results each process keeps cached
+SEARCH_CACHE_SIZE = 256
+# Searches with more results than this are not cached
+SEARCH_CACHE_MAX_RESULTS = 2000
+# Lowest trigram similarity (0 to 1) of a word fuzzy search corrects a search term to. Lower
+# than the pg_trgm default of 0.3 so that swapped letters in short words ("hosue") are corrected
+FUZZY_SEARCH_THRESHOLD = 0.2
+# Seconds fuzzy search may spend looking up similar words before giving up
+FUZZY_SEARCH_TIME_BUDGET = 0.5
+# Seconds before experience names are reloaded into the search suggestions
+SUGGEST_REFRESH_INTERVAL = 300
+
 # Views that are exempt from the restricted access middleware
 # be scrupulous in adding any exemptions to the middleware
 RESTRICTED_ACCESS_EXEMPTIONS = ['logout', 'login']